@@ -0,0 +1,89 @@
+"""
+UNet evaluations, latency and quality of severity-adaptive SDEdit against a fixed strength on `__assets__/corrupt_images`.
+
+    python -m benchmarks.adaptive_sdedit                                 # tiny random CM pipeline, offline
+    python -m benchmarks.adaptive_sdedit --model-id Anonymous-12/DeCorruptor-CM --resolution 512
+
+Both runs clean every bundled corrupted image from the same seed: once with SDEdit at `--strength` for all images,
+once with a `SeveritySchedule` that picks the strength per image. The JSON report holds the severity and the steps of
+every image, the total number of UNet steps, the latency and the mean PSNR against the matching clean images of both
+runs.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from .components import load_samples
+from .quantization import PIPELINE_DEFAULTS, load_pipeline, psnr
+
+
+def run(pipe, images, call_kwargs, seed):
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    output = pipe(prompt="Clean the image", image=images, output_type="np", **call_kwargs)
+    return output, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_DEFAULTS))
+    parser.add_argument("--model-id", default=None, help="checkpoint to load; a tiny random pipeline if not set")
+    parser.add_argument("--width", type=int, default=32, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--strength", type=float, default=1.0, help="strength of the fixed SDEdit run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    from pipeline.adaptive_sdedit import SeveritySchedule
+
+    torch.set_num_threads(args.threads)
+    call_kwargs = dict(PIPELINE_DEFAULTS[args.pipeline])
+    if args.steps is not None:
+        call_kwargs["num_inference_steps"] = args.steps
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+
+    paths, images, clean = load_samples(args.resolution)
+    pipe = load_pipeline(args)
+    # warm-up
+    run(pipe, images[:1], dict(call_kwargs, sdedit=True, strength=args.strength), args.seed)
+    fixed, fixed_s = run(pipe, images, dict(call_kwargs, sdedit=True, strength=args.strength), args.seed)
+    adaptive, adaptive_s = run(pipe, images, dict(call_kwargs, severity_schedule=SeveritySchedule()), args.seed)
+
+    def mean_psnr(outputs):
+        return float(np.mean([psnr(output, clean[path]) for output, path in zip(outputs, paths) if path in clean]))
+
+    report = json.dumps(
+        {
+            "benchmark": "adaptive_sdedit",
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "config": vars(args),
+            "severity": adaptive.severity,
+            "steps_fixed": fixed.num_inference_steps_used,
+            "steps_adaptive": adaptive.num_inference_steps_used,
+            "unet_steps_fixed": sum(fixed.num_inference_steps_used),
+            "unet_steps_adaptive": sum(adaptive.num_inference_steps_used),
+            "fixed_s": fixed_s,
+            "adaptive_s": adaptive_s,
+            "speedup": fixed_s / adaptive_s,
+            "psnr_vs_clean_fixed": mean_psnr(fixed.images),
+            "psnr_vs_clean_adaptive": mean_psnr(adaptive.images),
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Tiny, randomly initialised pipeline components with the real class layouts and the bundled sample images, for offline
+CPU benchmarks and the tests.
+"""
+
+import glob
+import json
+import os
+import tempfile
+
+import numpy as np
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler, LCMScheduler, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the decorruptor CM conditions its UNet on the product of two 768-dim guidance embeddings
+LCM_TIME_COND_DIM = 768
+
+
+def tiny_tokenizer(max_length: int = 16) -> CLIPTokenizer:
+    """A character-level CLIP tokenizer that needs no download."""
+    directory = tempfile.mkdtemp(prefix="decorruptor_tokenizer_")
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1, "!": 2}
+    for char in "abcdefghijklmnopqrstuvwxyz":
+        vocab[char] = len(vocab)
+        vocab[char + "</w>"] = len(vocab)
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(directory, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(
+        os.path.join(directory, "vocab.json"), os.path.join(directory, "merges.txt"), model_max_length=max_length
+    )
+
+
+def tiny_components(lcm: bool = False, width: int = 32, seed: int = 0) -> dict:
+    """
+    Builds the keyword arguments of either decorruptor pipeline with small random models.
+
+    `width` is the channel count of the first UNet block; the VAE keeps the real 8x down-sampling so that latent shapes
+    match the released checkpoints.
+    """
+    torch.manual_seed(seed)
+    tokenizer = tiny_tokenizer()
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            vocab_size=len(tokenizer),
+            max_position_embeddings=tokenizer.model_max_length,
+            bos_token_id=0,
+            eos_token_id=1,
+            pad_token_id=1,
+        )
+    )
+    unet = UNet2DConditionModel(
+        sample_size=32,
+        in_channels=8,
+        out_channels=4,
+        block_out_channels=(width, width * 2),
+        layers_per_block=1,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=32,
+        attention_head_dim=8,
+        norm_num_groups=8,
+        time_cond_proj_dim=LCM_TIME_COND_DIM if lcm else None,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[8, 8, 16, 16],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 4,
+        up_block_types=["UpDecoderBlock2D"] * 4,
+        latent_channels=4,
+        norm_num_groups=8,
+    )
+    if lcm:
+        scheduler = LCMScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear")
+    else:
+        scheduler = DDIMScheduler(
+            beta_start=0.00085,
+            beta_end=0.012,
+            beta_schedule="scaled_linear",
+            clip_sample=False,
+            set_alpha_to_one=False,
+        )
+    return dict(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+
+
+def tiny_dpm_pipeline(**kwargs):
+    from pipeline.deccoruptor_dpm_pipe import ConsistInstructPix2PixPipeline
+
+    pipe = ConsistInstructPix2PixPipeline(**tiny_components(lcm=False, **kwargs))
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def tiny_lcm_pipeline(**kwargs):
+    from pipeline.deccoruptor_lcm_pipe import IP2PLatentConsistencyModelPipeline
+
+    pipe = IP2PLatentConsistencyModelPipeline(**tiny_components(lcm=True, **kwargs))
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def load_samples(resolution: int):
+    r"""The bundled corrupted images resized to `resolution`, and their clean counterparts as floats in [0, 1]."""
+    from PIL import Image
+
+    paths = sorted(glob.glob(os.path.join(REPO_ROOT, "__assets__", "corrupt_images", "*")))
+    size = (resolution, resolution)
+    images = [Image.open(path).convert("RGB").resize(size) for path in paths]
+    clean = {}
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        matches = glob.glob(os.path.join(REPO_ROOT, "__assets__", "clean_images", stem + ".*"))
+        if matches:
+            clean[path] = np.asarray(Image.open(matches[0]).convert("RGB").resize(size), dtype=np.float32) / 255
+    return paths, images, clean
@@ -0,0 +1,159 @@
+"""
+Skip rate, latency and accuracy impact of the corruption-presence gate on a mix of clean and corrupted inputs.
+
+    python -m benchmarks.corruption_gate                                 # tiny random CM pipeline, offline
+    python -m benchmarks.corruption_gate --gate corruption_gate.pt --model-id Anonymous-12/DeCorruptor-CM \
+        --resolution 256 --classifier resnet50 --pretrained
+
+The workload is every image of `__assets__/clean_images` (clean) and `__assets__/corrupt_images` (corrupted), cleaned
+once by the pipeline alone and once with the gate enabled. Without `--gate`, a gate is trained on the bundled clean
+images with `training_code/train_corruption_gate.py`'s data generator first. The JSON report holds the skip rate
+over all, clean and corrupted inputs, the latency of both runs, the PSNR of the outputs against the clean images and,
+as accuracy, how often a classifier's top-1 prediction on an output matches its prediction on the clean image.
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from .components import load_samples
+from .quantization import PIPELINE_DEFAULTS, REPO_ROOT, load_pipeline, psnr
+
+
+def train_gate(resolution, seed):
+    sys.path.insert(0, os.path.join(REPO_ROOT, "training_code"))
+    trainer = importlib.import_module("train_corruption_gate")
+    from pipeline.corruption_gate import CorruptionGate
+
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    clean_paths = trainer.list_images(os.path.join(REPO_ROOT, "__assets__", "clean_images"))
+    mixing_sets = [trainer.list_images(directory) for directory in trainer.DEFAULT_MIXING_DIRS]
+    features, labels = trainer.build_dataset(clean_paths, mixing_sets, resolution, 4, 85)
+    gate = CorruptionGate(hidden_size=0)
+    gate.fit(features, labels)
+    with torch.no_grad():
+        gate.calibrate(gate.score_features(features), labels, 0.95)
+    return gate
+
+
+def run(pipe, images, call_kwargs, seed):
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    output = pipe(prompt="Clean the image", image=images, output_type="np", **call_kwargs)
+    return output, time.perf_counter() - start
+
+
+def top1(classifier, images, size):
+    from pipeline.classifier_output import ClassifierTransform
+
+    batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).float() * 2 - 1
+    with torch.no_grad():
+        return classifier(ClassifierTransform(size=size)(batch)).argmax(dim=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_DEFAULTS))
+    parser.add_argument("--model-id", default=None, help="checkpoint to load; a tiny random pipeline if not set")
+    parser.add_argument("--width", type=int, default=32, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--gate", default=None, help="a gate saved by training_code/train_corruption_gate.py")
+    parser.add_argument("--threshold", type=float, default=None, help="overrides the gate's operating point")
+    parser.add_argument("--classifier", default="resnet18", help="torchvision classifier for the accuracy check")
+    parser.add_argument("--pretrained", action="store_true", help="load the classifier's default weights")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    import torchvision
+    from PIL import Image
+
+    from pipeline.corruption_gate import CorruptionGate
+
+    torch.set_num_threads(args.threads)
+    call_kwargs = dict(PIPELINE_DEFAULTS[args.pipeline])
+    if args.steps is not None:
+        call_kwargs["num_inference_steps"] = args.steps
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+
+    paths, corrupted_images, clean = load_samples(args.resolution)
+    clean_paths = sorted(glob.glob(os.path.join(REPO_ROOT, "__assets__", "clean_images", "*")))
+    size = (args.resolution, args.resolution)
+    clean_images = [Image.open(path).convert("RGB").resize(size) for path in clean_paths]
+    references = [np.asarray(image, dtype=np.float32) / 255 for image in clean_images]
+    references += [clean[path] for path in paths]
+    images = clean_images + corrupted_images
+    labels = [False] * len(clean_images) + [True] * len(corrupted_images)
+
+    gate = CorruptionGate.load(args.gate) if args.gate else train_gate(args.resolution, args.seed)
+    pipe = load_pipeline(args)
+    # warm-up
+    run(pipe, images[:1], call_kwargs, args.seed)
+    ungated, ungated_s = run(pipe, images, call_kwargs, args.seed)
+    pipe.enable_corruption_gate(gate, threshold=args.threshold)
+    gated, gated_s = run(pipe, images, call_kwargs, args.seed)
+
+    skipped = [not flag for flag in gated.corruption_detected]
+    clean_skipped = [skip for skip, label in zip(skipped, labels) if not label]
+    corrupted_skipped = [skip for skip, label in zip(skipped, labels) if label]
+
+    classifier = getattr(torchvision.models, args.classifier)(weights="DEFAULT" if args.pretrained else None).eval()
+    reference_top1 = top1(classifier, references, 224)
+    ungated_top1 = top1(classifier, list(ungated.images), 224)
+    gated_top1 = top1(classifier, list(gated.images), 224)
+
+    def accuracy(predictions, subset=None):
+        matches = (predictions == reference_top1).tolist()
+        if subset is not None:
+            matches = [match for match, label in zip(matches, labels) if label == subset]
+        return float(np.mean(matches))
+
+    def mean_psnr(outputs, subset=None):
+        values = [psnr(output, reference) for output, reference, label in zip(outputs, references, labels)]
+        values = [value for value, label in zip(values, labels) if subset is None or label == subset]
+        return float(np.mean([value for value in values if np.isfinite(value)] or [float("inf")]))
+
+    report = json.dumps(
+        {
+            "benchmark": "corruption_gate",
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "config": vars(args),
+            "threshold": gate.threshold if args.threshold is None else args.threshold,
+            "skip_rate": float(np.mean(skipped)),
+            "clean_skip_rate": float(np.mean(clean_skipped)),
+            "corrupted_skip_rate": float(np.mean(corrupted_skipped)),
+            "ungated_s": ungated_s,
+            "gated_s": gated_s,
+            "speedup": ungated_s / gated_s,
+            "top1_agreement_ungated": accuracy(ungated_top1),
+            "top1_agreement_gated": accuracy(gated_top1),
+            "top1_agreement_ungated_corrupted": accuracy(ungated_top1, True),
+            "top1_agreement_gated_corrupted": accuracy(gated_top1, True),
+            "top1_agreement_ungated_clean": accuracy(ungated_top1, False),
+            "top1_agreement_gated_clean": accuracy(gated_top1, False),
+            "psnr_vs_clean_ungated": mean_psnr(ungated.images),
+            "psnr_vs_clean_gated": mean_psnr(gated.images),
+            "gate_stats": pipe.corruption_gate_stats,
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Output drift and latency of the CPU bfloat16 + channels_last profile against the fp32 pipeline on
+`__assets__/corrupt_images`.
+
+    python -m benchmarks.cpu_bf16                                        # tiny random CM pipeline, offline
+    python -m benchmarks.cpu_bf16 --model-id Anonymous-12/DeCorruptor-CM --resolution 512 --min-psnr 30
+
+One pipeline cleans every bundled corrupted image from the same seed with the profile disabled and enabled. The JSON
+report holds, per image and on average, the PSNR and maximum absolute difference of the bf16 output against the fp32
+output, the PSNR of both against the matching image in `__assets__/clean_images`, and the median latency of both. With
+`--min-psnr` the script exits with status 1 when the mean bf16-vs-fp32 PSNR falls below the threshold, so it can gate
+the profile on a new checkpoint or CPU.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from .components import load_samples
+from .quantization import PIPELINE_DEFAULTS, REPO_ROOT, load_pipeline, psnr, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_DEFAULTS))
+    parser.add_argument("--model-id", default=None, help="checkpoint to load; a tiny random pipeline if not set")
+    parser.add_argument("--width", type=int, default=64, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--no-channels-last", action="store_true")
+    parser.add_argument("--min-psnr", type=float, default=None, help="fail if the mean bf16-vs-fp32 PSNR is lower")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    call_kwargs = dict(PIPELINE_DEFAULTS[args.pipeline])
+    if args.steps is not None:
+        call_kwargs["num_inference_steps"] = args.steps
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+
+    paths, images, clean = load_samples(args.resolution)
+    pipe = load_pipeline(args)
+
+    # warm-up
+    run(pipe, images[:1], call_kwargs, args.seed)
+    fp32_outputs, fp32_latencies = run(pipe, images, call_kwargs, args.seed)
+    pipe.enable_cpu_bf16(channels_last=not args.no_channels_last)
+    run(pipe, images[:1], call_kwargs, args.seed)
+    bf16_outputs, bf16_latencies = run(pipe, images, call_kwargs, args.seed)
+
+    per_image = []
+    for path, reference, output in zip(paths, fp32_outputs, bf16_outputs):
+        entry = {
+            "image": os.path.relpath(path, REPO_ROOT),
+            "psnr_bf16_vs_fp32": psnr(output, reference),
+            "max_abs_diff": float(np.abs(output - reference).max()),
+        }
+        if path in clean:
+            entry["psnr_fp32_vs_clean"] = psnr(reference, clean[path])
+            entry["psnr_bf16_vs_clean"] = psnr(output, clean[path])
+        per_image.append(entry)
+
+    def mean(key):
+        values = [entry[key] for entry in per_image if key in entry and np.isfinite(entry[key])]
+        return float(np.mean(values)) if values else None
+
+    fp32_latency = float(np.median(fp32_latencies))
+    bf16_latency = float(np.median(bf16_latencies))
+    mean_drift = mean("psnr_bf16_vs_fp32")
+    passed = args.min_psnr is None or mean_drift is None or mean_drift >= args.min_psnr
+    report = json.dumps(
+        {
+            "benchmark": "cpu_bf16",
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "native_bf16": torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported(),
+            "config": vars(args),
+            "fp32_latency_s": fp32_latency,
+            "bf16_latency_s": bf16_latency,
+            "speedup": fp32_latency / bf16_latency,
+            "mean_psnr_bf16_vs_fp32": mean_drift,
+            "max_abs_diff": max(entry["max_abs_diff"] for entry in per_image),
+            "mean_psnr_fp32_vs_clean": mean("psnr_fp32_vs_clean"),
+            "mean_psnr_bf16_vs_clean": mean("psnr_bf16_vs_clean"),
+            "passed": passed,
+            "images": per_image,
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Cold-start import time of the decorruptor pipelines, with a time budget and a list of modules that must stay unloaded.
+
+    python -m benchmarks.import_time --output import_time.json
+
+Every target is imported in a fresh interpreter. The command exits with status 1 when the median import time of a
+target exceeds `--budget-s` (8 s by default) or when it loads one of the `--forbid` modules, so it can gate CI;
+`tests/test_import_time.py` runs the same check.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_TARGETS = [
+    "from pipeline.deccoruptor_dpm_pipe import ConsistInstructPix2PixPipeline",
+    "from pipeline.deccoruptor_lcm_pipe import IP2PLatentConsistencyModelPipeline",
+    "from pipeline import IP2PLatentConsistencyModelPipeline",
+]
+# only needed by optional paths (aesthetic guidance, video demo); never by the image pipelines
+DEFAULT_FORBIDDEN = ["timm", "torchvision", "tomesd", "kornia", "cv2", "decord", "imageio"]
+# median seconds per target; a cold CPU host imports torch and diffusers in about 5 s
+DEFAULT_BUDGET_S = 8.0
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(m for m in {forbidden!r} if m in sys.modules)}}))
+"""
+
+
+def measure(statement, forbidden, repeats):
+    """Imports `statement` in `repeats` fresh interpreters and returns the median time and the forbidden modules."""
+    timings, loaded = [], set()
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(statement=statement, forbidden=forbidden)],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(probe["seconds"])
+        loaded.update(probe["modules"])
+    return sorted(timings)[len(timings) // 2], sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS, help="Import statements to time.")
+    parser.add_argument("--forbid", nargs="*", default=DEFAULT_FORBIDDEN)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--budget-s", type=float, default=DEFAULT_BUDGET_S, help="Maximum median import time per target; 0 for none."
+    )
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args()
+
+    results, failed = [], False
+    for statement in args.targets:
+        seconds, loaded = measure(statement, args.forbid, args.repeats)
+        over_budget = args.budget_s > 0 and seconds > args.budget_s
+        failed = failed or over_budget or len(loaded) > 0
+        results.append(
+            {"target": statement, "seconds": seconds, "forbidden_loaded": loaded, "over_budget": over_budget}
+        )
+
+    report = {"benchmark": "import_time", "budget_s": args.budget_s, "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Eager vs. `torch.compile`d LCM denoising step on tiny random components.
+
+    python -m benchmarks.lcm_compiled_step --batch-sizes 1 4 --resolution 256 --output lcm_compiled_step.json
+"""
+
+import argparse
+import json
+import time
+
+import torch
+
+from .components import tiny_lcm_pipeline
+
+
+def _run(pipe, image, steps, seed):
+    torch.manual_seed(seed)
+    return pipe(
+        prompt="clean the image",
+        image=image,
+        num_inference_steps=steps,
+        image_guidance_scale=1.1,
+        guidance_scale=7.5,
+        output_type="latent",
+    ).images
+
+
+def _latency(pipe, image, steps, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _run(pipe, image, steps, seed=0)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def benchmark(batch_sizes, resolution, steps, repeats, compile_kwargs):
+    pipe = tiny_lcm_pipeline()
+    results = []
+    for batch_size in batch_sizes:
+        image = torch.rand(batch_size, 3, resolution, resolution)
+
+        pipe.disable_compiled_step()
+        reference = _run(pipe, image, steps, seed=0)
+        eager = _latency(pipe, image, steps, repeats)
+
+        compiled_step = pipe.enable_compiled_step(**compile_kwargs)
+        start = time.perf_counter()
+        output = _run(pipe, image, steps, seed=0)
+        first_call = time.perf_counter() - start
+        compiled = _latency(pipe, image, steps, repeats)
+
+        results.append(
+            {
+                "batch_size": batch_size,
+                "resolution": resolution,
+                "steps": steps,
+                "eager_s": eager,
+                "compiled_first_call_s": first_call,
+                "compiled_s": compiled,
+                "speedup": eager / compiled,
+                "max_abs_diff": (reference - output).abs().max().item(),
+                "compiled_calls": compiled_step.compiled_calls,
+                "eager_fallback_calls": compiled_step.eager_calls,
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--mode", default=None, help="`torch.compile` mode, e.g. `max-autotune`.")
+    parser.add_argument("--backend", default="inductor")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args()
+
+    compile_kwargs = {"backend": args.backend}
+    if args.mode is not None:
+        compile_kwargs["mode"] = args.mode
+    report = {
+        "benchmark": "lcm_compiled_step",
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "results": benchmark(args.batch_sizes, args.resolution, args.steps, args.repeats, compile_kwargs),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Cold-start load time of `from_pretrained` against the memory-mapped `from_mmap_pretrained`.
+
+    python -m benchmarks.load_time --width 128 --dtype float16
+    python -m benchmarks.load_time --path /models/decorruptor-cm-fp16 --pipeline lcm
+
+Without `--path`, a tiny random pipeline of the given UNet `--width` is saved with `save_mmap_pretrained` to a
+temporary directory first. Every loader runs in its own interpreter, after the imports, so the JSON report holds the
+load time alone together with the resident memory after loading and the `LoadReport` of the mmap loader. The files are
+read once beforehand, so both loaders see a warm page cache.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PIPELINE_CLASSES = {
+    "dpm": ("pipeline.deccoruptor_dpm_pipe", "ConsistInstructPix2PixPipeline"),
+    "lcm": ("pipeline.deccoruptor_lcm_pipe", "IP2PLatentConsistencyModelPipeline"),
+}
+
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def run_loader(loader, pipeline, path, dtype):
+    """Loads the pipeline in the current process and returns the measurements."""
+    import importlib
+
+    module, class_name = PIPELINE_CLASSES[pipeline]
+    cls = getattr(importlib.import_module(module), class_name)
+    torch_dtype = getattr(torch, dtype)
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    if loader == "from_pretrained":
+        pipe = cls.from_pretrained(path, torch_dtype=torch_dtype, safety_checker=None)
+    else:
+        pipe = cls.from_mmap_pretrained(path, torch_dtype=torch_dtype, safety_checker=None)
+    seconds = time.perf_counter() - start
+    result = {"loader": loader, "load_s": seconds, "rss_increase_bytes": _rss_bytes() - rss_before}
+    if loader == "from_mmap_pretrained":
+        result["load_report"] = pipe.load_report._asdict()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_CLASSES))
+    parser.add_argument("--path", default=None, help="a pipeline directory saved with safetensors")
+    parser.add_argument("--width", type=int, default=128, help="UNet width of the generated tiny pipeline")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "bfloat16", "float32"])
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    parser.add_argument("--single", nargs=2, metavar=("LOADER", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_loader(args.single[0], args.pipeline, args.single[1], args.dtype)))
+        return
+
+    path = args.path
+    if path is None:
+        from .components import tiny_dpm_pipeline, tiny_lcm_pipeline
+
+        path = os.path.join(tempfile.mkdtemp(prefix="decorruptor_load_"), args.pipeline)
+        pipe = (tiny_lcm_pipeline if args.pipeline == "lcm" else tiny_dpm_pipeline)(width=args.width)
+        pipe.save_mmap_pretrained(path, dtype=getattr(torch, args.dtype))
+
+    # warm the page cache so that both loaders read from memory
+    for root, _, files in os.walk(path):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                while f.read(1 << 24):
+                    pass
+
+    results = []
+    for loader in ("from_pretrained", "from_mmap_pretrained"):
+        command = [sys.executable, "-m", "benchmarks.load_time", "--pipeline", args.pipeline, "--dtype", args.dtype]
+        command += ["--single", loader, path]
+        completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = json.dumps(
+        {
+            "benchmark": "load_time",
+            "torch": torch.__version__,
+            "pipeline": args.pipeline,
+            "path": path,
+            "dtype": args.dtype,
+            "results": results,
+            "speedup": results[0]["load_s"] / results[1]["load_s"],
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
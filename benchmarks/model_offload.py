@@ -0,0 +1,94 @@
+"""
+Device residency and latency of sequential model offload against a fully resident pipeline on
+`__assets__/corrupt_images`.
+
+    python -m benchmarks.model_offload                                   # tiny random CM pipeline, offline
+    python -m benchmarks.model_offload --model-id Anonymous-12/DeCorruptor-CM --device cuda --memory-budget 2.5e9
+
+The same images are cleaned from the same seed with every component resident, with offload but without prefetch, and
+with offload and prefetch. The JSON report holds the latency of every run, the bytes of weights every stage needs,
+the largest residency an offloaded call reached against the total weights, the per-stage residency of the last call,
+and the maximum absolute output difference to the resident run. On a CPU-only host the compute device is the host, so
+only the residency accounting and its overhead are measured.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+
+from .components import load_samples
+from .quantization import PIPELINE_DEFAULTS, load_pipeline
+
+
+def run(pipe, images, call_kwargs, seed, repeats):
+    latencies = []
+    for _ in range(repeats):
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        output = pipe(prompt="Clean the image", image=images, output_type="np", **call_kwargs)
+        latencies.append(time.perf_counter() - start)
+    return output.images, float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_DEFAULTS))
+    parser.add_argument("--model-id", default=None, help="checkpoint to load; a tiny random pipeline if not set")
+    parser.add_argument("--width", type=int, default=32, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--memory-budget", type=float, default=None, help="bytes of weights allowed on the device")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    call_kwargs = dict(PIPELINE_DEFAULTS[args.pipeline])
+    if args.steps is not None:
+        call_kwargs["num_inference_steps"] = args.steps
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget)
+
+    _, images, _ = load_samples(args.resolution)
+    pipe = load_pipeline(args).to(args.device)
+    # warm-up
+    run(pipe, images[:1], call_kwargs, args.seed, 1)
+    resident, resident_s = run(pipe, images, call_kwargs, args.seed, args.repeats)
+
+    report = {
+        "benchmark": "model_offload",
+        "torch": torch.__version__,
+        "threads": args.threads,
+        "config": vars(args),
+        "resident_s": resident_s,
+    }
+    for prefetch in (False, True):
+        offloader = pipe.enable_model_offload(args.device, memory_budget=memory_budget, prefetch=prefetch)
+        run(pipe, images[:1], call_kwargs, args.seed, 1)
+        offloaded, offloaded_s = run(pipe, images, call_kwargs, args.seed, args.repeats)
+        key = "prefetch" if prefetch else "no_prefetch"
+        report[f"{key}_s"] = offloaded_s
+        report[f"{key}_max_abs_diff"] = float(np.abs(offloaded - resident).max())
+        report[f"{key}_wait_s"] = sum(entry.wait_seconds for entry in pipe.offload_report)
+        report[f"{key}_peak_resident_bytes"] = max(entry.resident_bytes for entry in pipe.offload_report)
+        report[f"{key}_stages"] = [entry._asdict() for entry in pipe.offload_report]
+        report["stage_bytes"] = {name: stage.bytes for name, stage in offloader.stages.items()}
+        pipe.disable_model_offload()
+    report["total_bytes"] = sum(report["stage_bytes"].values())
+
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
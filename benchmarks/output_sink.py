@@ -0,0 +1,123 @@
+"""
+End-to-end throughput of cleaning and saving images with synchronous PIL saves against the asynchronous `OutputSink`.
+
+    python -m benchmarks.output_sink --batches 8 --batch-size 4 --resolution 256
+    python -m benchmarks.output_sink --format jpeg --encode-workers 2 --tar-shard-size 16
+
+Both modes run the same tiny random CM pipeline on the bundled corrupted images. `sync` converts the outputs to PIL
+and saves them one by one before the next batch starts; `sink` hands the decoded `uint8` tensors to an `OutputSink`
+and runs the next batch while they are encoded and written. The JSON report holds, per mode, the end-to-end images per
+second and the time spent in inference and in saving, and for the sink its `SinkStats`.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+from .components import load_samples
+
+
+def run_sync(pipe, batches, call_kwargs, directory, format):
+    inference_s = save_s = 0.0
+    start = time.perf_counter()
+    for index, batch in enumerate(batches):
+        batch_start = time.perf_counter()
+        images = pipe(prompt="Clean the image", image=batch, **call_kwargs).images
+        inference_s += time.perf_counter() - batch_start
+        save_start = time.perf_counter()
+        for position, image in enumerate(images):
+            path = os.path.join(directory, f"{index:06d}-{position}.{'png' if format == 'png' else 'jpg'}")
+            image.save(path, **({"compress_level": 1} if format == "png" else {"quality": 95}))
+        save_s += time.perf_counter() - save_start
+    elapsed = time.perf_counter() - start
+    num_images = sum(len(batch) for batch in batches)
+    return {"images_per_second": num_images / elapsed, "inference_s": inference_s, "save_s": save_s}
+
+
+def run_sink(pipe, batches, call_kwargs, directory, args):
+    from pipeline.output_sink import OutputSink, TarShardWriter
+
+    writer = directory
+    if args.tar_shard_size is not None:
+        writer = TarShardWriter(os.path.join(directory, "shard-%06d.tar"), max_count=args.tar_shard_size)
+    sink = OutputSink(
+        writer,
+        format=args.format,
+        num_workers=args.encode_workers,
+        max_pending=args.max_pending,
+        use_processes=args.encode_processes,
+    )
+    inference_s = 0.0
+    start = time.perf_counter()
+    for batch in batches:
+        batch_start = time.perf_counter()
+        pipe(prompt="Clean the image", image=batch, output_sink=sink, **call_kwargs)
+        inference_s += time.perf_counter() - batch_start
+    sink.close()
+    elapsed = time.perf_counter() - start
+    num_images = sum(len(batch) for batch in batches)
+    return {
+        "images_per_second": num_images / elapsed,
+        "inference_s": inference_s,
+        "drain_s": elapsed - inference_s,
+        "sink": sink.stats._asdict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=32, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--batches", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--format", default="png", choices=["png", "jpeg"])
+    parser.add_argument("--encode-workers", type=int, default=2)
+    parser.add_argument("--encode-processes", action="store_true")
+    parser.add_argument("--max-pending", type=int, default=16)
+    parser.add_argument("--tar-shard-size", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    from .components import tiny_lcm_pipeline
+
+    torch.set_num_threads(args.threads)
+    _, images, _ = load_samples(args.resolution)
+    batches = [
+        [images[(index * args.batch_size + i) % len(images)] for i in range(args.batch_size)]
+        for index in range(args.batches)
+    ]
+    pipe = tiny_lcm_pipeline(width=args.width)
+    call_kwargs = {"num_inference_steps": args.steps}
+    # warm-up
+    pipe(prompt="Clean the image", image=batches[0], **call_kwargs)
+
+    with tempfile.TemporaryDirectory() as sync_dir, tempfile.TemporaryDirectory() as sink_dir:
+        sync = run_sync(pipe, batches, call_kwargs, sync_dir, args.format)
+        sink = run_sink(pipe, batches, call_kwargs, sink_dir, args)
+
+    report = json.dumps(
+        {
+            "benchmark": "output_sink",
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "config": vars(args),
+            "sync": sync,
+            "sink": sink,
+            "speedup": sink["images_per_second"] / sync["images_per_second"],
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
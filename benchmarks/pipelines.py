@@ -0,0 +1,149 @@
+"""
+CPU micro-benchmark of both decorruptor pipelines on tiny random components.
+
+    python -m benchmarks.pipelines --batch-sizes 1 4 --resolutions 128 256 --output pipelines.json
+
+Every `(pipeline, batch size, resolution)` configuration runs in its own interpreter so that its peak RSS is measured in
+isolation. The JSON report holds per-stage latency (prompt encode, preprocess, VAE encode, UNet per NFE, scheduler step,
+VAE decode, postprocess), end-to-end latency, throughput and peak RSS for every configuration.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import torch
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PIPELINE_DEFAULTS = {
+    "dpm": {"num_inference_steps": 20, "guidance_scale": 7.5, "image_guidance_scale": 1.5},
+    "lcm": {"num_inference_steps": 4, "guidance_scale": 7.5, "image_guidance_scale": 1.1},
+}
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_config(pipeline, batch_size, resolution, steps, repeats, warmup):
+    """Benchmarks one configuration in the current process and returns its report."""
+    from PIL import Image
+
+    from .components import tiny_dpm_pipeline, tiny_lcm_pipeline
+    from .stage_timer import StageTimer
+
+    pipe = tiny_dpm_pipeline() if pipeline == "dpm" else tiny_lcm_pipeline()
+    call_kwargs = dict(PIPELINE_DEFAULTS[pipeline])
+    if steps is not None:
+        call_kwargs["num_inference_steps"] = steps
+    if pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+
+    generator = torch.Generator().manual_seed(0)
+    images = [
+        Image.fromarray(torch.randint(0, 256, (resolution, resolution, 3), generator=generator, dtype=torch.uint8).numpy())
+        for _ in range(batch_size)
+    ]
+
+    def call():
+        return pipe(prompt="clean the image", image=images, output_type="pil", **call_kwargs)
+
+    for _ in range(warmup):
+        call()
+
+    timer = StageTimer(pipe)
+    latencies = []
+    with timer.active():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+
+    latency = sorted(latencies)[len(latencies) // 2]
+    return {
+        "pipeline": pipeline,
+        "batch_size": batch_size,
+        "resolution": resolution,
+        "num_inference_steps": call_kwargs["num_inference_steps"],
+        "latency_s": latency,
+        "latency_min_s": min(latencies),
+        "throughput_img_s": batch_size / latency,
+        "stages": timer.report(runs=repeats),
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def _run_isolated(args, pipeline, batch_size, resolution):
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.pipelines",
+        "--single",
+        pipeline,
+        str(batch_size),
+        str(resolution),
+        "--repeats",
+        str(args.repeats),
+        "--warmup",
+        str(args.warmup),
+        "--threads",
+        str(args.threads),
+    ]
+    if args.steps is not None:
+        command += ["--steps", str(args.steps)]
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", nargs="+", choices=sorted(PIPELINE_DEFAULTS), default=["dpm", "lcm"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[128, 256])
+    parser.add_argument("--steps", type=int, default=None, help="Overrides the per-pipeline number of steps.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--single", nargs=3, metavar=("PIPELINE", "BATCH", "RESOLUTION"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    if args.single is not None:
+        pipeline, batch_size, resolution = args.single
+        result = run_config(pipeline, int(batch_size), int(resolution), args.steps, args.repeats, args.warmup)
+        print(json.dumps(result))
+        return
+
+    results = [
+        _run_isolated(args, pipeline, batch_size, resolution)
+        for pipeline in args.pipelines
+        for resolution in args.resolutions
+        for batch_size in args.batch_sizes
+    ]
+    report = {
+        "benchmark": "pipelines",
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "threads": args.threads,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
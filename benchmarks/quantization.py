@@ -0,0 +1,162 @@
+"""
+Accuracy and latency of the int8 dynamically quantized UNet against the fp32 pipeline on `__assets__/corrupt_images`.
+
+    python -m benchmarks.quantization                                    # tiny random CM pipeline, offline
+    python -m benchmarks.quantization --model-id Anonymous-12/DeCorruptor-CM --resolution 512
+
+Both pipelines clean every bundled corrupted image from the same seed. The JSON report holds, per image and on average,
+the PSNR and maximum absolute difference of the int8 output against the fp32 output, the PSNR of both against the
+matching image in `__assets__/clean_images`, the median latency of both pipelines, and the time to quantize the
+UNet against loading it from the quantized weight cache.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from .components import load_samples
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PIPELINE_DEFAULTS = {
+    "dpm": {"num_inference_steps": 20, "guidance_scale": 7.5, "image_guidance_scale": 1.5},
+    "lcm": {"num_inference_steps": 4, "guidance_scale": 7.5, "image_guidance_scale": 1.1},
+}
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = float(np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def load_pipeline(args):
+    if args.model_id is None:
+        from .components import tiny_dpm_pipeline, tiny_lcm_pipeline
+
+        return (tiny_lcm_pipeline if args.pipeline == "lcm" else tiny_dpm_pipeline)(width=args.width)
+
+    from diffusers import DDIMScheduler, LCMScheduler
+
+    if args.pipeline == "lcm":
+        from pipeline.deccoruptor_lcm_pipe import IP2PLatentConsistencyModelPipeline as pipeline_class
+
+        scheduler = LCMScheduler.from_pretrained(args.model_id, subfolder="scheduler")
+    else:
+        from pipeline.deccoruptor_dpm_pipe import ConsistInstructPix2PixPipeline as pipeline_class
+
+        scheduler = DDIMScheduler(
+            beta_start=0.00085,
+            beta_end=0.012,
+            num_train_timesteps=1000,
+            beta_schedule="scaled_linear",
+            clip_sample=False,
+            set_alpha_to_one=False,
+        )
+    pipe = pipeline_class.from_pretrained(
+        args.model_id, torch_dtype=torch.float32, scheduler=scheduler, use_safetensors=True, safety_checker=None
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def run(pipe, images, call_kwargs, seed):
+    outputs, latencies = [], []
+    for image in images:
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        output = pipe(prompt="Clean the image", image=image, output_type="np", **call_kwargs).images[0]
+        latencies.append(time.perf_counter() - start)
+        outputs.append(output)
+    return outputs, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=sorted(PIPELINE_DEFAULTS))
+    parser.add_argument("--model-id", default=None, help="checkpoint to load; a tiny random pipeline if not set")
+    parser.add_argument("--width", type=int, default=64, help="UNet width of the tiny pipeline")
+    parser.add_argument("--resolution", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--quantize-text-encoder", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    call_kwargs = dict(PIPELINE_DEFAULTS[args.pipeline])
+    if args.steps is not None:
+        call_kwargs["num_inference_steps"] = args.steps
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [call_kwargs["image_guidance_scale"]] * call_kwargs["num_inference_steps"]
+
+    paths, images, clean = load_samples(args.resolution)
+
+    fp32 = load_pipeline(args)
+    int8 = load_pipeline(args)
+    cache_dir = tempfile.mkdtemp(prefix="decorruptor_int8_")
+    start = time.perf_counter()
+    layers = int8.enable_int8_quantization(quantize_text_encoder=args.quantize_text_encoder, cache_dir=cache_dir)
+    quantize_s = time.perf_counter() - start
+    cached = load_pipeline(args)
+    start = time.perf_counter()
+    cached.enable_int8_quantization(quantize_text_encoder=args.quantize_text_encoder, cache_dir=cache_dir)
+    cached_load_s = time.perf_counter() - start
+    del cached
+
+    # warm-up
+    run(fp32, images[:1], call_kwargs, args.seed)
+    run(int8, images[:1], call_kwargs, args.seed)
+    fp32_outputs, fp32_latencies = run(fp32, images, call_kwargs, args.seed)
+    int8_outputs, int8_latencies = run(int8, images, call_kwargs, args.seed)
+
+    per_image = []
+    for path, reference, output in zip(paths, fp32_outputs, int8_outputs):
+        entry = {
+            "image": os.path.relpath(path, REPO_ROOT),
+            "psnr_int8_vs_fp32": psnr(output, reference),
+            "max_abs_diff": float(np.abs(output - reference).max()),
+        }
+        if path in clean:
+            entry["psnr_fp32_vs_clean"] = psnr(reference, clean[path])
+            entry["psnr_int8_vs_clean"] = psnr(output, clean[path])
+        per_image.append(entry)
+
+    def mean(key):
+        values = [entry[key] for entry in per_image if key in entry and np.isfinite(entry[key])]
+        return float(np.mean(values)) if values else None
+
+    fp32_latency = float(np.median(fp32_latencies))
+    int8_latency = float(np.median(int8_latencies))
+    report = json.dumps(
+        {
+            "benchmark": "quantization",
+            "torch": torch.__version__,
+            "threads": args.threads,
+            "config": vars(args),
+            "quantized_layers": layers,
+            "quantize_s": quantize_s,
+            "cached_load_s": cached_load_s,
+            "fp32_latency_s": fp32_latency,
+            "int8_latency_s": int8_latency,
+            "speedup": fp32_latency / int8_latency,
+            "mean_psnr_int8_vs_fp32": mean("psnr_int8_vs_fp32"),
+            "mean_psnr_fp32_vs_clean": mean("psnr_fp32_vs_clean"),
+            "mean_psnr_int8_vs_clean": mean("psnr_int8_vs_clean"),
+            "images": per_image,
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
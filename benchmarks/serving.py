@@ -0,0 +1,144 @@
+"""
+Offline load test of the dynamic-batching server on a tiny random CM pipeline.
+
+    python -m benchmarks.serving --requests 64 --concurrency 16 --max-batch-size 8
+    python -m benchmarks.serving --route --deadline-s 1.0     # DPM/CM latency router under the same burst
+
+The server listens on a temporary Unix socket in this process and the clients speak plain HTTP to it, so nothing is
+downloaded and no network port is opened. The JSON report holds throughput, request latency percentiles, the HTTP
+status counts and the mean batch size and fill from the server metrics. With `--route`, both tiny pipelines are loaded
+behind the latency router and the report counts the `(pipeline, steps)` options the requests were routed to.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+
+async def _post(socket_path, path, body=b""):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    method = "POST" if body else "GET"
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n"
+    writer.write(head.encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in header_lines)
+    return int(status_line.split()[1]), headers, payload
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+async def run(args):
+    from PIL import Image
+
+    from serving.server import build_server
+
+    from .components import tiny_dpm_pipeline, tiny_lcm_pipeline
+
+    server_args = argparse.Namespace(
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue_size=args.max_queue_size,
+        timeout_s=args.timeout_s,
+        num_inference_steps=args.steps,
+        resolution=args.resolution,
+    )
+    pipe = {"dpm": tiny_dpm_pipeline(), "cm": tiny_lcm_pipeline()} if args.route else tiny_lcm_pipeline()
+    server = build_server(pipe, server_args)
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="decorruptor_serving_"), "server.sock")
+    await server.start(unix_socket=socket_path)
+
+    generator = torch.Generator().manual_seed(0)
+    pixels = torch.randint(0, 256, (args.resolution, args.resolution, 3), generator=generator, dtype=torch.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.numpy()).save(buffer, format="PNG")
+    body = buffer.getvalue()
+
+    # warm up outside of the measurement
+    await _post(socket_path, "/v1/edit", body)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, statuses, routes = [], {}, {}
+    query = f"?timeout_s={args.deadline_s}" if args.deadline_s is not None else ""
+
+    async def client():
+        async with semaphore:
+            start = time.perf_counter()
+            status, headers, _ = await _post(socket_path, "/v1/edit" + query, body)
+            statuses[status] = statuses.get(status, 0) + 1
+            route = headers.get("X-Decorruptor-Route")
+            if route is not None:
+                routes[route] = routes.get(route, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    _, _, metrics_text = await _post(socket_path, "/metrics")
+    batchers = server.batcher.batchers.values() if args.route else [server.batcher]
+    batch_sizes = [batcher.metrics.get("batch_size") for batcher in batchers]
+    batch_fills = [batcher.metrics.get("batch_fill_ratio") for batcher in batchers]
+    await server.close()
+
+    def mean(histograms):
+        count = sum(h.count for h in histograms)
+        return sum(h.mean * h.count for h in histograms if h.count > 0) / count if count > 0 else None
+
+    return {
+        "benchmark": "serving",
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "throughput_img_s": len(latencies) / elapsed,
+        "latency_p50_s": _percentile(latencies, 0.5),
+        "latency_p95_s": _percentile(latencies, 0.95),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "routes": routes,
+        "batches": sum(h.count for h in batch_sizes),
+        "mean_batch_size": mean(batch_sizes),
+        "mean_batch_fill": mean(batch_fills),
+        "metrics_bytes": len(metrics_text),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20.0)
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--timeout-s", type=float, default=60.0)
+    parser.add_argument("--deadline-s", type=float, default=None, help="per-request timeout_s sent by the clients")
+    parser.add_argument("--route", action="store_true", help="serve both pipelines behind the latency router")
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--resolution", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
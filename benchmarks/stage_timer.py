@@ -0,0 +1,86 @@
+"""Wall-clock timing of pipeline stages by wrapping the component methods each stage calls."""
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+# stage name -> (component attribute or None for the pipeline itself, method name)
+PIPELINE_STAGES = OrderedDict(
+    [
+        ("prompt_encode", (None, "_encode_prompt")),
+        ("preprocess", ("image_processor", "preprocess")),
+        ("vae_encode", ("vae", "encode")),
+        ("unet", ("unet", "forward")),
+        ("scheduler_step", ("scheduler", "step")),
+        ("vae_decode", ("vae", "decode")),
+        ("postprocess", ("image_processor", "postprocess")),
+    ]
+)
+
+
+def _synchronize():
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+
+
+class StageTimer:
+    """
+    Accumulates the time spent in every stage of [`PIPELINE_STAGES`] while active. Each call of a stage method counts
+    once, so the `unet` count is the number of function evaluations (NFEs).
+    """
+
+    def __init__(self, pipe, stages=PIPELINE_STAGES):
+        self.pipe = pipe
+        self.stages = stages
+        self.reset()
+
+    def reset(self):
+        self.seconds = OrderedDict((name, 0.0) for name in self.stages)
+        self.calls = OrderedDict((name, 0) for name in self.stages)
+
+    def _wrap(self, name, method):
+        def timed(*args, **kwargs):
+            _synchronize()
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _synchronize()
+                self.seconds[name] += time.perf_counter() - start
+                self.calls[name] += 1
+
+        return timed
+
+    @contextmanager
+    def active(self):
+        patched = []
+        for name, (component, method_name) in self.stages.items():
+            owner = self.pipe if component is None else getattr(self.pipe, component, None)
+            if owner is None or not hasattr(owner, method_name):
+                continue
+            had_instance_attr = method_name in vars(owner)
+            original = getattr(owner, method_name)
+            setattr(owner, method_name, self._wrap(name, original))
+            patched.append((owner, method_name, had_instance_attr, original))
+        try:
+            yield self
+        finally:
+            for owner, method_name, had_instance_attr, original in reversed(patched):
+                if had_instance_attr:
+                    setattr(owner, method_name, original)
+                else:
+                    delattr(owner, method_name)
+
+    def report(self, runs=1):
+        """Mean seconds and calls per run for every stage, plus the time per call of the UNet and scheduler."""
+        report = OrderedDict()
+        for name in self.stages:
+            calls = self.calls[name]
+            report[name] = {
+                "seconds": self.seconds[name] / runs,
+                "calls": calls / runs,
+                "seconds_per_call": self.seconds[name] / calls if calls > 0 else 0.0,
+            }
+        return report
@@ -0,0 +1,92 @@
+"""
+Autotunes the CPU worker pool on a tiny random pipeline.
+
+    python -m benchmarks.worker_pool --images 32 --candidates 1x4 2x2 4x1
+
+Every `WORKERSxTHREADS` candidate runs the same images; the JSON report holds the throughput of every split, the best
+one, the bytes of weights shared between the workers and the private (unshared) memory of every worker, read from
+`/proc/<pid>/smaps_rollup` where available.
+"""
+
+import argparse
+import json
+
+import torch
+
+
+def _private_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    return sum(int(fields[key].split()[0]) * 1024 for key in ("Private_Clean", "Private_Dirty") if key in fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipeline", default="lcm", choices=["lcm", "dpm"])
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--resolution", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--width", type=int, default=32, help="UNet width of the tiny pipeline")
+    parser.add_argument("--candidates", nargs="+", default=None, help="WORKERSxTHREADS splits, e.g. 1x4 2x2")
+    parser.add_argument("--start-method", default="spawn", choices=["spawn", "fork", "forkserver"])
+    parser.add_argument("--output", default=None, help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    from serving.worker_pool import CPUWorkerPool, autotune_pool, available_cores, pool_candidates
+
+    from .components import tiny_dpm_pipeline, tiny_lcm_pipeline
+
+    pipe = (tiny_lcm_pipeline if args.pipeline == "lcm" else tiny_dpm_pipeline)(width=args.width)
+    call_kwargs = {"num_inference_steps": args.steps, "output_type": "np"}
+    if args.pipeline == "dpm":
+        call_kwargs["image_guidance_scale"] = [1.5] * args.steps
+
+    generator = torch.Generator().manual_seed(0)
+    images = [
+        Image.fromarray(
+            torch.randint(0, 256, (args.resolution, args.resolution, 3), generator=generator, dtype=torch.uint8).numpy()
+        )
+        for _ in range(args.images)
+    ]
+    if args.candidates is None:
+        candidates = pool_candidates(available_cores())
+    else:
+        candidates = [tuple(int(n) for n in candidate.lower().split("x")) for candidate in args.candidates]
+
+    best, measurements = autotune_pool(
+        pipe, images, candidates, batch_size=args.batch_size, start_method=args.start_method, **call_kwargs
+    )
+
+    # memory of the best split, measured on a fresh pool after one round of work
+    with CPUWorkerPool(pipe, best.num_workers, best.threads_per_worker, start_method=args.start_method) as pool:
+        pool.map(images[: best.num_workers], **call_kwargs)
+        worker_private_bytes = [_private_bytes(pid) for pid in pool.worker_pids]
+        shared_bytes = pool.shared_bytes
+
+    report = json.dumps(
+        {
+            "benchmark": "worker_pool",
+            "torch": torch.__version__,
+            "cores": available_cores(),
+            "config": vars(args),
+            "measurements": [config._asdict() for config in measurements],
+            "best": best._asdict(),
+            "shared_weight_bytes": shared_bytes,
+            "worker_private_bytes": worker_private_bytes,
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Decorruptor pipelines.
+
+Attributes are resolved lazily: `from pipeline import IP2PLatentConsistencyModelPipeline` only imports the CM pipeline
+module, not the DPM one.
+"""
+
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    "ConsistInstructPix2PixPipeline": ".deccoruptor_dpm_pipe",
+    "IP2PLatentConsistencyModelPipeline": ".deccoruptor_lcm_pipe",
+    "DecorruptorPipelineOutput": ".outputs",
+    "ClassifierTransform": ".classifier_output",
+    "ResolutionBucketer": ".bucketing",
+    "VaeLatentCache": ".latent_cache",
+    "InversionNoiseStore": ".inversion",
+    "OutputSink": ".output_sink",
+    "CorruptionGate": ".corruption_gate",
+    "SeveritySchedule": ".adaptive_sdedit",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,123 @@
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+
+from .corruption_gate import FEATURE_NAMES, image_statistics
+
+_FEATURE = {name: index for index, name in enumerate(FEATURE_NAMES)}
+
+# (feature, value at severity 0, value at severity 1) of every cue; clean photographs sit at or below the first value
+_SEVERITY_CUES = (
+    ("noise_sigma", 0.01, 0.07),
+    ("blockiness", 1.2, 1.8),
+    ("clipped_fraction", 0.05, 0.35),
+    ("luminance_entropy", 4.0, 2.5),
+    ("luminance_std", 0.12, 0.04),
+)
+
+
+@torch.no_grad()
+def image_severity(images: torch.Tensor) -> torch.Tensor:
+    r"""
+    Heuristic corruption severity in `[0, 1]` of a batch of RGB images in `[0, 1]`, shape `(batch_size,)`.
+
+    Every cue of [`~pipeline.corruption_gate.image_statistics`] that departs from natural photographs (noise level,
+    JPEG blockiness, clipped pixels, lost luminance entropy and contrast) is mapped linearly to `[0, 1]`, and the
+    severity is the strongest of them. It needs no training; a trained [`~pipeline.corruption_gate.CorruptionGate`]
+    is usually the better estimator.
+    """
+    features = image_statistics(images)
+    cues = []
+    for name, low, high in _SEVERITY_CUES:
+        cues.append(((features[:, _FEATURE[name]] - low) / (high - low)).clamp(0, 1))
+    return torch.stack(cues, dim=1).amax(dim=1)
+
+
+class SeverityLevel(NamedTuple):
+    r"""
+    One SDEdit schedule of a [`SeveritySchedule`]: images with a severity of at most `max_severity` start at
+    `strength` of a `num_inference_steps` schedule (the call's own step count if `None`), i.e. run
+    `int(num_inference_steps * strength)` denoising steps.
+    """
+
+    max_severity: float
+    strength: float
+    num_inference_steps: Optional[int] = None
+
+    def steps(self, num_inference_steps: int) -> int:
+        num_inference_steps = self.num_inference_steps or num_inference_steps
+        return min(int(num_inference_steps * self.strength), num_inference_steps)
+
+
+DEFAULT_LEVELS = (
+    SeverityLevel(0.2, 0.25),
+    SeverityLevel(0.5, 0.5),
+    SeverityLevel(0.8, 0.75),
+    SeverityLevel(1.0, 1.0),
+)
+
+
+class SeveritySchedule:
+    r"""
+    Picks the SDEdit start timestep and step count of every image from its estimated corruption severity.
+
+    Pass it to either decorruptor pipeline as `severity_schedule`: the call then runs SDEdit, and images that fall
+    into the same [`SeverityLevel`] are denoised together, so a mildly corrupted image costs one or two UNet steps of
+    a four step CM schedule instead of the full schedule.
+
+    Args:
+        levels (`Sequence[SeverityLevel]`, *optional*):
+            The schedules, by increasing `max_severity`. Images above the last `max_severity` use the last level.
+            Defaults to a quarter, half, three quarters and all of the call's steps.
+        estimator (`Callable[[torch.Tensor], torch.Tensor]`, *optional*):
+            Maps a batch of RGB images in `[0, 1]` to severities in `[0, 1]`. Defaults to [`image_severity`]; a
+            [`~pipeline.corruption_gate.CorruptionGate`] can be passed to use its corruption probability instead.
+    """
+
+    def __init__(
+        self,
+        levels: Sequence[SeverityLevel] = DEFAULT_LEVELS,
+        estimator: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+    ):
+        levels = [SeverityLevel(*level) for level in levels]
+        if len(levels) == 0:
+            raise ValueError("`levels` needs at least one severity level.")
+        if any(a.max_severity >= b.max_severity for a, b in zip(levels, levels[1:])):
+            raise ValueError(f"`levels` have to be sorted by strictly increasing `max_severity` but are {levels}.")
+        for level in levels:
+            if not 0 < level.strength <= 1:
+                raise ValueError(f"The `strength` of every level has to be in (0, 1] but is {level.strength}.")
+        self.levels = levels
+        self.estimator = estimator if estimator is not None else image_severity
+
+    @torch.no_grad()
+    def severity(self, images: torch.Tensor) -> List[float]:
+        r"""Severities of a batch of RGB images in `[0, 1]`."""
+        return self.estimator(images).float().cpu().tolist()
+
+    def level(self, severity: float) -> int:
+        for index, level in enumerate(self.levels):
+            if severity <= level.max_severity:
+                return index
+        return len(self.levels) - 1
+
+    def plan(
+        self, images: torch.Tensor, num_inference_steps: Optional[int] = None
+    ) -> Tuple[List[float], List[Tuple[SeverityLevel, List[int]]]]:
+        r"""
+        Returns the severity of every image and the groups to denoise together, as `(level, indices)` pairs in level
+        order. With `num_inference_steps`, the call's step count, a level that would run no step raises.
+        """
+        severities = self.severity(images)
+        groups = {}
+        for index, severity in enumerate(severities):
+            groups.setdefault(self.level(severity), []).append(index)
+        plan = [(self.levels[level], groups[level]) for level in sorted(groups)]
+        if num_inference_steps is not None:
+            for level, _ in plan:
+                if level.steps(num_inference_steps) == 0:
+                    raise ValueError(
+                        f"{level} runs no denoising step of a {level.num_inference_steps or num_inference_steps} step"
+                        " schedule; raise its `strength` or `num_inference_steps`."
+                    )
+        return severities, plan
@@ -0,0 +1,129 @@
+from dataclasses import fields
+from typing import List, Tuple
+
+import numpy as np
+import PIL.Image
+import torch
+
+from diffusers.image_processor import PipelineImageInput
+
+
+def image_batch_size(image: PipelineImageInput) -> int:
+    r"""Returns the number of images in a raw pipeline `image` input, before any preprocessing."""
+    if isinstance(image, PIL.Image.Image):
+        return 1
+    if isinstance(image, (torch.Tensor, np.ndarray)):
+        return image.shape[0] if image.ndim == 4 else 1
+    if isinstance(image, list):
+        if len(image) > 0 and isinstance(image[0], (torch.Tensor, np.ndarray)) and image[0].ndim == 4:
+            return sum(i.shape[0] for i in image)
+        return len(image)
+    raise ValueError(f"`image` has to be a PIL image, a numpy array, a torch tensor or a list but is {type(image)}")
+
+
+def split_image_batch(image: PipelineImageInput, max_batch_size: int) -> List[Tuple[int, int, PipelineImageInput]]:
+    r"""
+    Splits a raw pipeline `image` input into micro-batches of at most `max_batch_size` images.
+
+    Returns a list of `(start, end, image)` tuples; the slices are taken before preprocessing so that every micro-batch
+    is normalised exactly like a direct call would normalise it.
+    """
+    if max_batch_size < 1:
+        raise ValueError(f"`max_batch_size` has to be a positive integer but is {max_batch_size}.")
+
+    num_images = image_batch_size(image)
+    if num_images <= max_batch_size:
+        return [(0, num_images, image)]
+
+    if isinstance(image, list) and isinstance(image[0], (torch.Tensor, np.ndarray)) and image[0].ndim == 4:
+        image = torch.cat(image) if isinstance(image[0], torch.Tensor) else np.concatenate(image)
+
+    return [
+        (start, min(start + max_batch_size, num_images), image[start : start + max_batch_size])
+        for start in range(0, num_images, max_batch_size)
+    ]
+
+
+def slice_batch_arg(value, start: int, end: int, batch_size: int, num_images_per_prompt: int = 1):
+    r"""
+    Slices a per-sample `__call__` argument (prompt list, generator list, latents, embeddings) to a micro-batch.
+
+    Arguments that are not per-sample, i.e. whose length is neither `batch_size` nor `batch_size *
+    num_images_per_prompt`, are shared by all micro-batches and returned unchanged.
+    """
+    if not isinstance(value, (list, torch.Tensor)):
+        return value
+    if len(value) == batch_size * num_images_per_prompt and num_images_per_prompt > 1:
+        return value[start * num_images_per_prompt : end * num_images_per_prompt]
+    if len(value) == batch_size and batch_size > 1:
+        return value[start:end]
+    return value
+
+
+def select_images(image: PipelineImageInput, indices: List[int]) -> PipelineImageInput:
+    r"""Selects the images at `indices` of a raw pipeline `image` input, before any preprocessing."""
+    if isinstance(image, PIL.Image.Image):
+        return image
+    if isinstance(image, (torch.Tensor, np.ndarray)) and image.ndim != 4:
+        return image
+    if isinstance(image, list) and len(image) > 0 and isinstance(image[0], (torch.Tensor, np.ndarray)):
+        if image[0].ndim == 4:
+            image = torch.cat(image) if isinstance(image[0], torch.Tensor) else np.concatenate(image)
+    if isinstance(image, list):
+        return [image[i] for i in indices]
+    return image[indices]
+
+
+def select_batch_arg(value, indices: List[int], batch_size: int):
+    r"""
+    Selects the samples at `indices` of a per-sample `__call__` argument, like [`slice_batch_arg`] does for a
+    contiguous range. Arguments that are not per-sample are returned unchanged.
+    """
+    if not isinstance(value, (list, torch.Tensor)) or len(value) != batch_size or batch_size == 1:
+        return value
+    if isinstance(value, list):
+        return [value[i] for i in indices]
+    return value[indices]
+
+
+def _concat(values: list):
+    if any(value is None for value in values):
+        return None
+    if isinstance(values[0], np.ndarray):
+        return np.concatenate(values, axis=0)
+    if isinstance(values[0], torch.Tensor):
+        return torch.cat(values, dim=0)
+    return [item for value in values for item in value]
+
+
+def concat_batch_outputs(outputs: list):
+    r"""
+    Concatenates the pipeline outputs returned by micro-batched calls into one output of the same class. Per-sample
+    fields are concatenated in order; a field is `None` if any micro-batch returned `None` for it.
+    """
+    merged = {}
+    for field in fields(outputs[0]):
+        merged[field.name] = _concat([getattr(out, field.name) for out in outputs])
+    return outputs[0].__class__(**merged)
+
+
+def merge_grouped_outputs(outputs: list, groups: List[List[int]]):
+    r"""
+    Merges the pipeline outputs of calls on disjoint groups of a batch, `outputs[k]` holding the samples at
+    `groups[k]`, into one output in the original sample order. `timings` are concatenated in call order.
+    """
+    merged = concat_batch_outputs(outputs)
+    order = [index for group in groups for index in group]
+    inverse = [0] * len(order)
+    for position, index in enumerate(order):
+        inverse[index] = position
+    for field in fields(merged):
+        value = getattr(merged, field.name)
+        if field.name == "timings" or value is None or len(value) != len(order):
+            continue
+        if isinstance(value, list):
+            value = [value[position] for position in inverse]
+        else:
+            value = value[inverse]
+        setattr(merged, field.name, value)
+    return merged
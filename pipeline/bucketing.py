@@ -0,0 +1,231 @@
+import math
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import PIL.Image
+import torch
+
+from diffusers.utils import PIL_INTERPOLATION
+
+from .batching import merge_grouped_outputs
+
+DEFAULT_ASPECT_RATIOS = (1 / 2, 2 / 3, 3 / 4, 1.0, 4 / 3, 3 / 2, 2.0)
+
+
+def make_buckets(
+    base_resolution: int = 512, aspect_ratios: Sequence[float] = DEFAULT_ASPECT_RATIOS, multiple: int = 64
+) -> List[Tuple[int, int]]:
+    r"""
+    Builds `(height, width)` buckets of roughly `base_resolution ** 2` pixels, one per width / height aspect ratio.
+
+    Sides are rounded to `multiple` so that every bucket maps to a latent shape the UNet can down- and up-sample
+    without padding.
+    """
+    buckets = []
+    for ratio in aspect_ratios:
+        height = max(multiple, int(round(base_resolution / math.sqrt(ratio) / multiple)) * multiple)
+        width = max(multiple, int(round(base_resolution * math.sqrt(ratio) / multiple)) * multiple)
+        if (height, width) not in buckets:
+            buckets.append((height, width))
+    return buckets
+
+
+class ResolutionBucketer:
+    r"""
+    Groups images of mixed sizes into a small set of fixed shapes so that both decorruptor pipelines can run them as
+    batches.
+
+    Every image is assigned to one of `buckets`, brought to that shape, processed together with the other images of
+    its bucket, and restored to its original size afterwards.
+
+    Args:
+        buckets (`List[Tuple[int, int]]`, *optional*):
+            The `(height, width)` shapes, in pixels, images are grouped into. Both sides have to be multiples of 8.
+            Defaults to [`make_buckets`] at 512 pixels.
+        policy (`str`, *optional*, defaults to `"resize"`):
+            How an image is brought to its bucket. `"resize"` picks the bucket with the closest aspect ratio and
+            resizes to it. `"pad"` picks the smallest bucket the image fits in (downscaling it first if it fits none),
+            reflect-pads it to the bucket and crops the padding off the output.
+        max_batch_size (`int`, *optional*):
+            Maximum number of images per pipeline call. Buckets holding more images are split into several batches.
+    """
+
+    def __init__(
+        self,
+        buckets: Optional[List[Tuple[int, int]]] = None,
+        policy: str = "resize",
+        max_batch_size: Optional[int] = None,
+    ):
+        buckets = make_buckets() if buckets is None else [tuple(bucket) for bucket in buckets]
+        if len(buckets) == 0:
+            raise ValueError("`buckets` cannot be empty.")
+        for height, width in buckets:
+            if height % 8 != 0 or width % 8 != 0:
+                raise ValueError(f"Bucket sides have to be multiples of 8 but got {(height, width)}.")
+        if policy not in ("resize", "pad"):
+            raise ValueError(f"`policy` has to be one of 'resize' or 'pad' but is {policy}.")
+        if max_batch_size is not None and max_batch_size < 1:
+            raise ValueError(f"`max_batch_size` has to be a positive integer but is {max_batch_size}.")
+
+        self.buckets = buckets
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._stats = OrderedDict((bucket, {"images": 0, "batches": 0, "slots": 0}) for bucket in self.buckets)
+
+    def assign(self, width: int, height: int) -> Tuple[int, int]:
+        r"""Returns the `(height, width)` bucket an image of the given size is processed in."""
+        if self.policy == "pad":
+            fitting = [bucket for bucket in self.buckets if bucket[0] >= height and bucket[1] >= width]
+            if len(fitting) > 0:
+                return min(fitting, key=lambda bucket: (bucket[0] * bucket[1], bucket))
+
+        aspect = math.log(width / height)
+        return min(
+            self.buckets,
+            key=lambda bucket: (
+                abs(math.log(bucket[1] / bucket[0]) - aspect),
+                abs(bucket[0] * bucket[1] - width * height),
+            ),
+        )
+
+    def _to_bucket(self, image: PIL.Image.Image, bucket: Tuple[int, int]):
+        height, width = bucket
+        image = image.convert("RGB")
+        if self.policy == "resize":
+            return image.resize((width, height), resample=PIL_INTERPOLATION["lanczos"]), (image.height, image.width)
+
+        scale = min(1.0, height / image.height, width / image.width)
+        if scale < 1.0:
+            size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            image = image.resize(size, resample=PIL_INTERPOLATION["lanczos"])
+        array = np.array(image)
+        pad = ((0, height - array.shape[0]), (0, width - array.shape[1])) + ((0, 0),) * (array.ndim - 2)
+        mode = "reflect" if min(array.shape[:2]) > 1 else "edge"
+        return PIL.Image.fromarray(np.pad(array, pad, mode=mode)), (image.height, image.width)
+
+    def _from_bucket(self, image, valid_size: Tuple[int, int], original_size: Tuple[int, int]):
+        if not isinstance(image, PIL.Image.Image):
+            # a `uint8` (height, width, num_channels) array: the crop is a view, only a size change goes through PIL
+            if self.policy == "pad":
+                image = image[: valid_size[0], : valid_size[1]]
+            if image.shape[:2] != original_size:
+                image = PIL.Image.fromarray(image).resize(
+                    (original_size[1], original_size[0]), resample=PIL_INTERPOLATION["lanczos"]
+                )
+                image = np.asarray(image)
+            return image
+
+        if self.policy == "pad":
+            image = image.crop((0, 0, valid_size[1], valid_size[0]))
+        if (image.height, image.width) != original_size:
+            image = image.resize((original_size[1], original_size[0]), resample=PIL_INTERPOLATION["lanczos"])
+        return image
+
+    def __call__(self, pipe, image: List[PIL.Image.Image], prompt="Clean the image", **kwargs):
+        r"""
+        Runs `pipe` on a list of images of arbitrary sizes, one batch per bucket.
+
+        Args:
+            pipe ([`ConsistInstructPix2PixPipeline`] or [`IP2PLatentConsistencyModelPipeline`]):
+                The pipeline to run.
+            image (`List[PIL.Image.Image]`):
+                The corrupted images.
+            prompt (`str`, *optional*, defaults to `"Clean the image"`):
+                The instruction shared by all images.
+            kwargs:
+                Forwarded to the pipeline. A `generator` list is reordered to follow the images into their buckets.
+                `output_type` can be `"pil"` or `"uint8"`, the outputs that can be restored to their input size; with
+                `"uint8"`, the images are a list of `(height, width, num_channels)` arrays. With an `output_sink`,
+                the pipeline decodes to `uint8`, and the restored images of every bucket are submitted to the sink
+                under `output_keys`, in input order, while the next bucket runs.
+
+        Returns:
+            The output class of `pipe`, e.g. [`~pipeline.outputs.DecorruptorPipelineOutput`], with the cleaned images
+            (or their sink keys) at input size and every per-sample field in input order, or a `(images,
+            nsfw_content_detected)` tuple if `return_dict` is `False`.
+        """
+        if isinstance(image, PIL.Image.Image):
+            image = [image]
+        output_type = kwargs.pop("output_type", "pil")
+        if output_type not in ("pil", "uint8"):
+            raise ValueError(
+                f"`ResolutionBucketer` restores every image to its input size and only supports `output_type='pil'`"
+                f" or `'uint8'`, but got {output_type}."
+            )
+        return_dict = kwargs.pop("return_dict", True)
+        generator = kwargs.pop("generator", None)
+        output_sink = kwargs.pop("output_sink", None)
+        output_keys = kwargs.pop("output_keys", None)
+        num_images_per_prompt = kwargs.get("num_images_per_prompt", 1)
+        if output_sink is not None:
+            output_type = "uint8"
+            if output_keys is None:
+                # the buckets are submitted one after another, so the default keys are fixed in input order first
+                output_keys = output_sink.reserve_keys(len(image) * num_images_per_prompt)
+            elif len(output_keys) != len(image) * num_images_per_prompt:
+                raise ValueError(
+                    f"Got {len(output_keys)} `output_keys` for {len(image) * num_images_per_prompt} output images."
+                )
+
+        groups = OrderedDict()
+        for idx, img in enumerate(image):
+            groups.setdefault(self.assign(img.width, img.height), []).append(idx)
+
+        outputs, sample_groups = [], []
+        for bucket, indices in groups.items():
+            batch_size = self.max_batch_size or len(indices)
+            for start in range(0, len(indices), batch_size):
+                batch_indices = indices[start : start + batch_size]
+                inputs, valid_sizes = zip(*(self._to_bucket(image[idx], bucket) for idx in batch_indices))
+                # the samples of an image are contiguous in the pipeline outputs
+                samples, sizes = [], []
+                for idx, valid_size in zip(batch_indices, valid_sizes):
+                    for sample in range(idx * num_images_per_prompt, (idx + 1) * num_images_per_prompt):
+                        samples.append(sample)
+                        sizes.append((valid_size, (image[idx].height, image[idx].width)))
+                batch_generator = generator
+                if isinstance(generator, list) and len(generator) == len(image) * num_images_per_prompt:
+                    batch_generator = [generator[sample] for sample in samples]
+                elif isinstance(generator, list) and len(generator) == len(image):
+                    batch_generator = [generator[idx] for idx in batch_indices]
+
+                output = pipe(
+                    prompt=prompt, image=list(inputs), generator=batch_generator, output_type=output_type, **kwargs
+                )
+                images = output.images.numpy() if isinstance(output.images, torch.Tensor) else output.images
+                output.images = [self._from_bucket(img, *size) for img, size in zip(images, sizes)]
+                if output_sink is not None:
+                    output.images = output_sink.submit(output.images, keys=[output_keys[sample] for sample in samples])
+                outputs.append(output)
+                sample_groups.append(samples)
+
+                stats = self._stats.setdefault(bucket, {"images": 0, "batches": 0, "slots": 0})
+                stats["images"] += len(batch_indices)
+                stats["batches"] += 1
+                stats["slots"] += batch_size
+
+        output = merge_grouped_outputs(outputs, sample_groups)
+
+        if not return_dict:
+            return (output.images, output.nsfw_content_detected)
+
+        return output
+
+    def stats(self) -> Dict[Tuple[int, int], Dict[str, float]]:
+        r"""
+        Returns per-bucket occupancy since the last [`~ResolutionBucketer.reset_stats`]: the number of `images` and
+        `batches` run in each bucket and the average batch `fill` relative to `max_batch_size`.
+        """
+        report = OrderedDict()
+        for bucket, stats in self._stats.items():
+            fill = stats["images"] / stats["slots"] if stats["slots"] > 0 else 0.0
+            report[bucket] = {"images": stats["images"], "batches": stats["batches"], "fill": fill}
+        return report
+
+    def num_shapes(self) -> int:
+        r"""Returns how many distinct latent shapes have been run since the last reset."""
+        return sum(1 for stats in self._stats.values() if stats["batches"] > 0)
@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+@dataclass
+class ClassifierTransform:
+    r"""
+    Turns decoded VAE images into classifier inputs on the device they were decoded on.
+
+    Used by both decorruptor pipelines when `output_type="classifier"`, which skips the host copy and `uint8`
+    quantisation of the PIL/NumPy outputs.
+
+    Args:
+        mean (`Sequence[float]`, *optional*, defaults to the ImageNet mean):
+            Per-channel mean subtracted from images in `[0, 1]`.
+        std (`Sequence[float]`, *optional*, defaults to the ImageNet std):
+            Per-channel standard deviation images are divided by.
+        size (`int` or `Tuple[int, int]`, *optional*):
+            `(height, width)` the images are resized to. An `int` resizes both sides. If not defined, the decoded size
+            is kept.
+        interpolation (`str`, *optional*, defaults to `"bilinear"`):
+            Interpolation mode of the resize, passed to `torch.nn.functional.interpolate`.
+        dtype (`torch.dtype`, *optional*):
+            Output dtype. Defaults to the dtype of the classifier if one is given, otherwise to `torch.float32`.
+    """
+
+    mean: Sequence[float] = IMAGENET_MEAN
+    std: Sequence[float] = IMAGENET_STD
+    size: Optional[Tuple[int, int]] = None
+    interpolation: str = "bilinear"
+    dtype: Optional[torch.dtype] = None
+
+    def __call__(self, image: torch.Tensor, dtype: Optional[torch.dtype] = None) -> torch.Tensor:
+        r"""Maps a batch of decoded images in `[-1, 1]` to normalised classifier inputs."""
+        image = (image.float() / 2 + 0.5).clamp(0, 1)
+        if self.size is not None:
+            size = (self.size, self.size) if isinstance(self.size, int) else tuple(self.size)
+            if tuple(image.shape[-2:]) != size:
+                antialias = self.interpolation in ("bilinear", "bicubic")
+                image = F.interpolate(image, size=size, mode=self.interpolation, antialias=antialias)
+        mean = torch.tensor(self.mean, device=image.device, dtype=image.dtype).view(1, -1, 1, 1)
+        std = torch.tensor(self.std, device=image.device, dtype=image.dtype).view(1, -1, 1, 1)
+        image = (image - mean) / std
+        return image.to(self.dtype or dtype or torch.float32)
+
+
+def run_classifier(
+    image: torch.Tensor, classifier: Optional[Callable], classifier_transform: Optional[ClassifierTransform]
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    r"""
+    Normalises decoded images with `classifier_transform` (ImageNet statistics if not defined) and, if given, runs
+    `classifier` on them.
+
+    Returns the classifier inputs and the logits, or `None` if no classifier was passed.
+    """
+    classifier_transform = classifier_transform or ClassifierTransform()
+    dtype = None
+    if isinstance(classifier, torch.nn.Module):
+        parameter = next(classifier.parameters(), None)
+        dtype = parameter.dtype if parameter is not None else None
+    inputs = classifier_transform(image, dtype)
+    logits = classifier(inputs) if classifier is not None else None
+    return inputs, logits
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+
+from diffusers.utils import logging
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+
+def lcm_step_coefficients(scheduler, timesteps: torch.Tensor) -> torch.Tensor:
+    r"""
+    Precomputes the scalars `LCMScheduler.step` derives from the timestep schedule, one row per step:
+    `(sqrt(alpha_prod_t), sqrt(beta_prod_t), c_skip, c_out, sqrt(alpha_prod_t_prev), sqrt(beta_prod_t_prev))`.
+
+    The last row maps the previous sample onto the denoised one, matching the scheduler, which injects no noise on the
+    final step.
+    """
+    rows = []
+    for i, t in enumerate(timesteps):
+        t = int(t)
+        prev_t = int(timesteps[i + 1]) if i + 1 < len(timesteps) else t
+        alpha_prod_t = scheduler.alphas_cumprod[t]
+        alpha_prod_t_prev = scheduler.alphas_cumprod[prev_t] if prev_t >= 0 else scheduler.final_alpha_cumprod
+        c_skip, c_out = scheduler.get_scalings_for_boundary_condition_discrete(t)
+        if i + 1 < len(timesteps):
+            alpha_prev, beta_prev = alpha_prod_t_prev.sqrt(), (1 - alpha_prod_t_prev).sqrt()
+        else:
+            alpha_prev, beta_prev = torch.tensor(1.0), torch.tensor(0.0)
+        rows.append(
+            torch.stack(
+                [
+                    alpha_prod_t.sqrt(),
+                    (1 - alpha_prod_t).sqrt(),
+                    torch.as_tensor(c_skip, dtype=torch.float32),
+                    torch.as_tensor(c_out, dtype=torch.float32),
+                    alpha_prev,
+                    beta_prev,
+                ]
+            ).float()
+        )
+    return torch.stack(rows)
+
+
+def supports_static_lcm_step(scheduler) -> bool:
+    r"""Returns whether `scheduler` is an `LCMScheduler` whose `step` [`lcm_step_coefficients`] reproduces."""
+    config = scheduler.config
+    return (
+        hasattr(scheduler, "get_scalings_for_boundary_condition_discrete")
+        and scheduler.order == 1
+        and not config.get("thresholding", False)
+        and not config.get("clip_sample", False)
+        and config.get("prediction_type", "epsilon") in ("epsilon", "sample", "v_prediction")
+    )
+
+
+def _lcm_step(
+    unet,
+    prediction_type: str,
+    latents: torch.Tensor,
+    image_latents: torch.Tensor,
+    timestep: torch.Tensor,
+    timestep_cond: torch.Tensor,
+    prompt_embeds: torch.Tensor,
+    coefficients: torch.Tensor,
+    noise: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    model_input = torch.cat([latents, image_latents], dim=1)
+    model_output = unet(
+        model_input,
+        timestep,
+        timestep_cond=timestep_cond,
+        encoder_hidden_states=prompt_embeds,
+        return_dict=False,
+    )[0]
+
+    alpha_t, beta_t, c_skip, c_out, alpha_prev, beta_prev = coefficients.unbind()
+    if prediction_type == "epsilon":
+        predicted_original_sample = (latents - beta_t * model_output) / alpha_t
+    elif prediction_type == "sample":
+        predicted_original_sample = model_output
+    else:
+        predicted_original_sample = alpha_t * latents - beta_t * model_output
+
+    denoised = c_out * predicted_original_sample + c_skip * latents
+    prev_sample = alpha_prev * denoised + beta_prev * noise
+    return prev_sample, denoised
+
+
+class CompiledLCMStep:
+    r"""
+    One static-shape LCM denoising step: concatenation with the image latents, the UNet call with `timestep_cond` and
+    the `LCMScheduler` update, compiled with `torch.compile` once per `(batch, channels, height, width, dtype,
+    device)`.
+
+    The scheduler scalars are passed in as a tensor and the timestep as a 0-d tensor, so a single compiled graph serves
+    every step of a shape. Compiled graphs are kept for the `max_shapes` most recently used shapes; a new shape is
+    compiled on first use, and shapes beyond the limit, or whose compilation fails, run the same step eagerly.
+
+    Args:
+        unet ([`UNet2DConditionModel`]):
+            The denoising UNet.
+        prediction_type (`str`, *optional*, defaults to `"epsilon"`):
+            The scheduler's `prediction_type`.
+        max_shapes (`int`, *optional*, defaults to 8):
+            Number of compiled shapes kept. Matches the default recompilation limit of `torch._dynamo`.
+        compile_kwargs:
+            Forwarded to `torch.compile`, e.g. `mode="max-autotune"` or `backend="inductor"`.
+    """
+
+    def __init__(self, unet, prediction_type: str = "epsilon", max_shapes: int = 8, **compile_kwargs):
+        if max_shapes < 0:
+            raise ValueError(f"`max_shapes` has to be a non-negative integer but is {max_shapes}.")
+        self.unet = unet
+        self.prediction_type = prediction_type
+        self.max_shapes = max_shapes
+        self.compile_kwargs = dict(compile_kwargs)
+        self.compile_kwargs.setdefault("dynamic", False)
+        self._compiled: Dict[Tuple, Callable] = OrderedDict()
+        self._failed = set()
+        self.compiled_calls = 0
+        self.eager_calls = 0
+
+    def _eager(self, *args):
+        return _lcm_step(self.unet, self.prediction_type, *args)
+
+    def _get(self, key: Tuple) -> Optional[Callable]:
+        if key in self._compiled:
+            self._compiled.move_to_end(key)
+            return self._compiled[key]
+        if key in self._failed or self.max_shapes == 0:
+            return None
+        if len(self._compiled) >= self.max_shapes:
+            logger.info(f"Compiled step cache is full ({self.max_shapes} shapes); running shape {key} eagerly.")
+            return None
+        self._compiled[key] = torch.compile(self._eager, **self.compile_kwargs)
+        return self._compiled[key]
+
+    def __call__(
+        self,
+        latents: torch.Tensor,
+        image_latents: torch.Tensor,
+        timestep: torch.Tensor,
+        timestep_cond: torch.Tensor,
+        prompt_embeds: torch.Tensor,
+        coefficients: torch.Tensor,
+        noise: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        r"""Runs one step and returns `(prev_sample, denoised)` like `LCMScheduler.step(..., return_dict=False)`."""
+        args = (latents, image_latents, timestep, timestep_cond, prompt_embeds, coefficients, noise)
+        key = (tuple(latents.shape), tuple(image_latents.shape), tuple(prompt_embeds.shape), latents.dtype, latents.device)
+        step = self._get(key)
+        if step is not None:
+            try:
+                out = step(*args)
+                self.compiled_calls += 1
+                return out
+            except Exception as e:  # noqa: BLE001 - any compiler failure falls back to the eager step
+                logger.warning(f"Compiling the LCM step for shape {key} failed, running it eagerly: {e}")
+                self._compiled.pop(key, None)
+                self._failed.add(key)
+        self.eager_calls += 1
+        return self._eager(*args)
+
+    def shapes(self):
+        r"""Returns the shape keys that currently have a compiled step."""
+        return list(self._compiled)
+
+    def reset(self):
+        r"""Drops all compiled steps."""
+        self._compiled.clear()
+        self._failed.clear()
@@ -0,0 +1,375 @@
+import contextlib
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+
+from diffusers.utils import logging
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+FEATURE_NAMES = (
+    "luminance_mean",
+    "luminance_std",
+    "saturation_mean",
+    "colorfulness",
+    "laplacian_mean",
+    "gradient_mean",
+    "laplacian_to_gradient",
+    "clipped_fraction",
+    "luminance_entropy",
+    "noise_sigma",
+    "blockiness",
+    "channel_correlation",
+)
+
+_LAPLACIAN = torch.tensor([[0.0, 1.0, 0.0], [1.0, -4.0, 1.0], [0.0, 1.0, 0.0]])
+_SOBEL_X = torch.tensor([[-1.0, 0.0, 1.0], [-2.0, 0.0, 2.0], [-1.0, 0.0, 1.0]])
+
+
+def _filter(image: torch.Tensor, kernel: torch.Tensor) -> torch.Tensor:
+    return F.conv2d(F.pad(image, (1, 1, 1, 1), mode="replicate"), kernel.to(image).view(1, 1, 3, 3))
+
+
+def _noise_sigma(luminance: torch.Tensor) -> torch.Tensor:
+    # robust noise estimate from the finest diagonal Haar coefficients (Donoho's MAD estimator)
+    height, width = luminance.shape[-2] // 2 * 2, luminance.shape[-1] // 2 * 2
+    x = luminance[..., :height, :width]
+    diagonal = (x[..., 0::2, 0::2] - x[..., 0::2, 1::2] - x[..., 1::2, 0::2] + x[..., 1::2, 1::2]) / 2
+    return diagonal.flatten(1).abs().median(dim=1).values / 0.6745
+
+
+def _blockiness(luminance: torch.Tensor, block: int = 8) -> torch.Tensor:
+    # mean jump across 8x8 block borders relative to the jump inside blocks, > 1 for JPEG artefacts
+    ratios = []
+    for dim in (-1, -2):
+        jumps = luminance.diff(dim=dim).abs().mean(dim=-2 if dim == -1 else -1).flatten(1)
+        border = torch.zeros(jumps.shape[-1], dtype=torch.bool, device=jumps.device)
+        border[block - 1 :: block] = True
+        if border.all() or not border.any():
+            ratios.append(torch.ones(jumps.shape[0], device=jumps.device))
+            continue
+        ratios.append(jumps[:, border].mean(dim=1) / (jumps[:, ~border].mean(dim=1) + 1e-4))
+    return torch.stack(ratios).mean(dim=0)
+
+
+@torch.no_grad()
+def image_statistics(images: torch.Tensor, size: int = 128) -> torch.Tensor:
+    r"""
+    Computes [`FEATURE_NAMES`] for a batch of RGB images in `[0, 1]` of shape `(batch_size, 3, height, width)`.
+
+    Noise and JPEG blockiness are measured at full resolution; everything else on a copy area-downsampled to `size`,
+    so the cost stays a few milliseconds per image on the CPU at any input size. Returns a `(batch_size,
+    len(FEATURE_NAMES))` float tensor.
+    """
+    images = images.float().clamp(0, 1)
+    weights = torch.tensor([0.299, 0.587, 0.114], device=images.device).view(1, 3, 1, 1)
+    full_luminance = (images * weights).sum(dim=1, keepdim=True)
+    noise = _noise_sigma(full_luminance)
+    blockiness = _blockiness(full_luminance)
+
+    if max(images.shape[-2:]) > size:
+        images = F.interpolate(images, size=(size, size), mode="area")
+    luminance = (images * weights).sum(dim=1, keepdim=True)
+    red, green, blue = images.unbind(dim=1)
+    flat = luminance.flatten(1)
+
+    saturation = (images.amax(dim=1) - images.amin(dim=1)).flatten(1).mean(dim=1)
+    rg, yb = (red - green).flatten(1), (0.5 * (red + green) - blue).flatten(1)
+    colorfulness = torch.sqrt(rg.var(dim=1) + yb.var(dim=1))
+    colorfulness = colorfulness + 0.3 * torch.sqrt(rg.mean(dim=1) ** 2 + yb.mean(dim=1) ** 2)
+    laplacian = _filter(luminance, _LAPLACIAN).abs().flatten(1).mean(dim=1)
+    gradient_x = _filter(luminance, _SOBEL_X)
+    gradient_y = _filter(luminance, _SOBEL_X.t())
+    gradient = torch.sqrt(gradient_x**2 + gradient_y**2).flatten(1).mean(dim=1)
+    clipped = ((flat < 0.02) | (flat > 0.98)).float().mean(dim=1)
+    histogram = torch.stack([torch.histc(row, bins=32, min=0, max=1) for row in flat]) / flat.shape[1]
+    entropy = -(histogram * torch.log2(histogram.clamp_min(1e-12))).sum(dim=1)
+    centered = images.flatten(2) - images.flatten(2).mean(dim=2, keepdim=True)
+    covariance = torch.bmm(centered, centered.transpose(1, 2))
+    std = covariance.diagonal(dim1=1, dim2=2).clamp_min(1e-8).sqrt()
+    correlation = covariance / (std.unsqueeze(2) * std.unsqueeze(1))
+    channel_correlation = (correlation.sum(dim=(1, 2)) - 3) / 6
+
+    return torch.stack(
+        [
+            flat.mean(dim=1),
+            flat.std(dim=1),
+            saturation,
+            colorfulness,
+            laplacian,
+            gradient,
+            laplacian / (gradient + 1e-4),
+            clipped,
+            entropy,
+            noise,
+            blockiness,
+            channel_correlation,
+        ],
+        dim=1,
+    )
+
+
+class CorruptionGate(torch.nn.Module):
+    r"""
+    Cheap per-image detector of whether an input is corrupted at all, so that clean inputs can skip the decorruptor.
+
+    A small MLP (or a logistic regression with `hidden_size=0`) on the standardised [`image_statistics`]. It is trained
+    by `training_code/train_corruption_gate.py` on clean images and their corrupted versions from the project's
+    corruption generator, and its operating point is a single `threshold` on the corruption probability.
+
+    Args:
+        hidden_size (`int`, *optional*, defaults to 32):
+            Width of the hidden layer; 0 for a linear model.
+        threshold (`float`, *optional*, defaults to 0.5):
+            Images with a corruption probability of at least `threshold` are sent to the decorruptor.
+        statistics_size (`int`, *optional*, defaults to 128):
+            Side the images are downsampled to for the global statistics.
+    """
+
+    def __init__(self, hidden_size: int = 32, threshold: float = 0.5, statistics_size: int = 128):
+        super().__init__()
+        num_features = len(FEATURE_NAMES)
+        self.hidden_size = hidden_size
+        self.threshold = threshold
+        self.statistics_size = statistics_size
+        self.register_buffer("feature_mean", torch.zeros(num_features))
+        self.register_buffer("feature_std", torch.ones(num_features))
+        if hidden_size > 0:
+            self.classifier = torch.nn.Sequential(
+                torch.nn.Linear(num_features, hidden_size), torch.nn.ReLU(), torch.nn.Linear(hidden_size, 1)
+            )
+        else:
+            self.classifier = torch.nn.Linear(num_features, 1)
+
+    def features(self, images: torch.Tensor) -> torch.Tensor:
+        return image_statistics(images.to(self.feature_mean.device), size=self.statistics_size)
+
+    def score_features(self, features: torch.Tensor) -> torch.Tensor:
+        r"""Corruption probabilities for precomputed [`image_statistics`]."""
+        features = (features.to(self.feature_mean) - self.feature_mean) / self.feature_std
+        return torch.sigmoid(self.classifier(features).squeeze(1))
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        r"""Corruption probabilities of a batch of RGB images in `[0, 1]`, shape `(batch_size,)`."""
+        return self.score_features(self.features(images))
+
+    @torch.no_grad()
+    def decide(self, images: torch.Tensor) -> Tuple[List[bool], List[float]]:
+        r"""Returns per image whether it goes to the decorruptor, and its corruption probability."""
+        scores = self(images).float().cpu()
+        return (scores >= self.threshold).tolist(), scores.tolist()
+
+    def fit(
+        self,
+        features: torch.Tensor,
+        labels: torch.Tensor,
+        epochs: int = 500,
+        lr: float = 1e-2,
+        weight_decay: float = 1e-4,
+    ) -> List[float]:
+        r"""
+        Fits the standardisation and the classifier to `features` of images labelled `1` for corrupted and `0` for
+        clean, with full-batch Adam on the binary cross-entropy. Returns the loss per epoch.
+        """
+        features = features.float()
+        labels = labels.float()
+        self.feature_mean.copy_(features.mean(dim=0))
+        self.feature_std.copy_(features.std(dim=0).clamp_min(1e-6))
+        optimizer = torch.optim.Adam(self.classifier.parameters(), lr=lr, weight_decay=weight_decay)
+        standardised = (features - self.feature_mean) / self.feature_std
+        losses = []
+        self.train()
+        for _ in range(epochs):
+            optimizer.zero_grad()
+            loss = F.binary_cross_entropy_with_logits(self.classifier(standardised).squeeze(1), labels)
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+        self.eval()
+        return losses
+
+    def calibrate(self, scores: torch.Tensor, labels: torch.Tensor, target_recall: float = 0.95) -> float:
+        r"""
+        Sets `threshold` so that a fraction `target_recall` of the corrupted images (`labels == 1`) is still sent to
+        the decorruptor, and returns it. Lower targets skip more clean images and miss more corrupted ones.
+        """
+        if not 0 < target_recall <= 1:
+            raise ValueError(f"`target_recall` has to be in (0, 1] but is {target_recall}.")
+        corrupted = scores[labels.bool()].float().sort().values
+        if len(corrupted) == 0:
+            raise ValueError("Calibrating the gate needs at least one corrupted image.")
+        index = int((1 - target_recall) * len(corrupted))
+        self.threshold = float(corrupted[min(index, len(corrupted) - 1)])
+        return self.threshold
+
+    def save(self, path: str):
+        config = {
+            "hidden_size": self.hidden_size,
+            "threshold": self.threshold,
+            "statistics_size": self.statistics_size,
+        }
+        torch.save({"config": config, "features": list(FEATURE_NAMES), "state_dict": self.state_dict()}, path)
+
+    @classmethod
+    def load(cls, path: str, map_location="cpu") -> "CorruptionGate":
+        entry = torch.load(path, map_location=map_location, weights_only=True)
+        if tuple(entry["features"]) != FEATURE_NAMES:
+            raise ValueError(f"{path} was trained on the features {entry['features']}, not {list(FEATURE_NAMES)}.")
+        gate = cls(**entry["config"])
+        gate.load_state_dict(entry["state_dict"])
+        return gate.eval()
+
+
+def gate_metrics(scores: torch.Tensor, labels: torch.Tensor, threshold: float) -> Dict[str, float]:
+    r"""
+    Operating-point metrics of a gate: the fraction of all, clean and corrupted images it skips, and the ROC AUC of the
+    scores. `corrupted_skip_rate` is the share of corrupted images passed through unchanged.
+    """
+    scores, labels = scores.float(), labels.bool()
+    skipped = scores < threshold
+    positives, negatives = scores[labels], scores[~labels]
+    if len(positives) > 0 and len(negatives) > 0:
+        auc = float((positives.unsqueeze(1) > negatives.unsqueeze(0)).float().mean())
+        auc += 0.5 * float((positives.unsqueeze(1) == negatives.unsqueeze(0)).float().mean())
+    else:
+        auc = float("nan")
+    return {
+        "threshold": threshold,
+        "skip_rate": float(skipped.float().mean()),
+        "clean_skip_rate": float(skipped[~labels].float().mean()) if (~labels).any() else float("nan"),
+        "corrupted_skip_rate": float(skipped[labels].float().mean()) if labels.any() else float("nan"),
+        "auc": auc,
+    }
+
+
+class CorruptionGateMixin:
+    r"""
+    Lets the decorruptor pipelines pass clean inputs through unchanged: with a [`CorruptionGate`] enabled, only the
+    images it flags as corrupted run the diffusion, and the others are returned as they came in.
+    """
+
+    corruption_gate: Optional[CorruptionGate] = None
+    _corruption_gate_bypassed: bool = False
+    _corruption_gate_bypass_logged: bool = False
+
+    def enable_corruption_gate(
+        self, gate: Union[CorruptionGate, str], threshold: Optional[float] = None
+    ) -> CorruptionGate:
+        r"""
+        Enables gating of every call with an `image`. Calls with `output_type="latent"` or `num_images_per_prompt > 1`
+        are not gated: a skipped image has no latents, and would come back as identical copies.
+
+        Args:
+            gate ([`CorruptionGate`] or `str`):
+                The gate, or the path of one saved with [`CorruptionGate.save`].
+            threshold (`float`, *optional*):
+                Overrides the operating point the gate was calibrated to.
+
+        Returns:
+            The enabled gate. Its skip counts are in `corruption_gate_stats`.
+        """
+        if isinstance(gate, str):
+            gate = CorruptionGate.load(gate)
+        if threshold is not None:
+            gate.threshold = threshold
+        self.corruption_gate = gate.eval()
+        self.corruption_gate_stats = {"images": 0, "skipped": 0}
+        return gate
+
+    def disable_corruption_gate(self):
+        self.corruption_gate = None
+
+    @contextlib.contextmanager
+    def _bypass_corruption_gate(self):
+        self._corruption_gate_bypassed = True
+        try:
+            yield
+        finally:
+            self._corruption_gate_bypassed = False
+
+    def _corruption_gate_active(self, image, output_type: str = "pil", num_images_per_prompt: int = 1) -> bool:
+        if self.corruption_gate is None or image is None or self._corruption_gate_bypassed:
+            return False
+        if output_type == "latent" or num_images_per_prompt != 1:
+            if not self._corruption_gate_bypass_logged:
+                logger.debug(
+                    "The corruption gate is bypassed for calls with `output_type='latent'` or"
+                    " `num_images_per_prompt > 1`; all of their images run the diffusion."
+                )
+                self._corruption_gate_bypass_logged = True
+            return False
+        return True
+
+    def _detect_corruption(self, image) -> Tuple[torch.Tensor, List[bool], List[float]]:
+        # the same preprocessing as the call itself, so a skipped image is returned exactly as it would be encoded
+        preprocessed = self.image_processor.preprocess(image)
+        corrupted, scores = self.corruption_gate.decide((preprocessed / 2 + 0.5).clamp(0, 1))
+        self.corruption_gate_stats["images"] += len(corrupted)
+        self.corruption_gate_stats["skipped"] += corrupted.count(False)
+        return preprocessed, corrupted, scores
+
+    def _merge_gated_outputs(
+        self,
+        preprocessed: torch.Tensor,
+        corrupted: Sequence[bool],
+        scores: Sequence[float],
+        edited,
+        output_type: str,
+        output_sink=None,
+        output_keys: Optional[List[str]] = None,
+        classifier=None,
+        classifier_transform=None,
+    ):
+        from .classifier_output import run_classifier
+        from .output_sink import to_uint8
+        from .outputs import DecorruptorPipelineOutput
+
+        num_images = len(corrupted)
+        indices = [i for i, flag in enumerate(corrupted) if flag]
+        device = edited.images.device if edited is not None else self._execution_device
+        images = (preprocessed.to(device) / 2 + 0.5).clamp(0, 1)
+        steps_used = [0] * num_images
+        nsfw = None
+        severity = None
+        timings = None
+        if edited is not None:
+            images[indices] = edited.images.to(images.dtype)
+            for position, index in enumerate(indices):
+                steps_used[index] = edited.num_inference_steps_used[position]
+            if edited.nsfw_content_detected is not None:
+                nsfw = [False] * num_images
+                for position, index in enumerate(indices):
+                    nsfw[index] = edited.nsfw_content_detected[position]
+            if edited.severity is not None:
+                # images passed through unchanged count as uncorrupted
+                severity = [0.0] * num_images
+                for position, index in enumerate(indices):
+                    severity[index] = edited.severity[position]
+            timings = edited.timings
+
+        classifier_logits = None
+        if output_type == "classifier" or classifier is not None:
+            inputs, classifier_logits = run_classifier(images * 2 - 1, classifier, classifier_transform)
+        # the merged images are in [0, 1] already
+        denormalize = [False] * num_images
+        if output_type == "classifier":
+            images = inputs
+        elif output_sink is not None:
+            images = output_sink.submit(to_uint8(images, denormalize), keys=output_keys)
+        elif output_type == "uint8":
+            images = to_uint8(images, denormalize)
+        else:
+            images = self.image_processor.postprocess(images, output_type=output_type, do_denormalize=denormalize)
+
+        return DecorruptorPipelineOutput(
+            images=images,
+            nsfw_content_detected=nsfw,
+            num_inference_steps_used=steps_used,
+            classifier_logits=classifier_logits,
+            timings=timings,
+            corruption_detected=list(corrupted),
+            corruption_scores=list(scores),
+            severity=severity,
+        )
+
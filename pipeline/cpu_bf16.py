@@ -0,0 +1,102 @@
+import functools
+import torch
+
+try:
+    from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+except ImportError:  # diffusers < 0.25
+    from diffusers.models.vae import DiagonalGaussianDistribution
+
+# instance attributes that are wrapped: the UNet call and both VAE directions
+_WRAPPED = (("unet", "forward"), ("vae", "encode"), ("vae", "decode"))
+
+
+def _to_float(output):
+    # brings every floating point tensor of a model output back to fp32, whatever container it is returned in
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, DiagonalGaussianDistribution):
+        return DiagonalGaussianDistribution(output.parameters.float(), deterministic=output.deterministic)
+    if isinstance(output, tuple):
+        return type(output)(_to_float(value) for value in output)
+    if isinstance(output, dict):
+        # diffusers `BaseOutput`s are ordered dicts that mirror their fields as attributes
+        for key, value in output.items():
+            output[key] = _to_float(value)
+        return output
+    return output
+
+
+def _channels_last(value):
+    if isinstance(value, torch.Tensor) and value.dim() == 4:
+        return value.contiguous(memory_format=torch.channels_last)
+    return value
+
+
+def _autocast_bf16(fn, channels_last: bool):
+    @functools.wraps(fn)
+    def wrapper(sample, *args, **kwargs):
+        if channels_last:
+            sample = _channels_last(sample)
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            output = fn(sample, *args, **kwargs)
+        return _to_float(output)
+
+    wrapper._cpu_bf16_wrapper = True
+    return wrapper
+
+
+class CpuBf16Mixin:
+    r"""
+    CPU execution profile for the decorruptor pipelines: the UNet and VAE run under bfloat16 autocast with
+    `channels_last` weights, while latents, the guidance combination and `scheduler.step` stay in fp32.
+    """
+
+    cpu_bf16_enabled: bool = False
+
+    def enable_cpu_bf16(self, channels_last: bool = True):
+        r"""
+        Runs the UNet and the VAE under CPU bfloat16 autocast.
+
+        The weights stay fp32; autocast runs convolutions, matrix products and attention in bfloat16 and every UNet
+        and VAE output is converted back to fp32, so the classifier-free guidance combination, the scheduler step and
+        the latents themselves keep full precision. Use on CPUs with native bfloat16 support (AVX512-BF16 or AMX),
+        where fp16 is slow or unsupported.
+
+        Args:
+            channels_last (`bool`, *optional*, defaults to `True`):
+                Whether to convert the UNet and VAE weights and inputs to the `channels_last` memory format, which the
+                oneDNN convolution kernels prefer.
+        """
+        if self.device.type != "cpu":
+            raise ValueError(f"The CPU bfloat16 profile needs a CPU pipeline but the pipeline is on {self.device}.")
+        if self.unet.dtype != torch.float32:
+            raise ValueError(f"The CPU bfloat16 profile needs fp32 weights but the UNet is {self.unet.dtype}.")
+        self.disable_cpu_bf16()
+
+        for component, method in _WRAPPED:
+            module = getattr(self, component)
+            setattr(module, method, _autocast_bf16(getattr(module, method), channels_last))
+        if channels_last:
+            self.unet.to(memory_format=torch.channels_last)
+            self.vae.to(memory_format=torch.channels_last)
+        self.cpu_bf16_enabled = True
+        self._reset_compiled_step()
+
+    def disable_cpu_bf16(self):
+        r"""Restores fp32 execution in the contiguous memory format."""
+        if not self.cpu_bf16_enabled:
+            return
+        for component, method in _WRAPPED:
+            module = getattr(self, component)
+            if getattr(module.__dict__.get(method), "_cpu_bf16_wrapper", False):
+                delattr(module, method)
+        self.unet.to(memory_format=torch.contiguous_format)
+        self.vae.to(memory_format=torch.contiguous_format)
+        self.cpu_bf16_enabled = False
+        self._reset_compiled_step()
+
+    def _reset_compiled_step(self):
+        compiled_step = getattr(self, "_compiled_step", None)
+        if compiled_step is not None:
+            compiled_step.reset()
+
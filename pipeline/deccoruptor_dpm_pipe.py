@@ -30,14 +30,38 @@ from diffusers.pipelines.pipeline_utils import DiffusionPipeline
 from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
 from diffusers.pipelines.stable_diffusion import StableDiffusionSafetyChecker
 
-import timm
-import torchvision.transforms as transforms
+from .adaptive_sdedit import SeveritySchedule
+from .classifier_output import ClassifierTransform, run_classifier
+from .corruption_gate import CorruptionGateMixin
+from .cpu_bf16 import CpuBf16Mixin
+from .batching import (
+    concat_batch_outputs,
+    merge_grouped_outputs,
+    select_batch_arg,
+    select_images,
+    slice_batch_arg,
+    split_image_batch,
+)
+from .early_exit import EarlyExitTracker, select_samples
+from .inversion import DDIMInversionMixin, backward_ddim  # noqa: F401
+from .latent_cache import LatentCacheMixin
+from .mmap_loading import MmapLoadingMixin
+from .model_offload import ModelOffloadMixin
+from .output_sink import OutputSink, to_uint8
+from .outputs import DecorruptorPipelineOutput
+from .profiling import ProfilingMixin
+from .quantization import Int8QuantizationMixin
+from .prompt_cache import PromptCacheMixin
+from .tiled_vae import VaeTilingMixin
+
 import torch.nn.functional as F
-import timm
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
 def load_model():
+    # timm is only needed for the aesthetic guidance model; importing it lazily keeps it off the startup path
+    import timm
+
     model = timm.models.vit_base_patch16_224(pretrained=True)
     return model 
 
@@ -85,19 +109,21 @@ def retrieve_latents(
         raise AttributeError("Could not access latents of provided encoder_output")
 
 
-def backward_ddim(x_t, alpha_t: "alpha_t", alpha_tm1: "alpha_{t-1}", eps_xt):
-    """ from noise to image"""
-    return (
-        alpha_tm1**0.5
-        * (
-            (alpha_t**-0.5 - alpha_tm1**-0.5) * x_t
-            + ((1 / alpha_tm1 - 1) ** 0.5 - (1 / alpha_t - 1) ** 0.5) * eps_xt
-        )
-        + x_t
-    )
-        
 class ConsistInstructPix2PixPipeline(
-    DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMixin, IPAdapterMixin
+    DiffusionPipeline,
+    PromptCacheMixin,
+    LatentCacheMixin,
+    VaeTilingMixin,
+    DDIMInversionMixin,
+    ProfilingMixin,
+    MmapLoadingMixin,
+    Int8QuantizationMixin,
+    CpuBf16Mixin,
+    CorruptionGateMixin,
+    ModelOffloadMixin,
+    TextualInversionLoaderMixin,
+    LoraLoaderMixin,
+    IPAdapterMixin,
 ):
     r"""
     Pipeline for pixel-level image editing by following text instructions (based on Stable Diffusion).
@@ -111,6 +137,15 @@ class ConsistInstructPix2PixPipeline(
         - [`~loaders.LoraLoaderMixin.save_lora_weights`] for saving LoRA weights
         - [`~loaders.IPAdapterMixin.load_ip_adapter`] for loading IP Adapters
 
+    Text embeddings are memoised by [`~PromptCacheMixin`]; see `enable_prompt_cache` and `prompt_cache_info`. VAE
+    latents of input images can be memoised as well, in memory and on disk, with `enable_latent_cache`, and
+    large images can be encoded and decoded in tiles under a memory budget with `enable_tiled_vae`. Per-stage timings
+    are recorded with `enable_profiling`. `from_mmap_pretrained` memory-maps weights saved by `save_mmap_pretrained`
+    for a fast cold start, and `enable_int8_quantization` runs the UNet's linear layers in int8 on the CPU.
+    `enable_cpu_bf16` runs the UNet and VAE under bfloat16 autocast in `channels_last` while sampling stays in fp32.
+    With `enable_corruption_gate`, inputs a cheap detector finds clean are passed through without diffusion.
+    `enable_model_offload` loads each component onto the device only for its stage, within a memory budget.
+
     Args:
         vae ([`AutoencoderKL`]):
             Variational Auto-Encoder (VAE) model to encode and decode images to and from latent representations.
@@ -203,7 +238,9 @@ class ConsistInstructPix2PixPipeline(
 
         return timesteps, num_inference_steps - t_start
     
-    def prepare_sdedit_latents(self, image, timestep, batch_size, num_images_per_prompt, dtype, device, generator=None):
+    def prepare_sdedit_latents(
+        self, image, timestep, batch_size, num_images_per_prompt, dtype, device, generator=None, encoder_output=None
+    ):
         if not isinstance(image, (torch.Tensor, PIL.Image.Image, list)):
             raise ValueError(
                 f"`image` has to be of type `torch.Tensor`, `PIL.Image.Image` or list but is {type(image)}"
@@ -223,18 +260,21 @@ class ConsistInstructPix2PixPipeline(
                     f" size of {batch_size}. Make sure the batch size matches the length of the generators."
                 )
 
-            elif isinstance(generator, list):
-                init_latents = [
-                    retrieve_latents(self.vae.encode(image[i : i + 1]), generator=generator[i])
-                    for i in range(batch_size)
-                ]
-                init_latents = torch.cat(init_latents, dim=0)
-            else:
-                init_latents = retrieve_latents(self.vae.encode(image), generator=generator)
+            if encoder_output is None:
+                encoder_output = self._vae_encode(image)
+            # a single batched encoder pass; a list of generators only draws the per-sample noise of the sample
+            encoder_generator = generator
+            if isinstance(generator, list) and len(generator) == image.shape[0] * num_images_per_prompt:
+                # the first generator of every image draws its encoder sample
+                encoder_generator = generator[::num_images_per_prompt]
+            init_latents = retrieve_latents(encoder_output, generator=encoder_generator)
 
             init_latents = self.vae.config.scaling_factor * init_latents
 
-        if batch_size > init_latents.shape[0] and batch_size % init_latents.shape[0] == 0:
+        if num_images_per_prompt > 1 and init_latents.shape[0] * num_images_per_prompt == batch_size:
+            # one image per prompt: keep the samples of an image contiguous, like the prompt embeddings
+            init_latents = init_latents.repeat_interleave(num_images_per_prompt, dim=0)
+        elif batch_size > init_latents.shape[0] and batch_size % init_latents.shape[0] == 0:
             # expand init_latents for batch_size
             deprecation_message = (
                 f"You have passed {batch_size} text prompts (`prompt`), but only {init_latents.shape[0]} initial"
@@ -283,6 +323,15 @@ class ConsistInstructPix2PixPipeline(
         callback_on_step_end: Optional[Callable[[int, int, Dict], None]] = None,
         callback_on_step_end_tensor_inputs: List[str] = ["latents"],
         strength: float = 0.8, 
+        max_batch_size: Optional[int] = None,
+        dynamic_cfg_tolerance: Optional[float] = None,
+        early_exit_threshold: Optional[float] = None,
+        early_exit_min_steps: int = 2,
+        classifier_transform: Optional[ClassifierTransform] = None,
+        classifier: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        output_sink: Optional[OutputSink] = None,
+        output_keys: Optional[List[str]] = None,
+        severity_schedule: Optional[SeveritySchedule] = None,
         **kwargs,
     ):
         r"""
@@ -329,7 +378,9 @@ class ConsistInstructPix2PixPipeline(
             ip_adapter_image: (`PipelineImageInput`, *optional*):
                 Optional image input to work with IP Adapters.
             output_type (`str`, *optional*, defaults to `"pil"`):
-                The output format of the generated image. Choose between `PIL.Image` or `np.array`.
+                The output format of the generated image. Choose between `PIL.Image` or `np.array`. `"classifier"`
+                returns a device-resident `torch.Tensor` normalised by `classifier_transform` instead, `"uint8"` a
+                CPU `torch.Tensor` of shape `(batch_size, height, width, num_channels)`.
             return_dict (`bool`, *optional*, defaults to `True`):
                 Whether or not to return a [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] instead of a
                 plain tuple.
@@ -342,6 +393,42 @@ class ConsistInstructPix2PixPipeline(
                 The list of tensor inputs for the `callback_on_step_end` function. The tensors specified in the list
                 will be passed as `callback_kwargs` argument. You will only be able to include variables listed in the
                 `._callback_tensor_inputs` attribute of your pipeline class.
+            max_batch_size (`int`, *optional*):
+                Maximum number of input images denoised together. A batch of `image` larger than this is split into
+                micro-batches that run one after another; per-sample arguments (`prompt` lists, `generator` lists,
+                `latents`, embeddings) are split alongside. If not defined, all images run as a single batch. A single
+                `prompt` is shared by every image in the batch.
+            dynamic_cfg_tolerance (`float`, *optional*):
+                Enables guidance-aware batch shrinking. The pix2pix guidance is rewritten per step as
+                `text + (guidance_scale - 1) * (text - image) + (image_guidance_scale[i] - 1) * (image - uncond)` and
+                a UNet branch is skipped whenever the coefficient that needs it is within `dynamic_cfg_tolerance` of
+                zero, so the UNet batch shrinks from 3x to 2x or 1x. `0.0` only skips branches whose contribution is
+                exactly zero (outputs match the full 3x loop up to floating point error); larger values bound the
+                per-step change of the guided noise by `dynamic_cfg_tolerance` times the norm of the skipped branch
+                difference. The multiplier used at every step is recorded in `cfg_batch_schedule`.
+            early_exit_threshold (`float`, *optional*):
+                Enables convergence-based early exit. After every step the mean absolute change of each sample's
+                predicted clean latent is compared to this threshold; converged samples leave the batch with their
+                predicted clean latent as final latent, and the remaining samples continue on a smaller UNet batch.
+                Requires a single-step scheduler such as [`DDIMScheduler`].
+            early_exit_min_steps (`int`, *optional*, defaults to 2):
+                Minimum number of steps every sample runs before it may exit.
+            classifier_transform ([`~pipeline.classifier_output.ClassifierTransform`], *optional*):
+                Resize and mean/std normalisation applied to the decoded images for `output_type="classifier"` and
+                for `classifier`. Defaults to ImageNet statistics at the decoded size.
+            classifier (`Callable`, *optional*):
+                Downstream model run on the normalised images within the same call, e.g. the classifier being
+                adapted. Its output is returned as `classifier_logits`.
+            output_sink ([`~pipeline.output_sink.OutputSink`], *optional*):
+                Hands the decoded images to the sink as `uint8` tensors, skipping the PIL/NumPy conversion; they are
+                encoded and written in the background while the next call runs. `images` then holds the keys the
+                images were stored under.
+            output_keys (`List[str]`, *optional*):
+                Keys for `output_sink`, one per generated image. Defaults to the sink's running counter.
+            severity_schedule ([`~pipeline.adaptive_sdedit.SeveritySchedule`], *optional*):
+                Runs SDEdit with a start timestep and step count picked per image from its estimated corruption
+                severity, overriding `sdedit` and `strength`. Images with the same schedule are denoised together; the
+                severities are returned as `severity` and the steps every image ran as `num_inference_steps_used`.
 
         Examples:
 
@@ -373,17 +460,171 @@ class ConsistInstructPix2PixPipeline(
         ```
 
         Returns:
-            [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] or `tuple`:
-                If `return_dict` is `True`, [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] is returned,
-                otherwise a `tuple` is returned where the first element is a list with the generated images and the
-                second element is a list of `bool`s indicating whether the corresponding generated image contains
-                "not-safe-for-work" (nsfw) content.
+            [`~pipeline.outputs.DecorruptorPipelineOutput`] or `tuple`:
+                If `return_dict` is `True`, [`~pipeline.outputs.DecorruptorPipelineOutput`] is returned, otherwise a
+                `tuple` is returned where the first element is a list with the generated images and the second element
+                is a list of `bool`s indicating whether the corresponding generated image contains "not-safe-for-work"
+                (nsfw) content.
         """
+        if self._corruption_gate_active(image, output_type, num_images_per_prompt):
+            preprocessed, corrupted, scores = self._detect_corruption(image)
+            indices = [i for i, flag in enumerate(corrupted) if flag]
+            edited = None
+            if len(indices) > 0:
+                with self._bypass_corruption_gate():
+                    edited = self(
+                        prompt=select_batch_arg(prompt, indices, len(corrupted)),
+                        image=select_images(image, indices),
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        negative_prompt=select_batch_arg(negative_prompt, indices, len(corrupted)),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=select_batch_arg(generator, indices, len(corrupted)),
+                        latents=select_batch_arg(latents, indices, len(corrupted)),
+                        prompt_embeds=select_batch_arg(prompt_embeds, indices, len(corrupted)),
+                        negative_prompt_embeds=select_batch_arg(negative_prompt_embeds, indices, len(corrupted)),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type="pt",
+                        image_guidance_scale=image_guidance_scale,
+                        return_dict=True,
+                        sdedit=sdedit,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        strength=strength,
+                        dynamic_cfg_tolerance=dynamic_cfg_tolerance,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=None,
+                        output_sink=None,
+                        output_keys=None,
+                        severity_schedule=severity_schedule,
+                        max_batch_size=max_batch_size,
+                        **kwargs,
+                    )
+            output = self._merge_gated_outputs(
+                preprocessed,
+                corrupted,
+                scores,
+                edited,
+                output_type,
+                output_sink=output_sink,
+                output_keys=output_keys,
+                classifier=classifier,
+                classifier_transform=classifier_transform,
+            )
+            if not return_dict:
+                return (output.images, output.nsfw_content_detected)
+
+            return output
+
+        if severity_schedule is not None and image is not None:
+            if num_images_per_prompt != 1:
+                raise ValueError("`severity_schedule` needs `num_images_per_prompt=1`.")
+            severities, groups = severity_schedule.plan(
+                (self.image_processor.preprocess(image) / 2 + 0.5).clamp(0, 1), num_inference_steps
+            )
+            if isinstance(image_guidance_scale, list):
+                steps = max(level.steps(num_inference_steps) for level, _ in groups)
+                if len(image_guidance_scale) < steps:
+                    raise ValueError(
+                        f"`image_guidance_scale` has {len(image_guidance_scale)} entries but a severity level runs"
+                        f" {steps} steps."
+                    )
+            if output_sink is not None and output_keys is None:
+                # the groups are submitted one after another, so the default keys are fixed in input order first
+                output_keys = output_sink.reserve_keys(len(severities))
+            outputs = []
+            for level, indices in groups:
+                outputs.append(
+                    self(
+                        prompt=select_batch_arg(prompt, indices, len(severities)),
+                        image=select_images(image, indices),
+                        num_inference_steps=level.num_inference_steps or num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        negative_prompt=select_batch_arg(negative_prompt, indices, len(severities)),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=select_batch_arg(generator, indices, len(severities)),
+                        latents=select_batch_arg(latents, indices, len(severities)),
+                        prompt_embeds=select_batch_arg(prompt_embeds, indices, len(severities)),
+                        negative_prompt_embeds=select_batch_arg(negative_prompt_embeds, indices, len(severities)),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type=output_type,
+                        image_guidance_scale=image_guidance_scale,
+                        return_dict=True,
+                        sdedit=True,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        strength=level.strength,
+                        dynamic_cfg_tolerance=dynamic_cfg_tolerance,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=classifier,
+                        output_sink=output_sink,
+                        output_keys=select_batch_arg(output_keys, indices, len(severities)),
+                        max_batch_size=max_batch_size,
+                        **kwargs,
+                    )
+                )
+            output = merge_grouped_outputs(outputs, [indices for _, indices in groups])
+            output.severity = severities
+
+            if not return_dict:
+                return (output.images, output.nsfw_content_detected)
+
+            return output
+
+        if max_batch_size is not None and image is not None:
+            image_batches = split_image_batch(image, max_batch_size)
+            if len(image_batches) > 1:
+                num_images = image_batches[-1][1]
+                outputs = [
+                    self(
+                        prompt=slice_batch_arg(prompt, start, end, num_images),
+                        image=image_batch,
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        negative_prompt=slice_batch_arg(negative_prompt, start, end, num_images),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=slice_batch_arg(generator, start, end, num_images, num_images_per_prompt),
+                        latents=slice_batch_arg(latents, start, end, num_images, num_images_per_prompt),
+                        prompt_embeds=slice_batch_arg(prompt_embeds, start, end, num_images),
+                        negative_prompt_embeds=slice_batch_arg(negative_prompt_embeds, start, end, num_images),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type=output_type,
+                        image_guidance_scale=image_guidance_scale,
+                        return_dict=True,
+                        sdedit=sdedit,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        strength=strength,
+                        dynamic_cfg_tolerance=dynamic_cfg_tolerance,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=classifier,
+                        output_sink=output_sink,
+                        output_keys=slice_batch_arg(output_keys, start, end, num_images, num_images_per_prompt),
+                        **kwargs,
+                    )
+                    for start, end, image_batch in image_batches
+                ]
+                output = concat_batch_outputs(outputs)
+
+                if not return_dict:
+                    return (output.images, output.nsfw_content_detected)
+
+                return output
+
         if image_guidance_scale == None:
             image_guidance_scale = 1.5
         else:
             assert isinstance(image_guidance_scale, list)
-            
+
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
 
@@ -400,6 +641,10 @@ class ConsistInstructPix2PixPipeline(
                 "Passing `callback_steps` as an input argument to `__call__` is deprecated, consider use `callback_on_step_end`",
             )
 
+        profiler = self._active_profiler()
+        profiler.start_call(self.__class__.__name__, self._execution_device)
+        self._offload_start_call()
+
         # 0. Check inputs
         self.check_inputs(
             prompt,
@@ -409,6 +654,10 @@ class ConsistInstructPix2PixPipeline(
             negative_prompt_embeds,
             callback_on_step_end_tensor_inputs,
         )
+        if classifier is not None and output_type == "latent":
+            raise ValueError("`classifier` cannot be used with `output_type='latent'`.")
+        if output_sink is not None and output_type in ("latent", "classifier"):
+            raise ValueError(f"`output_sink` cannot be used with `output_type='{output_type}'`.")
         self._guidance_scale = guidance_scale
         self._image_guidance_scale = image_guidance_scale
 
@@ -421,6 +670,7 @@ class ConsistInstructPix2PixPipeline(
             )
             if self.do_classifier_free_guidance:
                 image_embeds = torch.cat([image_embeds, negative_image_embeds, negative_image_embeds])
+        profiler.lap("setup")
 
         if image is None:
             raise ValueError("`image` input cannot be undefined.")
@@ -430,28 +680,36 @@ class ConsistInstructPix2PixPipeline(
             batch_size = 1
         elif prompt is not None and isinstance(prompt, list):
             batch_size = len(prompt)
-        # else:
-        #     batch_size = prompt_embeds.shape[0]
-        # batch_size = len(image) 
+        else:
+            batch_size = prompt_embeds.shape[0]
 
         device = self._execution_device
         # check if scheduler is in sigmas space
         scheduler_is_in_sigma_space = hasattr(self.scheduler, "sigmas")
 
+        image_copy = image
+        # 3. Preprocess image
+        image = self.image_processor.preprocess(image)
+        profiler.lap("preprocess")
+
+        # A single instruction is shared by every image of the batch: encode it once and broadcast the embeddings
+        # instead of duplicating images to match the prompt count.
+        prompt_num_images_per_prompt = num_images_per_prompt
+        if batch_size == 1 and image.shape[0] > 1:
+            batch_size = image.shape[0]
+            prompt_num_images_per_prompt = batch_size * num_images_per_prompt
+
         # 2. Encode input prompt
         prompt_embeds = self._encode_prompt(
             prompt,
             device,
-            num_images_per_prompt,
+            prompt_num_images_per_prompt,
             self.do_classifier_free_guidance,
             negative_prompt,
             prompt_embeds=prompt_embeds,
             negative_prompt_embeds=negative_prompt_embeds,
         )
-
-        image_copy = image
-        # 3. Preprocess image
-        image = self.image_processor.preprocess(image)
+        profiler.lap("encode_prompt")
 
         # 4. set timesteps
         self.scheduler.set_timesteps(num_inference_steps, device=device)
@@ -462,6 +720,10 @@ class ConsistInstructPix2PixPipeline(
             timesteps, num_inference_steps = self.get_timesteps(len(timesteps), strength, device)
             latent_timestep = timesteps[:1].repeat(batch_size * num_images_per_prompt) 
         # 5. Prepare Image latents
+        # With SDEdit, one encoder pass yields both the image latents (the mode) and the SDEdit latents (a sample).
+        encoder_output = None
+        if sdedit is not None and image.shape[1] != 4:
+            encoder_output = self._vae_encode(image.to(device=device, dtype=prompt_embeds.dtype))
         image_latents = self.prepare_image_latents(
             image,
             batch_size,
@@ -469,7 +731,9 @@ class ConsistInstructPix2PixPipeline(
             prompt_embeds.dtype,
             device,
             self.do_classifier_free_guidance,
+            encoder_output=encoder_output,
         )
+        profiler.lap("vae_encode")
         # prompt_embeds = prompt_embeds.repeat(len(image),1,1)
         # print(prompt, image_latents.size())
 
@@ -499,8 +763,10 @@ class ConsistInstructPix2PixPipeline(
                 prompt_embeds.dtype,
                 device,
                 generator,
+                encoder_output=encoder_output,
             )
-                        
+        profiler.lap("prepare_latents")
+
         # 7. Check that shapes of latents and image match the UNet channels
         num_channels_image = image_latents.shape[1]
         if num_channels_latents + num_channels_image != self.unet.config.in_channels:
@@ -518,15 +784,47 @@ class ConsistInstructPix2PixPipeline(
         # 8.1 Add image embeds for IP-Adapter
         added_cond_kwargs = {"image_embeds": image_embeds} if ip_adapter_image is not None else None
 
+        # 8.2 Track per-sample convergence for early exit
+        early_exit = None
+        if early_exit_threshold is not None:
+            if self.scheduler.order != 1 or getattr(self.scheduler, "model_outputs", None) is not None:
+                raise ValueError(
+                    f"`early_exit_threshold` requires a single-step scheduler, but {self.scheduler.__class__.__name__}"
+                    " keeps a history of model outputs across steps."
+                )
+            early_exit = EarlyExitTracker(early_exit_threshold, latents.shape[0], len(timesteps), early_exit_min_steps)
+
         # 9. Denoising loop
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         self._num_timesteps = len(timesteps)
+        self._cfg_batch_schedule = []
         
         # print(latents.size())
         # latents = image_latents[0].unsqueeze(0)
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             for i, t in enumerate(timesteps):
-                latent_model_input = torch.cat([latents] * 3) if self.do_classifier_free_guidance else latents
+                if not self.do_classifier_free_guidance:
+                    cfg_branches = None
+                elif dynamic_cfg_tolerance is not None:
+                    cfg_branches = self._dynamic_cfg_branches(i, dynamic_cfg_tolerance)
+                else:
+                    cfg_branches = (0, 1, 2)
+
+                if cfg_branches is None or len(cfg_branches) == 3:
+                    step_prompt_embeds = prompt_embeds
+                    step_image_latents = image_latents
+                    step_added_cond_kwargs = added_cond_kwargs
+                else:
+                    step_prompt_embeds = self._select_cfg_branches(prompt_embeds, cfg_branches)
+                    step_image_latents = self._select_cfg_branches(image_latents, cfg_branches)
+                    step_added_cond_kwargs = added_cond_kwargs
+                    if added_cond_kwargs is not None:
+                        step_added_cond_kwargs = {
+                            "image_embeds": self._select_cfg_branches(added_cond_kwargs["image_embeds"], cfg_branches)
+                        }
+                self._cfg_batch_schedule.append(1 if cfg_branches is None else len(cfg_branches))
+
+                latent_model_input = torch.cat([latents] * len(cfg_branches)) if cfg_branches is not None else latents
                 
                 # Expand the latents if we are doing classifier free guidance.
                 # The latents are expanded 3 times because for pix2pix the guidance\
@@ -535,15 +833,15 @@ class ConsistInstructPix2PixPipeline(
                 # concat latents, image_latents in the channel dimension
                 scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
                 # print(latent_model_input.size(), image_latents.size())
-                scaled_latent_model_input = torch.cat([scaled_latent_model_input, image_latents], dim=1)
+                scaled_latent_model_input = torch.cat([scaled_latent_model_input, step_image_latents], dim=1)
 
                 # print(scaled_latent_model_input.size(), len(image), prompt_embeds.size())
                 # predict the noise residual
                 noise_pred = self.unet(
                     scaled_latent_model_input,
                     t,
-                    encoder_hidden_states=prompt_embeds,
-                    added_cond_kwargs=added_cond_kwargs,
+                    encoder_hidden_states=step_prompt_embeds,
+                    added_cond_kwargs=step_added_cond_kwargs,
                     return_dict=False,
                 )[0]
 
@@ -558,12 +856,22 @@ class ConsistInstructPix2PixPipeline(
 
                 # print(self.image_guidance_scale[i])
                 # perform guidance
-                if self.do_classifier_free_guidance:
+                if cfg_branches == (0, 1, 2):
                     noise_pred_text, noise_pred_image, noise_pred_uncond = noise_pred.chunk(3)
                     noise_pred = (
                         noise_pred_uncond
                         + self.guidance_scale * (noise_pred_text - noise_pred_image)
-                        + self.image_guidance_scale[i] * (noise_pred_image - noise_pred_uncond)
+                        + self._image_guidance_scale_at(i) * (noise_pred_image - noise_pred_uncond)
+                    )
+                elif cfg_branches == (0, 1):
+                    # image_guidance_scale ~ 1: the unconditional branch drops out
+                    noise_pred_text, noise_pred_image = noise_pred.chunk(2)
+                    noise_pred = noise_pred_image + self.guidance_scale * (noise_pred_text - noise_pred_image)
+                elif cfg_branches == (0, 2):
+                    # image_guidance_scale ~ guidance_scale: the image-only branch drops out
+                    noise_pred_text, noise_pred_uncond = noise_pred.chunk(2)
+                    noise_pred = noise_pred_uncond + self._image_guidance_scale_at(i) * (
+                        noise_pred_text - noise_pred_uncond
                     )
 
                 # Hack:
@@ -578,7 +886,14 @@ class ConsistInstructPix2PixPipeline(
                 # classifier guidance
                 
                 # compute the previous noisy sample x_t -> x_t-1
-                latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
+                if early_exit is None:
+                    latents = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
+                else:
+                    step_output = self.scheduler.step(noise_pred, t, latents, **extra_step_kwargs)
+                    latents = step_output.prev_sample
+                    pred_original_sample = getattr(step_output, "pred_original_sample", None)
+                    if pred_original_sample is None:
+                        pred_original_sample = latents
                 
                 if callback_on_step_end is not None:
                     callback_kwargs = {}
@@ -597,11 +912,36 @@ class ConsistInstructPix2PixPipeline(
                     if callback is not None and i % callback_steps == 0:
                         step_idx = i // getattr(self.scheduler, "order", 1)
                         callback(step_idx, t, latents)
+                profiler.lap("denoise_step", step=i, timestep=t, batch_size=latents.shape[0])
+
+                # retire converged samples and continue on the smaller batch
+                if early_exit is not None:
+                    keep = early_exit.step(i, pred_original_sample)
+                    if keep is not None:
+                        if early_exit.finished:
+                            break
+                        latents = latents[keep]
+                        prompt_embeds = select_samples(prompt_embeds, keep)
+                        image_latents = select_samples(image_latents, keep)
+                        if added_cond_kwargs is not None:
+                            added_cond_kwargs = {"image_embeds": select_samples(added_cond_kwargs["image_embeds"], keep)}
+                        if isinstance(extra_step_kwargs.get("generator"), list):
+                            extra_step_kwargs["generator"] = [
+                                g for g, kept in zip(extra_step_kwargs["generator"], keep.tolist()) if kept
+                            ]
+
+        if early_exit is not None:
+            latents = early_exit.gather(latents)
+            num_inference_steps_used = early_exit.steps_used
+        else:
+            num_inference_steps_used = [len(timesteps)] * latents.shape[0]
 
         if not output_type == "latent":
             # image = self.vae.decode(latents / self.vae.config.scaling_factor, return_dict=False)[0]
-            image = self.vae.decode(latents / self.vae.config.scaling_factor, return_dict=False)[0]            
+            image = self._vae_decode_latents(latents / self.vae.config.scaling_factor)
+            profiler.lap("vae_decode")
             image, has_nsfw_concept = self.run_safety_checker(image, device, prompt_embeds.dtype)
+            profiler.lap("safety_checker")
         else:
             image = latents
             has_nsfw_concept = None
@@ -611,15 +951,34 @@ class ConsistInstructPix2PixPipeline(
         else:
             do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
 
-        image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+        classifier_logits = None
+        if output_type == "classifier":
+            image, classifier_logits = run_classifier(image, classifier, classifier_transform)
+        else:
+            if classifier is not None:
+                _, classifier_logits = run_classifier(image, classifier, classifier_transform)
+            if output_sink is not None:
+                image = output_sink.submit(to_uint8(image, do_denormalize), keys=output_keys)
+            elif output_type == "uint8":
+                image = to_uint8(image, do_denormalize)
+            else:
+                image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+        profiler.lap("postprocess")
 
         # Offload all models
         self.maybe_free_model_hooks()
+        timings = profiler.end_call()
 
         if not return_dict:
             return (image, has_nsfw_concept)
 
-        return StableDiffusionPipelineOutput(images=image, nsfw_content_detected=has_nsfw_concept)
+        return DecorruptorPipelineOutput(
+            images=image,
+            nsfw_content_detected=has_nsfw_concept,
+            num_inference_steps_used=num_inference_steps_used,
+            classifier_logits=classifier_logits,
+            timings=timings,
+        )
 
     def _encode_prompt(
         self,
@@ -662,6 +1021,21 @@ class ConsistInstructPix2PixPipeline(
         else:
             batch_size = prompt_embeds.shape[0]
 
+        cache_key = None
+        if self.prompt_cache is not None and prompt_embeds is None and negative_prompt_embeds is None:
+            self.prompt_cache.bind(self.text_encoder)
+            cache_key = self.prompt_cache.make_key(
+                prompt,
+                negative_prompt,
+                num_images_per_prompt,
+                do_classifier_free_guidance,
+                self.text_encoder.dtype,
+                device,
+            )
+            cached_prompt_embeds = self.prompt_cache.get(cache_key)
+            if cached_prompt_embeds is not None:
+                return cached_prompt_embeds
+
         if prompt_embeds is None:
             # textual inversion: process multi-vector tokens if necessary
             if isinstance(self, TextualInversionLoaderMixin):
@@ -768,6 +1142,9 @@ class ConsistInstructPix2PixPipeline(
             # pix2pix has two negative embeddings, and unlike in other pipelines latents are ordered [prompt_embeds, negative_prompt_embeds, negative_prompt_embeds]
             prompt_embeds = torch.cat([prompt_embeds, negative_prompt_embeds, negative_prompt_embeds])
 
+        if cache_key is not None:
+            self.prompt_cache.put(cache_key, prompt_embeds)
+
         return prompt_embeds
 
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.encode_image
@@ -842,7 +1219,7 @@ class ConsistInstructPix2PixPipeline(
     
         
     def get_image_latents(self, image, sample=True, rng_generator=None):
-        encoding_dist = self.vae.encode(image).latent_dist
+        encoding_dist = self._vae_encode(image).latent_dist
         if sample:
             encoding = encoding_dist.sample(generator=rng_generator)
         else:
@@ -861,43 +1238,10 @@ class ConsistInstructPix2PixPipeline(
         text_embeddings = self.text_encoder(text_input_ids.to(self.device))[0]
         return text_embeddings
 
-    @torch.no_grad()
     def get_latents(self, latents, timesteps=20, reverse_process=True):
-        self.scheduler.set_timesteps(timesteps)
-        latents = latents * self.scheduler.init_noise_sigma
-        timesteps_tensor = self.scheduler.timesteps.to(self.device)
-        text_embeddings = self.get_text_embedding("")
-        for i, t in enumerate(self.progress_bar(reversed(timesteps_tensor))):
-            # ddim 
-            latents = self.scheduler.scale_model_input(latents, t)
-            cat_image_latents = torch.cat([latents, latents], dim=1)
-            # print(cat_image_latents, text_embeddings)
-            noise_pred = self.unet(
-                        cat_image_latents, t, encoder_hidden_states=text_embeddings
-                    ).sample
-
-            prev_timestep = (
-                t
-                - self.scheduler.config.num_train_timesteps
-                // self.scheduler.num_inference_steps
-            )
-            
-            alpha_prod_t = self.scheduler.alphas_cumprod[t]
-            alpha_prod_t_prev = (
-                self.scheduler.alphas_cumprod[prev_timestep]
-                if prev_timestep >= 0
-                else self.scheduler.final_alpha_cumprod
-            )
-            if reverse_process:
-                alpha_prod_t, alpha_prod_t_prev = alpha_prod_t_prev, alpha_prod_t
-            latents = backward_ddim(
-                x_t=latents,
-                alpha_t=alpha_prod_t,
-                alpha_tm1=alpha_prod_t_prev,
-                eps_xt=noise_pred,
-            )
-        return latents
-    
+        r"""DDIM inversion of `latents` over `timesteps` steps; see [`~DDIMInversionMixin.invert_latents`]."""
+        return self.invert_latents(latents, num_inference_steps=timesteps, reverse_process=reverse_process)
+
     def check_inputs(
         self,
         prompt,
@@ -981,7 +1325,15 @@ class ConsistInstructPix2PixPipeline(
         return latents
     
     def prepare_image_latents(
-        self, image, batch_size, num_images_per_prompt, dtype, device, do_classifier_free_guidance, generator=None
+        self,
+        image,
+        batch_size,
+        num_images_per_prompt,
+        dtype,
+        device,
+        do_classifier_free_guidance,
+        generator=None,
+        encoder_output=None,
     ):
         if not isinstance(image, (torch.Tensor, PIL.Image.Image, list)):
             raise ValueError(
@@ -995,9 +1347,14 @@ class ConsistInstructPix2PixPipeline(
         if image.shape[1] == 4:
             image_latents = image
         else:
-            image_latents = retrieve_latents(self.vae.encode(image), sample_mode="argmax")
-
-        if batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
+            if encoder_output is None:
+                encoder_output = self._vae_encode(image)
+            image_latents = retrieve_latents(encoder_output, sample_mode="argmax")
+
+        if num_images_per_prompt > 1 and image_latents.shape[0] * num_images_per_prompt == batch_size:
+            # one image per prompt: keep the samples of an image contiguous, like the prompt embeddings
+            image_latents = image_latents.repeat_interleave(num_images_per_prompt, dim=0)
+        elif batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
             # expand image_latents for batch_size
             deprecation_message = (
                 f"You have passed {batch_size} text prompts (`prompt`), but only {image_latents.shape[0]} initial"
@@ -1061,6 +1418,35 @@ class ConsistInstructPix2PixPipeline(
     def num_timesteps(self):
         return self._num_timesteps
 
+    @property
+    def cfg_batch_schedule(self):
+        return self._cfg_batch_schedule
+
+    def _image_guidance_scale_at(self, step):
+        if isinstance(self.image_guidance_scale, list):
+            return self.image_guidance_scale[step]
+        return self.image_guidance_scale
+
+    def _dynamic_cfg_branches(self, step, tolerance):
+        # The pix2pix guidance equals text + (g - 1) * (text - image) + (s - 1) * (image - uncond), so the
+        # unconditional branch is only needed when s != 1 and the image branch only when s != g (and g != 1).
+        image_guidance_scale = self._image_guidance_scale_at(step)
+        drop_uncond = abs(image_guidance_scale - 1.0) <= tolerance
+        drop_image = abs(image_guidance_scale - self.guidance_scale) <= tolerance
+        if drop_uncond and abs(self.guidance_scale - 1.0) <= tolerance:
+            return (0,)
+        if drop_uncond:
+            return (0, 1)
+        if drop_image:
+            return (0, 2)
+        return (0, 1, 2)
+
+    @staticmethod
+    def _select_cfg_branches(tensor, branches):
+        # CFG batches are laid out as [text, image, uncond] along the batch dimension
+        chunks = tensor.chunk(3)
+        return torch.cat([chunks[branch] for branch in branches])
+
     # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
     # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
     # corresponds to doing no classifier free guidance.
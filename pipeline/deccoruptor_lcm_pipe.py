@@ -29,6 +29,30 @@ from diffusers.pipelines.pipeline_utils import DiffusionPipeline
 from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
 from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
 
+from .adaptive_sdedit import SeveritySchedule
+from .classifier_output import ClassifierTransform, run_classifier
+from .corruption_gate import CorruptionGateMixin
+from .cpu_bf16 import CpuBf16Mixin
+from .compiled_step import CompiledLCMStep, lcm_step_coefficients, supports_static_lcm_step
+from .batching import (
+    concat_batch_outputs,
+    merge_grouped_outputs,
+    select_batch_arg,
+    select_images,
+    slice_batch_arg,
+    split_image_batch,
+)
+from .early_exit import EarlyExitTracker, select_samples
+from .latent_cache import LatentCacheMixin
+from .mmap_loading import MmapLoadingMixin
+from .model_offload import ModelOffloadMixin
+from .output_sink import OutputSink, to_uint8
+from .outputs import DecorruptorPipelineOutput
+from .profiling import ProfilingMixin
+from .quantization import Int8QuantizationMixin
+from .prompt_cache import PromptCacheMixin
+from .tiled_vae import VaeTilingMixin
+
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
 
@@ -71,7 +95,19 @@ def retrieve_latents(
 
 
 class IP2PLatentConsistencyModelPipeline(
-    DiffusionPipeline, TextualInversionLoaderMixin, LoraLoaderMixin, IPAdapterMixin
+    DiffusionPipeline,
+    PromptCacheMixin,
+    LatentCacheMixin,
+    VaeTilingMixin,
+    ProfilingMixin,
+    MmapLoadingMixin,
+    Int8QuantizationMixin,
+    CpuBf16Mixin,
+    CorruptionGateMixin,
+    ModelOffloadMixin,
+    TextualInversionLoaderMixin,
+    LoraLoaderMixin,
+    IPAdapterMixin,
 ):
     r"""
     Pipeline for pixel-level image editing by following text instructions (based on Stable Diffusion).
@@ -85,6 +121,15 @@ class IP2PLatentConsistencyModelPipeline(
         - [`~loaders.LoraLoaderMixin.save_lora_weights`] for saving LoRA weights
         - [`~loaders.IPAdapterMixin.load_ip_adapter`] for loading IP Adapters
 
+    Text embeddings are memoised by [`~PromptCacheMixin`]; see `enable_prompt_cache` and `prompt_cache_info`. VAE
+    latents of input images can be memoised as well, in memory and on disk, with `enable_latent_cache`, and
+    large images can be encoded and decoded in tiles under a memory budget with `enable_tiled_vae`. Per-stage timings
+    are recorded with `enable_profiling`. `from_mmap_pretrained` memory-maps weights saved by `save_mmap_pretrained`
+    for a fast cold start, and `enable_int8_quantization` runs the UNet's linear layers in int8 on the CPU.
+    `enable_cpu_bf16` runs the UNet and VAE under bfloat16 autocast in `channels_last` while sampling stays in fp32.
+    With `enable_corruption_gate`, inputs a cheap detector finds clean are passed through without diffusion.
+    `enable_model_offload` loads each component onto the device only for its stage, within a memory budget.
+
     Args:
         vae ([`AutoencoderKL`]):
             Variational Auto-Encoder (VAE) model to encode and decode images to and from latent representations.
@@ -215,6 +260,14 @@ class IP2PLatentConsistencyModelPipeline(
         callback_on_step_end_tensor_inputs: List[str] = ["latents"],
         step_size: float = 100,
         num_intervention_steps: int = 1,
+        max_batch_size: Optional[int] = None,
+        early_exit_threshold: Optional[float] = None,
+        early_exit_min_steps: int = 2,
+        classifier_transform: Optional[ClassifierTransform] = None,
+        classifier: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        output_sink: Optional[OutputSink] = None,
+        output_keys: Optional[List[str]] = None,
+        severity_schedule: Optional[SeveritySchedule] = None,
         **kwargs,
     ):
         r"""
@@ -261,7 +314,9 @@ class IP2PLatentConsistencyModelPipeline(
             ip_adapter_image: (`PipelineImageInput`, *optional*):
                 Optional image input to work with IP Adapters.
             output_type (`str`, *optional*, defaults to `"pil"`):
-                The output format of the generated image. Choose between `PIL.Image` or `np.array`.
+                The output format of the generated image. Choose between `PIL.Image` or `np.array`. `"classifier"`
+                returns a device-resident `torch.Tensor` normalised by `classifier_transform` instead, `"uint8"` a
+                CPU `torch.Tensor` of shape `(batch_size, height, width, num_channels)`.
             return_dict (`bool`, *optional*, defaults to `True`):
                 Whether or not to return a [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] instead of a
                 plain tuple.
@@ -274,6 +329,33 @@ class IP2PLatentConsistencyModelPipeline(
                 The list of tensor inputs for the `callback_on_step_end` function. The tensors specified in the list
                 will be passed as `callback_kwargs` argument. You will only be able to include variables listed in the
                 `._callback_tensor_inputs` attribute of your pipeline class.
+            max_batch_size (`int`, *optional*):
+                Maximum number of input images denoised together. A batch of `image` larger than this is split into
+                micro-batches that run one after another; per-sample arguments (`prompt` lists, `generator` lists,
+                `latents`, embeddings) are split alongside. If not defined, all images run as a single batch. A single
+                `prompt` is shared by every image in the batch.
+            early_exit_threshold (`float`, *optional*):
+                Enables convergence-based early exit. After every step the mean absolute change of each sample's
+                `denoised` latent is compared to this threshold; converged samples leave the batch with their current
+                `denoised` latent as final latent, and the remaining samples continue on a smaller UNet batch.
+            early_exit_min_steps (`int`, *optional*, defaults to 2):
+                Minimum number of steps every sample runs before it may exit.
+            classifier_transform ([`~pipeline.classifier_output.ClassifierTransform`], *optional*):
+                Resize and mean/std normalisation applied to the decoded images for `output_type="classifier"` and
+                for `classifier`. Defaults to ImageNet statistics at the decoded size.
+            classifier (`Callable`, *optional*):
+                Downstream model run on the normalised images within the same call, e.g. the classifier being
+                adapted. Its output is returned as `classifier_logits`.
+            output_sink ([`~pipeline.output_sink.OutputSink`], *optional*):
+                Hands the decoded images to the sink as `uint8` tensors, skipping the PIL/NumPy conversion; they are
+                encoded and written in the background while the next call runs. `images` then holds the keys the
+                images were stored under.
+            output_keys (`List[str]`, *optional*):
+                Keys for `output_sink`, one per generated image. Defaults to the sink's running counter.
+            severity_schedule ([`~pipeline.adaptive_sdedit.SeveritySchedule`], *optional*):
+                Runs SDEdit with a start timestep and step count picked per image from its estimated corruption
+                severity, overriding `sdedit` and `strength`. Images with the same schedule are denoised together; the
+                severities are returned as `severity` and the steps every image ran as `num_inference_steps_used`.
 
         Examples:
 
@@ -305,12 +387,161 @@ class IP2PLatentConsistencyModelPipeline(
         ```
 
         Returns:
-            [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] or `tuple`:
-                If `return_dict` is `True`, [`~pipelines.stable_diffusion.StableDiffusionPipelineOutput`] is returned,
-                otherwise a `tuple` is returned where the first element is a list with the generated images and the
-                second element is a list of `bool`s indicating whether the corresponding generated image contains
-                "not-safe-for-work" (nsfw) content.
+            [`~pipeline.outputs.DecorruptorPipelineOutput`] or `tuple`:
+                If `return_dict` is `True`, [`~pipeline.outputs.DecorruptorPipelineOutput`] is returned, otherwise a
+                `tuple` is returned where the first element is a list with the generated images and the second element
+                is a list of `bool`s indicating whether the corresponding generated image contains "not-safe-for-work"
+                (nsfw) content.
         """
+        if self._corruption_gate_active(image, output_type, num_images_per_prompt):
+            preprocessed, corrupted, scores = self._detect_corruption(image)
+            indices = [i for i, flag in enumerate(corrupted) if flag]
+            edited = None
+            if len(indices) > 0:
+                with self._bypass_corruption_gate():
+                    edited = self(
+                        prompt=select_batch_arg(prompt, indices, len(corrupted)),
+                        image=select_images(image, indices),
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        image_guidance_scale=image_guidance_scale,
+                        negative_prompt=select_batch_arg(negative_prompt, indices, len(corrupted)),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=select_batch_arg(generator, indices, len(corrupted)),
+                        latents=select_batch_arg(latents, indices, len(corrupted)),
+                        prompt_embeds=select_batch_arg(prompt_embeds, indices, len(corrupted)),
+                        negative_prompt_embeds=select_batch_arg(negative_prompt_embeds, indices, len(corrupted)),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type="pt",
+                        return_dict=True,
+                        sdedit=sdedit,
+                        strength=strength,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        step_size=step_size,
+                        num_intervention_steps=num_intervention_steps,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=None,
+                        output_sink=None,
+                        output_keys=None,
+                        severity_schedule=severity_schedule,
+                        max_batch_size=max_batch_size,
+                        **kwargs,
+                    )
+            output = self._merge_gated_outputs(
+                preprocessed,
+                corrupted,
+                scores,
+                edited,
+                output_type,
+                output_sink=output_sink,
+                output_keys=output_keys,
+                classifier=classifier,
+                classifier_transform=classifier_transform,
+            )
+            if not return_dict:
+                return (output.images, output.nsfw_content_detected)
+
+            return output
+
+        if severity_schedule is not None and image is not None:
+            if num_images_per_prompt != 1:
+                raise ValueError("`severity_schedule` needs `num_images_per_prompt=1`.")
+            severities, groups = severity_schedule.plan(
+                (self.image_processor.preprocess(image) / 2 + 0.5).clamp(0, 1), num_inference_steps
+            )
+            if output_sink is not None and output_keys is None:
+                # the groups are submitted one after another, so the default keys are fixed in input order first
+                output_keys = output_sink.reserve_keys(len(severities))
+            outputs = []
+            for level, indices in groups:
+                outputs.append(
+                    self(
+                        prompt=select_batch_arg(prompt, indices, len(severities)),
+                        image=select_images(image, indices),
+                        num_inference_steps=level.num_inference_steps or num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        image_guidance_scale=image_guidance_scale,
+                        negative_prompt=select_batch_arg(negative_prompt, indices, len(severities)),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=select_batch_arg(generator, indices, len(severities)),
+                        latents=select_batch_arg(latents, indices, len(severities)),
+                        prompt_embeds=select_batch_arg(prompt_embeds, indices, len(severities)),
+                        negative_prompt_embeds=select_batch_arg(negative_prompt_embeds, indices, len(severities)),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type=output_type,
+                        return_dict=True,
+                        sdedit=True,
+                        strength=level.strength,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        step_size=step_size,
+                        num_intervention_steps=num_intervention_steps,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=classifier,
+                        output_sink=output_sink,
+                        output_keys=select_batch_arg(output_keys, indices, len(severities)),
+                        max_batch_size=max_batch_size,
+                        **kwargs,
+                    )
+                )
+            output = merge_grouped_outputs(outputs, [indices for _, indices in groups])
+            output.severity = severities
+
+            if not return_dict:
+                return (output.images, output.nsfw_content_detected)
+
+            return output
+
+        if max_batch_size is not None and image is not None:
+            image_batches = split_image_batch(image, max_batch_size)
+            if len(image_batches) > 1:
+                num_images = image_batches[-1][1]
+                outputs = [
+                    self(
+                        prompt=slice_batch_arg(prompt, start, end, num_images),
+                        image=image_batch,
+                        num_inference_steps=num_inference_steps,
+                        guidance_scale=guidance_scale,
+                        image_guidance_scale=image_guidance_scale,
+                        negative_prompt=slice_batch_arg(negative_prompt, start, end, num_images),
+                        num_images_per_prompt=num_images_per_prompt,
+                        eta=eta,
+                        generator=slice_batch_arg(generator, start, end, num_images, num_images_per_prompt),
+                        latents=slice_batch_arg(latents, start, end, num_images, num_images_per_prompt),
+                        prompt_embeds=slice_batch_arg(prompt_embeds, start, end, num_images),
+                        negative_prompt_embeds=slice_batch_arg(negative_prompt_embeds, start, end, num_images),
+                        ip_adapter_image=ip_adapter_image,
+                        output_type=output_type,
+                        return_dict=True,
+                        sdedit=sdedit,
+                        strength=strength,
+                        callback_on_step_end=callback_on_step_end,
+                        callback_on_step_end_tensor_inputs=callback_on_step_end_tensor_inputs,
+                        step_size=step_size,
+                        num_intervention_steps=num_intervention_steps,
+                        early_exit_threshold=early_exit_threshold,
+                        early_exit_min_steps=early_exit_min_steps,
+                        classifier_transform=classifier_transform,
+                        classifier=classifier,
+                        output_sink=output_sink,
+                        output_keys=slice_batch_arg(output_keys, start, end, num_images, num_images_per_prompt),
+                        **kwargs,
+                    )
+                    for start, end, image_batch in image_batches
+                ]
+                output = concat_batch_outputs(outputs)
+
+                if not return_dict:
+                    return (output.images, output.nsfw_content_detected)
+
+                return output
 
         callback = kwargs.pop("callback", None)
         callback_steps = kwargs.pop("callback_steps", None)
@@ -328,6 +559,10 @@ class IP2PLatentConsistencyModelPipeline(
                 "Passing `callback_steps` as an input argument to `__call__` is deprecated, consider use `callback_on_step_end`",
             )
 
+        profiler = self._active_profiler()
+        profiler.start_call(self.__class__.__name__, self._execution_device)
+        self._offload_start_call()
+
         # 0. Check inputs
         self.check_inputs(
             prompt,
@@ -337,6 +572,10 @@ class IP2PLatentConsistencyModelPipeline(
             negative_prompt_embeds,
             callback_on_step_end_tensor_inputs,
         )
+        if classifier is not None and output_type == "latent":
+            raise ValueError("`classifier` cannot be used with `output_type='latent'`.")
+        if output_sink is not None and output_type in ("latent", "classifier"):
+            raise ValueError(f"`output_sink` cannot be used with `output_type='{output_type}'`.")
         self._guidance_scale = guidance_scale
         self._image_guidance_scale = image_guidance_scale
 
@@ -349,6 +588,7 @@ class IP2PLatentConsistencyModelPipeline(
             )
             if self.do_classifier_free_guidance:
                 image_embeds = torch.cat([image_embeds, negative_image_embeds, negative_image_embeds])
+        profiler.lap("setup")
 
         if image is None:
             raise ValueError("`image` input cannot be undefined.")
@@ -365,19 +605,28 @@ class IP2PLatentConsistencyModelPipeline(
         # check if scheduler is in sigmas space
         scheduler_is_in_sigma_space = hasattr(self.scheduler, "sigmas")
 
+        # 3. Preprocess image
+        image = self.image_processor.preprocess(image)
+        profiler.lap("preprocess")
+
+        # A single instruction is shared by every image of the batch: encode it once and broadcast the embeddings
+        # instead of duplicating images to match the prompt count.
+        prompt_num_images_per_prompt = num_images_per_prompt
+        if batch_size == 1 and image.shape[0] > 1:
+            batch_size = image.shape[0]
+            prompt_num_images_per_prompt = batch_size * num_images_per_prompt
+
         # 2. Encode input prompt
         prompt_embeds = self._encode_prompt(
             prompt,
             device,
-            num_images_per_prompt,
+            prompt_num_images_per_prompt,
             self.do_classifier_free_guidance,
             negative_prompt,
             prompt_embeds=prompt_embeds,
             negative_prompt_embeds=negative_prompt_embeds,
         )
-
-        # 3. Preprocess image
-        image = self.image_processor.preprocess(image)
+        profiler.lap("encode_prompt")
 
         # 4. set timesteps
         # print(num_inference_steps)
@@ -390,6 +639,10 @@ class IP2PLatentConsistencyModelPipeline(
             # print(timesteps,latent_timestep)
  
         # 5. Prepare Image latents
+        # With SDEdit, one encoder pass yields both the image latents (the mode) and the SDEdit latents (a sample).
+        encoder_output = None
+        if sdedit is not None and image.shape[1] != 4:
+            encoder_output = self._vae_encode(image.to(device=device, dtype=prompt_embeds.dtype))
         image_latents = self.prepare_image_latents(
             image,
             batch_size,
@@ -397,7 +650,9 @@ class IP2PLatentConsistencyModelPipeline(
             prompt_embeds.dtype,
             device,
             self.do_classifier_free_guidance,
+            encoder_output=encoder_output,
         )
+        profiler.lap("vae_encode")
 
         height, width = image_latents.shape[-2:]
         height = height * self.vae_scale_factor
@@ -425,7 +680,9 @@ class IP2PLatentConsistencyModelPipeline(
                 prompt_embeds.dtype,
                 device,
                 generator,
+                encoder_output=encoder_output,
             )
+        profiler.lap("prepare_latents")
 
         # 7. Check that shapes of latents and image match the UNet channels
         num_channels_image = image_latents.shape[1]
@@ -446,14 +703,26 @@ class IP2PLatentConsistencyModelPipeline(
 
         
         # 8.2. Get Guidance Scale Embedding
-        w = torch.tensor(guidance_scale).repeat(batch_size)
+        w = torch.tensor(guidance_scale).repeat(batch_size * num_images_per_prompt)
         w_embedding = self.get_w_embedding(w, embedding_dim=768) 
         w_embedding = w_embedding.to(device=latents.device, dtype=latents.dtype)
 
-        w2 = torch.tensor(image_guidance_scale).repeat(batch_size)
+        w2 = torch.tensor(image_guidance_scale).repeat(batch_size * num_images_per_prompt)
         w2_embedding = self.get_w_embedding(w2, embedding_dim=768) 
         w2_embedding = w2_embedding.to(device=latents.device, dtype=latents.dtype)
 
+        # 8.3 Track per-sample convergence for early exit
+        early_exit = None
+        if early_exit_threshold is not None:
+            early_exit = EarlyExitTracker(early_exit_threshold, latents.shape[0], len(timesteps), early_exit_min_steps)
+
+        # 8.4 Static-shape compiled step
+        compiled_step = getattr(self, "_compiled_step", None)
+        if compiled_step is not None and (added_cond_kwargs is not None or not supports_static_lcm_step(self.scheduler)):
+            compiled_step = None
+        if compiled_step is not None:
+            step_coefficients = lcm_step_coefficients(self.scheduler, timesteps).to(device)
+
         # 9. Denoising loop
         num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
         self._num_timesteps = len(timesteps)
@@ -464,27 +733,67 @@ class IP2PLatentConsistencyModelPipeline(
                 # is applied for both the text and the input image.
                 latent_model_input = latents #  torch.cat([latents] * 3) if self.do_classifier_free_guidance else latents
 
-                # concat latents, image_latents in the channel dimension
-                scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-                scaled_latent_model_input = torch.cat([scaled_latent_model_input, image_latents], dim=1)
-
-                # predict the noise residual
-                noise_pred = self.unet(
-                    scaled_latent_model_input,
-                    t,
-                    timestep_cond=w_embedding * w2_embedding,
-                    encoder_hidden_states=prompt_embeds,
-                    added_cond_kwargs=added_cond_kwargs,
-                    return_dict=False,
-                )[0]
-
-                # compute the previous noisy sample x_t -> x_t-1
-                latents, denoised = self.scheduler.step(noise_pred, t, latents, return_dict=False)
+                if compiled_step is not None:
+                    # UNet and scheduler update in one static-shape graph; the noise is drawn outside of it
+                    if i + 1 < len(timesteps):
+                        noise = randn_tensor(latents.shape, device=latents.device, dtype=latents.dtype)
+                    else:
+                        noise = torch.zeros_like(latents)
+                    latents, denoised = compiled_step(
+                        latents,
+                        image_latents,
+                        t,
+                        w_embedding * w2_embedding,
+                        prompt_embeds,
+                        step_coefficients[i].to(latents.dtype),
+                        noise,
+                    )
+                else:
+                    # concat latents, image_latents in the channel dimension
+                    scaled_latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+                    scaled_latent_model_input = torch.cat([scaled_latent_model_input, image_latents], dim=1)
+
+                    # predict the noise residual
+                    noise_pred = self.unet(
+                        scaled_latent_model_input,
+                        t,
+                        timestep_cond=w_embedding * w2_embedding,
+                        encoder_hidden_states=prompt_embeds,
+                        added_cond_kwargs=added_cond_kwargs,
+                        return_dict=False,
+                    )[0]
+
+                    # compute the previous noisy sample x_t -> x_t-1
+                    latents, denoised = self.scheduler.step(noise_pred, t, latents, return_dict=False)
                 progress_bar.update()
+                profiler.lap("denoise_step", step=i, timestep=t, batch_size=latents.shape[0])
+
+                # retire converged samples and continue on the smaller batch
+                if early_exit is not None:
+                    keep = early_exit.step(i, denoised)
+                    if keep is not None:
+                        if early_exit.finished:
+                            break
+                        latents = latents[keep]
+                        denoised = denoised[keep]
+                        prompt_embeds = select_samples(prompt_embeds, keep)
+                        image_latents = select_samples(image_latents, keep)
+                        w_embedding = w_embedding[keep]
+                        w2_embedding = w2_embedding[keep]
+                        if added_cond_kwargs is not None:
+                            added_cond_kwargs = {"image_embeds": select_samples(added_cond_kwargs["image_embeds"], keep)}
+
+        if early_exit is not None:
+            latents = denoised = early_exit.gather(denoised)
+            num_inference_steps_used = early_exit.steps_used
+        else:
+            num_inference_steps_used = [len(timesteps)] * latents.shape[0]
 
         if not output_type == "latent":
-            image = self.vae.decode(denoised / self.vae.config.scaling_factor, return_dict=False)[0]
+            image = self._vae_decode_latents(denoised / self.vae.config.scaling_factor)
+            profiler.lap("vae_decode")
             image, has_nsfw_concept = self.run_safety_checker(image, device, prompt_embeds.dtype)
+            profiler.lap("safety_checker")
         else:
             image = latents
             has_nsfw_concept = None
@@ -494,15 +803,34 @@ class IP2PLatentConsistencyModelPipeline(
         else:
             do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
 
-        image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+        classifier_logits = None
+        if output_type == "classifier":
+            image, classifier_logits = run_classifier(image, classifier, classifier_transform)
+        else:
+            if classifier is not None:
+                _, classifier_logits = run_classifier(image, classifier, classifier_transform)
+            if output_sink is not None:
+                image = output_sink.submit(to_uint8(image, do_denormalize), keys=output_keys)
+            elif output_type == "uint8":
+                image = to_uint8(image, do_denormalize)
+            else:
+                image = self.image_processor.postprocess(image, output_type=output_type, do_denormalize=do_denormalize)
+        profiler.lap("postprocess")
 
         # Offload all models
         self.maybe_free_model_hooks()
+        timings = profiler.end_call()
 
         if not return_dict:
             return (image, has_nsfw_concept)
 
-        return StableDiffusionPipelineOutput(images=image, nsfw_content_detected=has_nsfw_concept)
+        return DecorruptorPipelineOutput(
+            images=image,
+            nsfw_content_detected=has_nsfw_concept,
+            num_inference_steps_used=num_inference_steps_used,
+            classifier_logits=classifier_logits,
+            timings=timings,
+        )
 
     def _encode_prompt(
         self,
@@ -545,6 +873,21 @@ class IP2PLatentConsistencyModelPipeline(
         else:
             batch_size = prompt_embeds.shape[0]
 
+        cache_key = None
+        if self.prompt_cache is not None and prompt_embeds is None and negative_prompt_embeds is None:
+            self.prompt_cache.bind(self.text_encoder)
+            cache_key = self.prompt_cache.make_key(
+                prompt,
+                negative_prompt,
+                num_images_per_prompt,
+                do_classifier_free_guidance,
+                self.text_encoder.dtype,
+                device,
+            )
+            cached_prompt_embeds = self.prompt_cache.get(cache_key)
+            if cached_prompt_embeds is not None:
+                return cached_prompt_embeds
+
         if prompt_embeds is None:
             # textual inversion: procecss multi-vector tokens if necessary
             if isinstance(self, TextualInversionLoaderMixin):
@@ -633,7 +976,10 @@ class IP2PLatentConsistencyModelPipeline(
                 attention_mask=attention_mask,
             )
             negative_prompt_embeds = negative_prompt_embeds[0]
-            
+
+        if cache_key is not None:
+            self.prompt_cache.put(cache_key, prompt_embeds)
+
         return prompt_embeds
 
     # Copied from diffusers.pipelines.stable_diffusion.pipeline_stable_diffusion.StableDiffusionPipeline.encode_image
@@ -772,7 +1118,9 @@ class IP2PLatentConsistencyModelPipeline(
         latents = latents * self.scheduler.init_noise_sigma
         return latents
 
-    def prepare_sdedit_latents(self, image, timestep, batch_size, num_images_per_prompt, dtype, device, generator=None):
+    def prepare_sdedit_latents(
+        self, image, timestep, batch_size, num_images_per_prompt, dtype, device, generator=None, encoder_output=None
+    ):
         if not isinstance(image, (torch.Tensor, PIL.Image.Image, list)):
             raise ValueError(
                 f"`image` has to be of type `torch.Tensor`, `PIL.Image.Image` or list but is {type(image)}"
@@ -792,18 +1140,21 @@ class IP2PLatentConsistencyModelPipeline(
                     f" size of {batch_size}. Make sure the batch size matches the length of the generators."
                 )
 
-            elif isinstance(generator, list):
-                init_latents = [
-                    retrieve_latents(self.vae.encode(image[i : i + 1]), generator=generator[i])
-                    for i in range(batch_size)
-                ]
-                init_latents = torch.cat(init_latents, dim=0)
-            else:
-                init_latents = retrieve_latents(self.vae.encode(image), generator=generator)
+            if encoder_output is None:
+                encoder_output = self._vae_encode(image)
+            # a single batched encoder pass; a list of generators only draws the per-sample noise of the sample
+            encoder_generator = generator
+            if isinstance(generator, list) and len(generator) == image.shape[0] * num_images_per_prompt:
+                # the first generator of every image draws its encoder sample
+                encoder_generator = generator[::num_images_per_prompt]
+            init_latents = retrieve_latents(encoder_output, generator=encoder_generator)
 
             init_latents = self.vae.config.scaling_factor * init_latents
 
-        if batch_size > init_latents.shape[0] and batch_size % init_latents.shape[0] == 0:
+        if num_images_per_prompt > 1 and init_latents.shape[0] * num_images_per_prompt == batch_size:
+            # one image per prompt: keep the samples of an image contiguous, like the prompt embeddings
+            init_latents = init_latents.repeat_interleave(num_images_per_prompt, dim=0)
+        elif batch_size > init_latents.shape[0] and batch_size % init_latents.shape[0] == 0:
             # expand init_latents for batch_size
             deprecation_message = (
                 f"You have passed {batch_size} text prompts (`prompt`), but only {init_latents.shape[0]} initial"
@@ -831,7 +1182,15 @@ class IP2PLatentConsistencyModelPipeline(
         return latents
     
     def prepare_image_latents(
-        self, image, batch_size, num_images_per_prompt, dtype, device, do_classifier_free_guidance, generator=None
+        self,
+        image,
+        batch_size,
+        num_images_per_prompt,
+        dtype,
+        device,
+        do_classifier_free_guidance,
+        generator=None,
+        encoder_output=None,
     ):
         if not isinstance(image, (torch.Tensor, PIL.Image.Image, list)):
             raise ValueError(
@@ -845,9 +1204,14 @@ class IP2PLatentConsistencyModelPipeline(
         if image.shape[1] == 4:
             image_latents = image
         else:
-            image_latents = retrieve_latents(self.vae.encode(image), sample_mode="argmax")
-
-        if batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
+            if encoder_output is None:
+                encoder_output = self._vae_encode(image)
+            image_latents = retrieve_latents(encoder_output, sample_mode="argmax")
+
+        if num_images_per_prompt > 1 and image_latents.shape[0] * num_images_per_prompt == batch_size:
+            # one image per prompt: keep the samples of an image contiguous, like the prompt embeddings
+            image_latents = image_latents.repeat_interleave(num_images_per_prompt, dim=0)
+        elif batch_size > image_latents.shape[0] and batch_size % image_latents.shape[0] == 0:
             # expand image_latents for batch_size
             deprecation_message = (
                 f"You have passed {batch_size} text prompts (`prompt`), but only {image_latents.shape[0]} initial"
@@ -899,6 +1263,27 @@ class IP2PLatentConsistencyModelPipeline(
         """Disables the FreeU mechanism if enabled."""
         self.unet.disable_freeu()
 
+    def enable_compiled_step(self, max_shapes: int = 8, **compile_kwargs) -> CompiledLCMStep:
+        r"""
+        Runs every denoising step through a [`~pipeline.compiled_step.CompiledLCMStep`] that is compiled with
+        `torch.compile` once per latent shape, which removes most of the Python and kernel-launch overhead of the few
+        LCM steps. Calls with IP-Adapter images or a scheduler other than [`LCMScheduler`] keep the eager loop.
+
+        Args:
+            max_shapes (`int`, *optional*, defaults to 8):
+                Number of latent shapes kept compiled; further shapes run eagerly.
+            compile_kwargs:
+                Forwarded to `torch.compile`.
+        """
+        self._compiled_step = CompiledLCMStep(
+            self.unet, self.scheduler.config.get("prediction_type", "epsilon"), max_shapes, **compile_kwargs
+        )
+        return self._compiled_step
+
+    def disable_compiled_step(self):
+        r"""Returns to the eager denoising loop and drops the compiled steps."""
+        self._compiled_step = None
+
     @property
     def guidance_scale(self):
         return self._guidance_scale
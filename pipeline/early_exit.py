@@ -0,0 +1,78 @@
+from typing import List, Optional
+
+import torch
+
+
+def select_samples(tensor: torch.Tensor, keep: torch.BoolTensor) -> torch.Tensor:
+    r"""
+    Keeps the samples flagged in `keep` from a batch tensor. Tensors whose batch is a multiple of `len(keep)`, such as
+    the `[text, image, uncond]` CFG layout, are filtered chunk by chunk.
+    """
+    num_chunks = tensor.shape[0] // keep.shape[0]
+    if num_chunks == 1:
+        return tensor[keep]
+    return torch.cat([chunk[keep] for chunk in tensor.chunk(num_chunks)])
+
+
+class EarlyExitTracker:
+    r"""
+    Tracks the per-sample change of the predicted clean latents across denoising steps and retires samples whose
+    prediction has converged.
+
+    Args:
+        threshold (`float`):
+            A sample converges once the mean absolute change of its predicted `x0` between two consecutive steps falls
+            below this value.
+        num_samples (`int`):
+            Number of samples in the denoising batch.
+        num_steps (`int`):
+            Number of scheduled denoising steps.
+        min_steps (`int`, *optional*, defaults to 2):
+            Samples are never retired before running this many steps.
+    """
+
+    def __init__(self, threshold: float, num_samples: int, num_steps: int, min_steps: int = 2):
+        self.threshold = threshold
+        self.min_steps = max(min_steps, 2)
+        self.num_steps = num_steps
+        self.active = torch.arange(num_samples)
+        self.steps_used = [num_steps] * num_samples
+        self._outputs: List[Optional[torch.Tensor]] = [None] * num_samples
+        self._prev = None
+
+    def step(self, step: int, pred_original_sample: torch.Tensor) -> Optional[torch.BoolTensor]:
+        r"""
+        Records the predicted `x0` of the active samples after denoising step `step` (0-based).
+
+        Returns `None` if every active sample keeps going, otherwise a mask over the active samples of the ones that
+        stay in the batch. The latest `pred_original_sample` of a retired sample becomes its final latent.
+        """
+        prev, self._prev = self._prev, pred_original_sample
+        # nothing to save on the last step, which also produces the regular final latent
+        if prev is None or step + 1 < self.min_steps or step + 1 >= self.num_steps:
+            return None
+
+        delta = (pred_original_sample.float() - prev.float()).flatten(1).abs().mean(dim=1)
+        converged = (delta < self.threshold).cpu()
+        if not converged.any():
+            return None
+
+        for j in converged.nonzero().flatten().tolist():
+            sample = self.active[j].item()
+            self.steps_used[sample] = step + 1
+            self._outputs[sample] = pred_original_sample[j]
+
+        keep = ~converged
+        self.active = self.active[keep]
+        self._prev = pred_original_sample[keep.to(pred_original_sample.device)]
+        return keep.to(pred_original_sample.device)
+
+    @property
+    def finished(self) -> bool:
+        return len(self.active) == 0
+
+    def gather(self, final_latents: Optional[torch.Tensor]) -> torch.Tensor:
+        r"""Reassembles the full batch from the retired samples and the `final_latents` of the still active ones."""
+        for j, sample in enumerate(self.active.tolist()):
+            self._outputs[sample] = final_latents[j]
+        return torch.stack(self._outputs)
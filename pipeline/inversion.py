@@ -0,0 +1,195 @@
+import hashlib
+import os
+import tempfile
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import torch
+
+from .latent_cache import module_content_hash
+
+
+def backward_ddim(x_t, alpha_t: "alpha_t", alpha_tm1: "alpha_{t-1}", eps_xt):
+    """ from noise to image"""
+    return (
+        alpha_tm1**0.5
+        * (
+            (alpha_t**-0.5 - alpha_tm1**-0.5) * x_t
+            + ((1 / alpha_tm1 - 1) ** 0.5 - (1 / alpha_t - 1) ** 0.5) * eps_xt
+        )
+        + x_t
+    )
+
+
+class DDIMInversionTable(NamedTuple):
+    r"""Timesteps of a DDIM inversion schedule in processing order, with the `alpha_prod` pair used at every step."""
+
+    timesteps: torch.Tensor
+    alpha_t: torch.Tensor
+    alpha_tm1: torch.Tensor
+
+
+def ddim_inversion_table(
+    scheduler, num_inference_steps: int, reverse_process: bool = True, device: Optional[torch.device] = None
+) -> DDIMInversionTable:
+    r"""
+    Computes the `alphas_cumprod` lookups of [`~ConsistInstructPix2PixPipeline.get_latents`] for a whole schedule at
+    once, so that the inversion loop indexes precomputed tensors instead of the scheduler.
+    """
+    scheduler.set_timesteps(num_inference_steps)
+    timesteps = scheduler.timesteps.flip(0)
+    step_ratio = scheduler.config.num_train_timesteps // scheduler.num_inference_steps
+    prev_timesteps = timesteps - step_ratio
+
+    alphas_cumprod = scheduler.alphas_cumprod
+    alpha_t = alphas_cumprod[timesteps]
+    alpha_tm1 = torch.where(
+        prev_timesteps >= 0,
+        alphas_cumprod[prev_timesteps.clamp(min=0)],
+        torch.as_tensor(scheduler.final_alpha_cumprod, dtype=alphas_cumprod.dtype),
+    )
+    if reverse_process:
+        alpha_t, alpha_tm1 = alpha_tm1, alpha_t
+    return DDIMInversionTable(timesteps.to(device), alpha_t.to(device), alpha_tm1.to(device))
+
+
+class InversionNoiseStore:
+    r"""
+    On-disk store of inverted DDIM noise, one `.npy` file per sample.
+
+    Entries are keyed by the content of the inverted latents (deterministic for images encoded with the latent mode),
+    the inversion schedule and the content hash of the UNet that ran it.
+
+    Args:
+        cache_dir (`str`):
+            Directory the noise files are written to.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(latents: torch.Tensor, model_id: str, num_inference_steps: int, reverse_process: bool) -> str:
+        digest = hashlib.sha256(f"{model_id}:{num_inference_steps}:{reverse_process}".encode())
+        digest.update(str((tuple(latents.shape), latents.dtype)).encode())
+        digest.update(latents.detach().float().contiguous().cpu().numpy().tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key: str) -> Optional[torch.Tensor]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return torch.from_numpy(np.load(path))
+
+    def put(self, key: str, noise: torch.Tensor):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            np.save(f, noise.detach().float().cpu().numpy())
+        os.replace(f.name, path)
+
+
+class DDIMInversionMixin:
+    r"""
+    Batched DDIM inversion for [`ConsistInstructPix2PixPipeline`] with cached null-text embeddings, precomputed alpha
+    tables and an optional on-disk noise store.
+    """
+
+    def _null_text_embedding(self) -> torch.Tensor:
+        key = ("__null_text__", self.text_encoder.dtype, str(self.device))
+        cache = self.prompt_cache
+        if cache is not None:
+            cache.bind(self.text_encoder)
+            embedding = cache.get(key)
+            if embedding is not None:
+                return embedding
+        embedding = self.get_text_embedding("")
+        if cache is not None:
+            cache.put(key, embedding)
+        return embedding
+
+    def _inversion_table(self, num_inference_steps: int, reverse_process: bool) -> DDIMInversionTable:
+        tables: Dict = self.__dict__.setdefault("_inversion_tables", {})
+        key = (id(self.scheduler), num_inference_steps, reverse_process, str(self.device))
+        if key not in tables:
+            tables[key] = ddim_inversion_table(self.scheduler, num_inference_steps, reverse_process, self.device)
+        return tables[key]
+
+    @torch.no_grad()
+    def invert_latents(
+        self,
+        latents: torch.FloatTensor,
+        num_inference_steps: int = 20,
+        reverse_process: bool = True,
+        batch_size: Optional[int] = None,
+        noise_store: Optional[InversionNoiseStore] = None,
+    ) -> torch.FloatTensor:
+        r"""
+        Runs the DDIM inversion of [`~ConsistInstructPix2PixPipeline.get_latents`] on a batch of image latents.
+
+        Args:
+            latents (`torch.FloatTensor`):
+                Scaled image latents of shape `(batch_size, 4, height // 8, width // 8)`, e.g. from `get_image_latents`.
+            num_inference_steps (`int`, *optional*, defaults to 20):
+                Number of inversion steps.
+            reverse_process (`bool`, *optional*, defaults to `True`):
+                Whether to run from image to noise (inversion) or from noise to image.
+            batch_size (`int`, *optional*):
+                Maximum number of latents per UNet call. If not defined, all latents run together.
+            noise_store ([`~pipeline.inversion.InversionNoiseStore`], *optional*):
+                Loads previously inverted samples and saves new ones. Only the samples missing from the store are
+                inverted.
+
+        Returns:
+            `torch.FloatTensor`: the inverted latents, in input order.
+        """
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f"`batch_size` has to be a positive integer but is {batch_size}.")
+
+        outputs = [None] * latents.shape[0]
+        keys = None
+        if noise_store is not None:
+            model_id = module_content_hash(self.unet)
+            keys = [
+                InversionNoiseStore.make_key(latents[i], model_id, num_inference_steps, reverse_process)
+                for i in range(latents.shape[0])
+            ]
+            for i, key in enumerate(keys):
+                noise = noise_store.get(key)
+                if noise is not None:
+                    outputs[i] = noise.to(device=latents.device, dtype=latents.dtype)
+
+        missing = [i for i, out in enumerate(outputs) if out is None]
+        if len(missing) > 0:
+            table = self._inversion_table(num_inference_steps, reverse_process)
+            null_text = self._null_text_embedding()
+            chunk_size = batch_size or len(missing)
+            for start in range(0, len(missing), chunk_size):
+                indices = missing[start : start + chunk_size]
+                inverted = self._invert_batch(latents[indices], table, null_text)
+                for j, i in enumerate(indices):
+                    outputs[i] = inverted[j]
+                    if noise_store is not None:
+                        noise_store.put(keys[i], inverted[j])
+
+        return torch.stack(outputs)
+
+    def _invert_batch(self, latents: torch.FloatTensor, table: DDIMInversionTable, null_text: torch.Tensor):
+        latents = latents * self.scheduler.init_noise_sigma
+        text_embeddings = null_text.expand(latents.shape[0], -1, -1)
+        for i, t in enumerate(self.progress_bar(table.timesteps)):
+            latents = self.scheduler.scale_model_input(latents, t)
+            cat_image_latents = torch.cat([latents, latents], dim=1)
+            noise_pred = self.unet(cat_image_latents, t, encoder_hidden_states=text_embeddings).sample
+            latents = backward_ddim(
+                x_t=latents, alpha_t=table.alpha_t[i], alpha_tm1=table.alpha_tm1[i], eps_xt=noise_pred
+            )
+        return latents
@@ -0,0 +1,348 @@
+import hashlib
+import json
+import os
+import tempfile
+import weakref
+from collections import OrderedDict
+from typing import Callable, List, NamedTuple, Optional
+
+import numpy as np
+import torch
+
+from diffusers.utils import logging
+
+try:
+    from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+    from diffusers.models.modeling_outputs import AutoencoderKLOutput
+except ImportError:  # diffusers < 0.25
+    from diffusers.models.autoencoder_kl import AutoencoderKLOutput
+    from diffusers.models.vae import DiagonalGaussianDistribution
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+_fingerprints = weakref.WeakKeyDictionary()
+_content_hashes = weakref.WeakKeyDictionary()
+
+
+class LatentCacheInfo(NamedTuple):
+    memory_hits: int
+    disk_hits: int
+    misses: int
+    memory_entries: int
+    memory_bytes: int
+    disk_entries: int
+    disk_bytes: int
+
+
+def _module_digest(module: torch.nn.Module, dtype: torch.dtype, sparse: bool) -> str:
+    digest = hashlib.sha256()
+    digest.update(module.__class__.__name__.encode())
+    config = getattr(module, "config", {})
+    config = config.to_dict() if hasattr(config, "to_dict") else dict(config)
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+    digest.update(str(dtype).encode())
+    with torch.no_grad():
+        for name, value in module.state_dict().items():
+            digest.update(name.encode())
+            # quantized modules store packed `(weight, bias)` tuples and their dtype next to the tensors
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if not isinstance(tensor, torch.Tensor):
+                    digest.update(str(tensor).encode())
+                    continue
+                if tensor.is_quantized:
+                    tensor = tensor.dequantize()
+                flat = tensor.detach().flatten()
+                if sparse:
+                    flat = flat[:: max(1, flat.numel() // 64)][:64].float()
+                elif flat.dtype == torch.bfloat16:
+                    # numpy has no bfloat16; the upcast is exact
+                    flat = flat.float()
+                digest.update(str(tuple(tensor.shape)).encode())
+                digest.update(flat.contiguous().cpu().numpy())
+    return digest.hexdigest()
+
+
+def module_fingerprint(module: torch.nn.Module) -> str:
+    r"""
+    Returns a cheap identifier of a model: its class, config, dtype and a sparse sample of every weight tensor.
+
+    The fingerprint is memoised per module and dtype. It tells the models of one process apart; fine-tunes that only
+    change weights between the samples collide, so keys that outlive the process use [`module_content_hash`].
+    """
+    dtype = next(module.parameters()).dtype
+    memo = _fingerprints.get(module)
+    if memo is not None and memo[0] == dtype:
+        return memo[1]
+
+    fingerprint = _module_digest(module, dtype, sparse=True)
+    _fingerprints[module] = (dtype, fingerprint)
+    return fingerprint
+
+
+def module_content_hash(module: torch.nn.Module) -> str:
+    r"""
+    Returns the hash of a model's class, config, dtype and every byte of its weights.
+
+    Reading all weights costs a second or so per GB, once per module and dtype; the hash is stable across processes,
+    so entries written to disk by one run are found again by the next one only if the very same weights are loaded.
+    """
+    dtype = next(module.parameters()).dtype
+    memo = _content_hashes.get(module)
+    if memo is not None and memo[0] == dtype:
+        return memo[1]
+
+    content_hash = _module_digest(module, dtype, sparse=False)
+    _content_hashes[module] = (dtype, content_hash)
+    return content_hash
+
+
+def forget_fingerprint(module: torch.nn.Module):
+    r"""Drops the memoised fingerprint and content hash of a module whose weights were changed in place."""
+    _fingerprints.pop(module, None)
+    _content_hashes.pop(module, None)
+
+
+def image_digest(image: torch.Tensor, vae_id: str) -> str:
+    r"""Returns the content key of a single preprocessed image tensor for the VAE identified by `vae_id`."""
+    digest = hashlib.sha256(vae_id.encode())
+    digest.update(str((tuple(image.shape), image.dtype)).encode())
+    array = image.detach().contiguous()
+    if array.dtype == torch.bfloat16:
+        array = array.float()
+    digest.update(array.cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+class VaeLatentCache:
+    r"""
+    Two-tier, content-addressed cache of VAE latent distributions.
+
+    Entries hold the `DiagonalGaussianDistribution` parameters (mean and log-variance) of a single image, so both the
+    argmax latents of `prepare_image_latents` and the sampled latents of `prepare_sdedit_latents` are derived from one
+    encoder pass. Entries are keyed by the preprocessed image content and the VAE weights, which lets several pipelines
+    sharing the same VAE weights share one cache: the in-memory tier uses the cheap [`module_fingerprint`], the
+    on-disk tier the [`module_content_hash`], so files written for one checkpoint are never read for another.
+
+    Args:
+        max_memory_bytes (`int`, *optional*, defaults to 1 GiB):
+            Size limit of the in-memory LRU tier.
+        cache_dir (`str`, *optional*):
+            Directory of the on-disk tier. Entries are stored as `.npy` files and memory-mapped when read. If not
+            defined, only the in-memory tier is used.
+        max_disk_bytes (`int`, *optional*, defaults to 16 GiB):
+            Size limit of the on-disk tier; the least recently used files are deleted first.
+        storage_device (`str` or `torch.device`, *optional*, defaults to `"cpu"`):
+            Device the in-memory tier keeps its tensors on.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 1 << 30,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 16 << 30,
+        storage_device="cpu",
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.storage_device = torch.device(storage_device)
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan_disk()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".npy"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, name[: -len(".npy")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _put_memory(self, key: str, parameters: torch.Tensor):
+        size = parameters.numel() * parameters.element_size()
+        if size > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= self._memory[key].numel() * self._memory[key].element_size()
+        self._memory[key] = parameters
+        self._memory.move_to_end(key)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.numel() * evicted.element_size()
+
+    def _put_disk(self, key: str, parameters: torch.Tensor):
+        if parameters.dtype == torch.bfloat16:
+            parameters = parameters.float()
+        array = parameters.cpu().numpy()
+        if array.nbytes > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+            np.save(f, array)
+        os.replace(f.name, path)
+
+        size = os.path.getsize(path)
+        self._disk_bytes += size - self._disk.get(key, 0)
+        self._disk[key] = size
+        self._disk.move_to_end(key)
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_bytes -= evicted_size
+            try:
+                os.remove(self._path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def get(self, key: str, dtype: torch.dtype, disk_key: Optional[str] = None) -> Optional[torch.Tensor]:
+        r"""
+        Returns the cached distribution parameters for `key`, or `None`. The on-disk tier is looked up under `disk_key`
+        if given.
+        """
+        parameters = self._memory.get(key)
+        if parameters is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return parameters
+
+        disk_key = disk_key or key
+        if disk_key in self._disk:
+            path = self._path(disk_key)
+            try:
+                array = np.load(path, mmap_mode="c")
+            except (FileNotFoundError, ValueError, OSError):
+                self._disk_bytes -= self._disk.pop(disk_key)
+            else:
+                os.utime(path)
+                self._disk.move_to_end(disk_key)
+                parameters = torch.from_numpy(array).to(device=self.storage_device, dtype=dtype)
+                self._put_memory(key, parameters)
+                self.disk_hits += 1
+                return parameters
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, parameters: torch.Tensor, disk_key: Optional[str] = None):
+        r"""Stores the distribution parameters of a single image in both tiers, on disk under `disk_key` if given."""
+        parameters = parameters.detach().to(self.storage_device, copy=True)
+        self._put_memory(key, parameters)
+        if self.cache_dir is not None:
+            self._put_disk(disk_key or key, parameters)
+
+    def encode(self, vae, image: torch.Tensor, encode_fn: Optional[Callable] = None, variant: str = ""):
+        r"""
+        Drop-in replacement for `vae.encode(image)` that only runs the encoder on images missing from the cache.
+
+        Args:
+            encode_fn (`Callable`, *optional*):
+                Encoder used for the missing images. Defaults to `vae.encode`.
+            variant (`str`, *optional*):
+                Added to the keys when `encode_fn` does not match `vae.encode` exactly, e.g. tiled encoding.
+
+        Returns an [`AutoencoderKLOutput`] whose `latent_dist` covers the whole batch in input order.
+        """
+        encode_fn = encode_fn or vae.encode
+        vae_id = module_fingerprint(vae) + variant
+        keys = [image_digest(image[i], vae_id) for i in range(image.shape[0])]
+        disk_keys = keys
+        if self.cache_dir is not None and any(key not in self._memory for key in keys):
+            # files outlive the process, so they are keyed on every weight of the VAE rather than the sparse sample
+            disk_id = module_content_hash(vae) + variant
+            disk_keys = [image_digest(image[i], disk_id) for i in range(image.shape[0])]
+        dtype = next(vae.parameters()).dtype
+
+        parameters: List[Optional[torch.Tensor]] = [
+            self.get(key, dtype, disk_key) for key, disk_key in zip(keys, disk_keys)
+        ]
+        missing = [i for i, params in enumerate(parameters) if params is None]
+        if len(missing) > 0:
+            encoder_output = encode_fn(image[missing])
+            if not hasattr(encoder_output, "latent_dist"):
+                logger.warning(f"{vae.__class__.__name__} does not return a latent distribution; caching is skipped.")
+                return encode_fn(image) if len(missing) < image.shape[0] else encoder_output
+            encoded = encoder_output.latent_dist.parameters
+            for j, i in enumerate(missing):
+                parameters[i] = encoded[j]
+                self.put(keys[i], encoded[j], disk_keys[i])
+
+        parameters = torch.stack([params.to(device=image.device, dtype=dtype) for params in parameters])
+        return AutoencoderKLOutput(latent_dist=DiagonalGaussianDistribution(parameters))
+
+    def clear(self, disk: bool = False):
+        r"""Empties the in-memory tier, and the on-disk tier too if `disk` is `True`."""
+        self._memory.clear()
+        self._memory_bytes = 0
+        if disk and self.cache_dir is not None:
+            for key in list(self._disk):
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._disk.clear()
+            self._disk_bytes = 0
+
+    def info(self) -> LatentCacheInfo:
+        r"""Returns the hit and miss counters and the current size of both tiers."""
+        return LatentCacheInfo(
+            self.memory_hits,
+            self.disk_hits,
+            self.misses,
+            len(self._memory),
+            self._memory_bytes,
+            len(self._disk),
+            self._disk_bytes,
+        )
+
+
+class LatentCacheMixin:
+    r"""
+    Routes the VAE encoder passes of a pipeline through an optional [`VaeLatentCache`].
+
+    The cache is disabled by default. Pass the same cache instance to several pipelines to share encoded latents
+    between them.
+    """
+
+    latent_cache: Optional[VaeLatentCache] = None
+
+    def enable_latent_cache(self, latent_cache: Optional[VaeLatentCache] = None, **kwargs) -> VaeLatentCache:
+        r"""
+        Enables VAE latent caching.
+
+        Args:
+            latent_cache ([`VaeLatentCache`], *optional*):
+                The cache to use. If not defined, a new one is created from `kwargs`.
+        """
+        self.latent_cache = latent_cache if latent_cache is not None else VaeLatentCache(**kwargs)
+        return self.latent_cache
+
+    def disable_latent_cache(self):
+        r"""Disables VAE latent caching."""
+        self.latent_cache = None
+
+    def _vae_encode(self, image: torch.Tensor):
+        encode_fn = getattr(self, "_vae_encode_pixels", self.vae.encode)
+        if self.latent_cache is None:
+            return encode_fn(image)
+        tiling = self.vae_tiling(image.shape[0]) if getattr(self, "vae_tiling_enabled", False) else None
+        variant = f"tiled{tiling}" if tiling is not None and max(image.shape[-2:]) > tiling[0] else ""
+        if getattr(self, "cpu_bf16_enabled", False):
+            variant += "bf16"
+        return self.latent_cache.encode(self.vae, image, encode_fn=encode_fn, variant=variant)
@@ -0,0 +1,238 @@
+import glob
+import importlib
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+import torch
+
+from diffusers.utils import logging
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+class LoadReport(NamedTuple):
+    r"""
+    Where the time and bytes of [`~MmapLoadingMixin.from_mmap_pretrained`] went: `mapped_bytes` are weights used in
+    place from the memory-mapped files, `copied_bytes` weights that had to be copied (dtype casts, misaligned tensors
+    or the move to a non-CPU device).
+    """
+
+    seconds: float
+    component_seconds: Dict[str, float]
+    mapped_bytes: int
+    copied_bytes: int
+
+
+def mmap_safetensors(path: str, prefetch: bool = False) -> Tuple[Dict[str, torch.Tensor], int]:
+    r"""
+    Maps a `.safetensors` file into memory and returns its tensors as views of the mapping, together with the number of
+    bytes that had to be copied because a tensor was not aligned to its element size.
+
+    The mapping is private (copy-on-write): pages are shared with the page cache, and with every other process mapping
+    the same file, until a tensor is written to.
+
+    Args:
+        prefetch (`bool`, *optional*, defaults to `False`):
+            Asks the kernel to start reading the whole file in the background, so the first forward pass does not
+            fault in the weights page by page.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if prefetch and hasattr(mmap, "MADV_WILLNEED"):
+        buffer.madvise(mmap.MADV_WILLNEED)
+
+    data_start = 8 + header_size
+    tensors = {}
+    copied = 0
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        if info["dtype"] not in _SAFETENSORS_DTYPES:
+            raise ValueError(f"Tensor {name} in {path} has the unsupported dtype {info['dtype']}.")
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        offset = data_start + begin
+        if end == begin:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        elif offset % itemsize == 0:
+            tensors[name] = torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // itemsize, offset=offset)
+            tensors[name] = tensors[name].view(info["shape"])
+        else:
+            raw = torch.frombuffer(buffer, dtype=torch.uint8, count=end - begin, offset=offset)
+            tensors[name] = raw.clone().view(dtype).view(info["shape"])
+            copied += end - begin
+    return tensors, copied
+
+
+def _weight_files(directory: str, variant: Optional[str]) -> list:
+    files = sorted(glob.glob(os.path.join(directory, "*.safetensors")))
+    if variant is not None:
+        matching = [f for f in files if f".{variant}." in os.path.basename(f)]
+        if len(matching) > 0:
+            return matching
+    return [f for f in files if os.path.basename(f).count(".") == 1] or files
+
+
+def _empty_model(library: str, class_name: str, directory: str) -> torch.nn.Module:
+    from accelerate import init_empty_weights
+
+    cls = getattr(importlib.import_module(library), class_name)
+    with init_empty_weights():
+        if library == "transformers":
+            config = cls.config_class.from_pretrained(directory)
+            return cls(config)
+        return cls.from_config(cls.load_config(directory))
+
+
+def _load_model(
+    library: str, class_name: str, directory: str, dtype, variant, prefetch
+) -> Tuple[torch.nn.Module, int, int]:
+    state_dict = {}
+    copied = 0
+    for path in _weight_files(directory, variant):
+        tensors, misaligned = mmap_safetensors(path, prefetch=prefetch)
+        state_dict.update(tensors)
+        copied += misaligned
+    if len(state_dict) == 0:
+        raise ValueError(f"No `.safetensors` weights found in {directory}.")
+
+    if dtype is not None:
+        for name, tensor in state_dict.items():
+            if tensor.is_floating_point() and tensor.dtype != dtype:
+                state_dict[name] = tensor.to(dtype)
+                copied += state_dict[name].numel() * state_dict[name].element_size()
+
+    model = _empty_model(library, class_name, directory)
+    model.load_state_dict(state_dict, strict=True, assign=True)
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if len(missing) > 0:
+        raise ValueError(f"The weights in {directory} do not initialise {missing[:5]} of {class_name}.")
+    model.eval()
+
+    total = sum(tensor.numel() * tensor.element_size() for tensor in state_dict.values())
+    return model, total - copied, copied
+
+
+class MmapLoadingMixin:
+    r"""
+    Fast cold start for the decorruptor pipelines: weights saved by [`~MmapLoadingMixin.save_mmap_pretrained`] are
+    memory-mapped straight into the model parameters instead of being deserialised into fresh allocations and cast.
+    """
+
+    def save_mmap_pretrained(self, save_directory: str, dtype: Optional[torch.dtype] = torch.float16):
+        r"""
+        Saves the pipeline in the layout of `save_pretrained`, with all floating point weights converted to `dtype`
+        and stored as safetensors, ready for [`~MmapLoadingMixin.from_mmap_pretrained`]. The pipeline itself is
+        converted to `dtype` in place.
+        """
+        if dtype is not None:
+            self.to(dtype=dtype)
+        self.save_pretrained(save_directory, safe_serialization=True)
+
+    @classmethod
+    def from_mmap_pretrained(
+        cls,
+        pretrained_model_path: str,
+        torch_dtype: Optional[torch.dtype] = None,
+        device: Optional[Union[str, torch.device]] = None,
+        variant: Optional[str] = None,
+        prefetch: bool = False,
+        **kwargs,
+    ):
+        r"""
+        Loads a pipeline from a local directory by memory-mapping its safetensors weights.
+
+        Models are created without initialising their weights and take the mapped tensors as parameters, so no weight
+        is read, allocated or copied at load time; pages are read from disk on first use and are shared by every
+        process that loads the same files. Weights stored in `torch_dtype` are used as they are; only weights in
+        another dtype are cast, which copies them.
+
+        Args:
+            pretrained_model_path (`str`):
+                A directory written by [`~MmapLoadingMixin.save_mmap_pretrained`] or `save_pretrained` with
+                `safe_serialization=True`.
+            torch_dtype (`torch.dtype`, *optional*):
+                The dtype of the floating point weights. Keeps the stored dtype if not defined.
+            device (`str` or `torch.device`, *optional*):
+                Moves the pipeline there after loading, which copies the weights once. Stays on the CPU if not defined.
+            variant (`str`, *optional*):
+                Loads the weight files of this variant, e.g. `"fp16"`, when present.
+            prefetch (`bool`, *optional*, defaults to `False`):
+                Starts reading all weight files in the background.
+            kwargs:
+                Components to use instead of loading them, e.g. `scheduler=...` or `safety_checker=None`.
+
+        Returns:
+            The pipeline. Its `load_report` attribute holds a [`~pipeline.mmap_loading.LoadReport`].
+        """
+        start = time.perf_counter()
+        with open(os.path.join(pretrained_model_path, "model_index.json")) as f:
+            model_index = json.load(f)
+
+        components = {}
+        component_seconds = {}
+        mapped = copied = 0
+        init_kwargs = {}
+        for name, value in model_index.items():
+            if name.startswith("_"):
+                continue
+            if not isinstance(value, list):
+                init_kwargs[name] = value
+                continue
+            if name in kwargs:
+                components[name] = kwargs.pop(name)
+                continue
+            library, class_name = value
+            if library is None:
+                components[name] = None
+                continue
+
+            component_start = time.perf_counter()
+            directory = os.path.join(pretrained_model_path, name)
+            component_cls = getattr(importlib.import_module(library), class_name)
+            if issubclass(component_cls, torch.nn.Module):
+                components[name], component_mapped, component_copied = _load_model(
+                    library, class_name, directory, torch_dtype, variant, prefetch
+                )
+                mapped += component_mapped
+                copied += component_copied
+            elif hasattr(component_cls, "from_pretrained"):
+                components[name] = component_cls.from_pretrained(directory)
+            else:
+                components[name] = component_cls.from_config(component_cls.load_config(directory))
+            component_seconds[name] = time.perf_counter() - component_start
+
+        init_kwargs.update(kwargs)
+        pipe = cls(**components, **init_kwargs)
+        pipe.register_to_config(_name_or_path=pretrained_model_path)
+        if device is not None and torch.device(device).type != "cpu":
+            pipe.to(device)
+            copied += mapped
+            mapped = 0
+
+        pipe.load_report = LoadReport(time.perf_counter() - start, component_seconds, mapped, copied)
+        logger.info(
+            f"Loaded {cls.__name__} in {pipe.load_report.seconds:.2f}s: {mapped / 2**20:.0f} MiB mapped,"
+            f" {copied / 2**20:.0f} MiB copied."
+        )
+        return pipe
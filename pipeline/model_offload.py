@@ -0,0 +1,300 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+import torch
+
+# The stages of a call in the order they run; the VAE is split into its encoder and decoder halves, which are never
+# needed at the same time.
+_STAGES = (
+    ("image_encoder", "image_encoder", ()),
+    ("text_encoder", "text_encoder", ()),
+    ("vae_encoder", "vae", ("encoder", "quant_conv")),
+    ("unet", "unet", ()),
+    ("vae_decoder", "vae", ("post_quant_conv", "decoder")),
+    ("safety_checker", "safety_checker", ()),
+)
+
+
+class StageResidency(NamedTuple):
+    r"""
+    What was on the compute device when a stage of a call started: `resident` lists the stages whose weights were
+    loaded (or being prefetched), `wait_seconds` is the time the stage waited for its own weights (0 when the prefetch
+    finished in time), and `prefetching` names the stage whose weights started loading in the background.
+    `device_allocated_bytes` is the allocator's view of the device, `None` on devices without one.
+    """
+
+    stage: str
+    resident: Tuple[str, ...]
+    resident_bytes: int
+    wait_seconds: float
+    prefetching: Optional[str]
+    device_allocated_bytes: Optional[int]
+
+
+class _Stage:
+    def __init__(self, name: str, modules: List[torch.nn.Module], pin_memory: bool):
+        self.name = name
+        self.modules = modules
+        self.tensors = []
+        seen = set()
+        for module in modules:
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                if id(tensor) in seen:
+                    continue
+                seen.add(id(tensor))
+                host = tensor.data.to("cpu")
+                if pin_memory:
+                    host = host.pin_memory()
+                tensor.data = host
+                self.tensors.append((tensor, host))
+        self.bytes = sum(host.numel() * host.element_size() for _, host in self.tensors)
+        self.resident = False
+        self.pending = None
+
+
+class _StageHook:
+    r"""An accelerate `ModelHook` that loads the weights of its stage before the module runs."""
+
+    no_grad = False
+
+    def __init__(self, offloader: "_SequentialOffloader", stage: Optional[str]):
+        self.offloader = offloader
+        self.stage = stage
+        self.execution_device = offloader.device
+
+    def init_hook(self, module):
+        return module
+
+    def pre_forward(self, module, *args, **kwargs):
+        from accelerate.utils import send_to_device
+
+        if self.stage is not None:
+            self.offloader.activate(self.stage)
+        return send_to_device(args, self.execution_device), send_to_device(kwargs, self.execution_device)
+
+    def post_forward(self, module, output):
+        return output
+
+    def detach_hook(self, module):
+        return module
+
+
+class _SequentialOffloader:
+    def __init__(self, pipe, device: torch.device, memory_budget: Optional[int], prefetch: bool, pin_memory: bool):
+        self.device = device
+        self.memory_budget = memory_budget
+        self.prefetch = prefetch
+        self.stages: Dict[str, _Stage] = OrderedDict()
+        for name, component, children in _STAGES:
+            model = getattr(pipe, component, None)
+            if not isinstance(model, torch.nn.Module):
+                continue
+            modules = [getattr(model, child) for child in children] if children else [model]
+            modules = [module for module in modules if module is not None]
+            if modules:
+                self.stages[name] = _Stage(name, modules, pin_memory)
+        if memory_budget is not None:
+            too_large = {name: stage.bytes for name, stage in self.stages.items() if stage.bytes > memory_budget}
+            if too_large:
+                raise ValueError(
+                    f"`memory_budget` of {memory_budget} bytes cannot hold the stages {too_large} on their own; use"
+                    " `enable_sequential_cpu_offload` to offload layer by layer instead."
+                )
+        order = list(self.stages)
+        # the stage that followed each stage last time; calls that skip a stage (cached prompt embeddings or VAE
+        # latents, gated inputs) then prefetch the one that actually runs next
+        self.successor = {name: order[(index + 1) % len(order)] for index, name in enumerate(order)}
+        self.current = None
+        self.lru: "OrderedDict[str, None]" = OrderedDict()
+        self.report: List[StageResidency] = []
+        self.stream = torch.cuda.Stream(device) if device.type == "cuda" else None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="model-offload-prefetch")
+
+    def _load(self, stage: _Stage):
+        # runs on the prefetch thread: only copies, the weights are swapped in on the calling thread
+        if self.stream is None:
+            return [host.to(self.device) for _, host in stage.tensors], None
+        with torch.cuda.stream(self.stream):
+            loaded = [host.to(self.device, non_blocking=True) for _, host in stage.tensors]
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return loaded, event
+
+    def _start(self, stage: _Stage):
+        stage.pending = self.executor.submit(self._load, stage)
+        self.lru[stage.name] = None
+
+    def _finish(self, stage: _Stage):
+        loaded, event = stage.pending.result()
+        stage.pending = None
+        if event is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(event)
+            for tensor in loaded:
+                # allocated on the copy stream but freed after use on the compute stream
+                tensor.record_stream(current_stream)
+        for (tensor, _), value in zip(stage.tensors, loaded):
+            tensor.data = value
+        stage.resident = True
+
+    def _evict(self, stage: _Stage):
+        if stage.pending is not None:
+            stage.pending.result()
+            stage.pending = None
+        # the host copy is kept, so offloading a stage only drops its device tensors
+        for tensor, host in stage.tensors:
+            tensor.data = host
+        stage.resident = False
+        self.lru.pop(stage.name, None)
+
+    def _resident_bytes(self) -> int:
+        return sum(self.stages[name].bytes for name in self.lru)
+
+    def _make_room(self, num_bytes: int, keep: Tuple[str, ...]) -> bool:
+        candidates = [self.stages[name] for name in self.lru if name not in keep]
+        if self.memory_budget is None:
+            # no budget: only the running stage and the one being prefetched stay on the device
+            evict = candidates
+        else:
+            evict = []
+            resident = self._resident_bytes()
+            for stage in candidates:
+                if resident + num_bytes <= self.memory_budget:
+                    break
+                evict.append(stage)
+                resident -= stage.bytes
+            if resident + num_bytes > self.memory_budget:
+                return False
+        for stage in evict:
+            self._evict(stage)
+        return True
+
+    def activate(self, name: str):
+        if name == self.current:
+            return
+        start = time.perf_counter()
+        stage = self.stages[name]
+        if not stage.resident and stage.pending is None:
+            self._make_room(stage.bytes, keep=(name,))
+            self._start(stage)
+        if stage.pending is not None:
+            self._finish(stage)
+        self.lru.move_to_end(name)
+        if self.current is not None:
+            self.successor[self.current] = name
+        self.current = name
+        wait_seconds = time.perf_counter() - start
+
+        prefetching = None
+        following = self.successor[name]
+        upcoming = self.stages[following]
+        if self.prefetch and following != name and not upcoming.resident and upcoming.pending is None:
+            if self._make_room(upcoming.bytes, keep=(name, following)):
+                self._start(upcoming)
+                prefetching = following
+
+        allocated = torch.cuda.memory_allocated(self.device) if self.device.type == "cuda" else None
+        self.report.append(
+            StageResidency(
+                stage=name,
+                resident=tuple(self.lru),
+                resident_bytes=self._resident_bytes(),
+                wait_seconds=wait_seconds,
+                prefetching=prefetching,
+                device_allocated_bytes=allocated,
+            )
+        )
+
+    def close(self):
+        for stage in self.stages.values():
+            self._evict(stage)
+        self.executor.shutdown(wait=True)
+
+
+class ModelOffloadMixin:
+    r"""
+    Memory-budgeted sequential placement of the pipeline components, for hosts whose accelerator cannot hold the text
+    encoder, the VAE and the 8-channel UNet at once.
+    """
+
+    _model_offloader: Optional[_SequentialOffloader] = None
+
+    @property
+    def model_offload_enabled(self) -> bool:
+        return self._model_offloader is not None
+
+    @property
+    def offload_report(self) -> List[StageResidency]:
+        r"""The [`StageResidency`] of every stage of the last call, in the order the stages ran."""
+        return [] if self._model_offloader is None else list(self._model_offloader.report)
+
+    def enable_model_offload(
+        self,
+        device: Union[str, torch.device] = "cuda",
+        memory_budget: Optional[int] = None,
+        prefetch: bool = True,
+        pin_memory: Optional[bool] = None,
+    ):
+        r"""
+        Keeps the weights of every component in host memory and loads them onto `device` only for the stages that
+        need them: image encoder, text encoder, VAE encoder, UNet, VAE decoder and safety checker.
+
+        Unlike `enable_model_cpu_offload`, the weights are never copied back: the host copy is kept, so offloading a
+        stage is free, and while one stage runs the next one is loaded on a background thread (and a separate CUDA
+        stream), so its transfer overlaps with the compute of the current one.
+
+        Args:
+            device (`str` or `torch.device`, *optional*, defaults to `"cuda"`):
+                The compute device.
+            memory_budget (`int`, *optional*):
+                Bytes of weights that may be on `device` at once. Stages stay loaded between calls as long as they
+                fit, the least recently used are offloaded first, and the next stage is only prefetched when it fits
+                next to the running one. If not defined, only the running stage and the prefetched next one are on
+                the device.
+            prefetch (`bool`, *optional*, defaults to `True`):
+                Loads the next stage while the current one runs.
+            pin_memory (`bool`, *optional*):
+                Keeps the host copies in page-locked memory for asynchronous copies. Defaults to `True` for CUDA.
+
+        The weights must not be changed while the offload is enabled (LoRA fusing, quantization, `pipe.to`); call
+        [`~ModelOffloadMixin.disable_model_offload`] first.
+        """
+        from accelerate.hooks import add_hook_to_module
+
+        device = torch.device(device)
+        if device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+        if getattr(self, "_compiled_step", None) is not None:
+            raise ValueError("Model offload cannot be combined with `enable_compiled_step`.")
+        self.disable_model_offload()
+        if pin_memory is None:
+            pin_memory = device.type == "cuda"
+
+        offloader = _SequentialOffloader(self, device, memory_budget, prefetch, pin_memory)
+        for name, stage in offloader.stages.items():
+            for module in stage.modules:
+                add_hook_to_module(module, _StageHook(offloader, name))
+        # every component carries a hook, so `_execution_device` resolves to the compute device
+        for component in self.components.values():
+            if isinstance(component, torch.nn.Module) and not hasattr(component, "_hf_hook"):
+                add_hook_to_module(component, _StageHook(offloader, None))
+        self._model_offloader = offloader
+        return offloader
+
+    def disable_model_offload(self):
+        r"""Removes the offload hooks and leaves every component in host memory."""
+        if self._model_offloader is None:
+            return
+        from accelerate.hooks import remove_hook_from_module
+
+        for component in self.components.values():
+            if isinstance(component, torch.nn.Module):
+                remove_hook_from_module(component, recurse=True)
+        self._model_offloader.close()
+        self._model_offloader = None
+
+    def _offload_start_call(self):
+        if self._model_offloader is not None:
+            self._model_offloader.report = []
@@ -0,0 +1,363 @@
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import PIL.Image
+import torch
+
+_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+
+def to_uint8(image: torch.Tensor, do_denormalize: Optional[List[bool]] = None) -> torch.Tensor:
+    r"""
+    Converts a batch of decoded VAE images in `[-1, 1]`, of shape `(batch_size, num_channels, height, width)`, to a
+    `uint8` CPU tensor of shape `(batch_size, height, width, num_channels)`.
+
+    The quantisation runs on the device the images were decoded on, so only a quarter of the fp32 bytes is copied to
+    the host. Images whose `do_denormalize` entry is `False` (blacked out by the safety checker) are taken as `[0, 1]`.
+    """
+    if do_denormalize is None or all(do_denormalize):
+        image = image / 2 + 0.5
+    else:
+        denormalize = torch.tensor(do_denormalize, device=image.device).view(-1, 1, 1, 1)
+        image = torch.where(denormalize, image / 2 + 0.5, image)
+    image = (image.float().clamp(0, 1) * 255).round().to(torch.uint8)
+    return image.permute(0, 2, 3, 1).contiguous().cpu()
+
+
+def encode_image(array: np.ndarray, format: str, quality: int = 95, compress_level: int = 1) -> Tuple[bytes, float]:
+    r"""Encodes one `(height, width, num_channels)` `uint8` array and returns the bytes and the seconds it took."""
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    image = PIL.Image.fromarray(array)
+    if format == "png":
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    else:
+        image.save(buffer, format=format.upper(), quality=quality)
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+class DirectoryWriter:
+    r"""Writes every encoded image to `root/<name>`, creating sub-directories as needed."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._directories = set()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.root, name)
+        directory = os.path.dirname(path)
+        if directory not in self._directories:
+            os.makedirs(directory, exist_ok=True)
+            self._directories.add(directory)
+        # written under a temporary name, so an interrupted run never leaves a truncated image behind
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def repair_tar_shard(path: str) -> int:
+    r"""
+    Cuts a tar shard left behind by an interrupted run after its last complete member and closes the archive, so tar
+    readers do not fail on a truncated member. Returns the number of members kept.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(max(0, size - 2 * tarfile.BLOCKSIZE))
+        if size >= 2 * tarfile.BLOCKSIZE and f.read() == bytes(2 * tarfile.BLOCKSIZE):
+            # ends with the end-of-archive blocks: closed properly
+            return -1
+
+    end, members = 0, 0
+    try:
+        with tarfile.open(path, "r:") as tar:
+            for member in tar:
+                member_end = member.offset_data + -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                if member_end > size:
+                    break
+                end, members = member_end, members + 1
+    except tarfile.ReadError:
+        # a truncated header or member data; everything before it is kept
+        pass
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(bytes(2 * tarfile.BLOCKSIZE))
+    return members
+
+
+class TarShardWriter:
+    r"""
+    Appends encoded images to a sequence of uncompressed tar shards, `pattern % shard_index`, starting a new shard
+    after `max_count` images or `max_bytes` bytes. The layout is readable by webdataset-style loaders. Existing shards
+    are never overwritten: numbering continues after them, so a resumed run adds new shards. The existing shards a
+    killed run left open are closed with [`repair_tar_shard`] first.
+
+    Every image is flushed to the operating system before `write` returns its location, so a location recorded by a
+    resumable run is complete even if the process is killed; [`~TarShardWriter.sync`] also makes it survive a power
+    loss.
+    """
+
+    def __init__(self, pattern: str, max_count: int = 10000, max_bytes: Optional[int] = None):
+        if "%" not in pattern:
+            raise ValueError("`pattern` has to contain a `%` format for the shard index, e.g. 'out-%06d.tar'.")
+        self.pattern = pattern
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.shard = -1
+        self._tar = self._file = None
+        self._count = self._bytes = 0
+        index = 0
+        while os.path.exists(pattern % index):
+            repair_tar_shard(pattern % index)
+            index += 1
+
+    def _next_shard(self):
+        self.close()
+        self.shard += 1
+        while os.path.exists(self.pattern % self.shard):
+            self.shard += 1
+        path = self.pattern % self.shard
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "wb")
+        self._tar = tarfile.open(fileobj=self._file, mode="w")
+        self._count = self._bytes = 0
+
+    def write(self, name: str, data: bytes) -> str:
+        full = self._tar is None or self._count >= self.max_count
+        if self.max_bytes is not None and self._count > 0 and self._bytes + len(data) > self.max_bytes:
+            full = True
+        if full:
+            self._next_shard()
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        self._file.flush()
+        self._count += 1
+        self._bytes += len(data)
+        return f"{self.pattern % self.shard}:{name}"
+
+    def sync(self):
+        r"""Forces the images written so far to disk."""
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._tar = self._file = None
+
+
+class SinkStats(NamedTuple):
+    r"""
+    Throughput of an [`OutputSink`], separate from the inference that feeds it. `encode_images_per_second` is images
+    per second of encoding time summed over the pool, i.e. the rate of one worker; `images_per_second` is the end to
+    end rate from the first `submit` to the last write; `blocked_seconds` is the time `submit` waited for a free
+    slot, i.e. the time inference was held back by encoding and writing.
+    """
+
+    images: int
+    bytes: int
+    encode_seconds: float
+    write_seconds: float
+    blocked_seconds: float
+    wall_seconds: float
+    encode_images_per_second: float
+    images_per_second: float
+
+
+class OutputSink:
+    r"""
+    Encodes pipeline outputs on a bounded pool of threads or processes and writes them, in submission order, to a
+    directory or to tar shards.
+
+    Pass it to either decorruptor pipeline as `output_sink` to hand over the decoded images as `uint8` tensors
+    instead of PIL images, or call [`~OutputSink.submit`] directly. `submit` returns as soon as the images are
+    queued and blocks once `max_pending` images are waiting, so a slow disk slows the producer down instead of
+    filling the memory.
+
+    Args:
+        writer (`str`, [`DirectoryWriter`] or [`TarShardWriter`]):
+            Where the encoded images go. A `str` is a directory.
+        format (`str`, *optional*, defaults to `"png"`):
+            `"png"`, `"jpeg"` or `"webp"`.
+        num_workers (`int`, *optional*, defaults to 4):
+            Size of the encoder pool.
+        max_pending (`int`, *optional*, defaults to 64):
+            Images that may be queued or being encoded before `submit` blocks.
+        use_processes (`bool`, *optional*, defaults to `False`):
+            Encodes in worker processes instead of threads, for formats whose encoder holds the GIL.
+        quality (`int`, *optional*, defaults to 95):
+            JPEG and WebP quality.
+        compress_level (`int`, *optional*, defaults to 1):
+            PNG zlib level; 1 is several times faster than PIL's default 6 at a slightly larger size.
+        on_write (`Callable[[str, str], None]`, *optional*):
+            Called from the writer thread with the key and the location of every written image.
+    """
+
+    def __init__(
+        self,
+        writer: Union[str, DirectoryWriter, TarShardWriter],
+        format: str = "png",
+        num_workers: int = 4,
+        max_pending: int = 64,
+        use_processes: bool = False,
+        quality: int = 95,
+        compress_level: int = 1,
+        on_write: Optional[Callable[[str, str], None]] = None,
+    ):
+        if format not in _EXTENSIONS:
+            raise ValueError(f"`format` has to be one of {list(_EXTENSIONS)} but is {format}.")
+        if num_workers < 1 or max_pending < 1:
+            raise ValueError(
+                f"`num_workers` and `max_pending` have to be positive but are {num_workers} and {max_pending}."
+            )
+        self.writer = DirectoryWriter(writer) if isinstance(writer, str) else writer
+        self.format = format
+        self.extension = _EXTENSIONS[format]
+        self.encode_kwargs = {"quality": quality, "compress_level": compress_level}
+        self.on_write = on_write
+
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor_class(num_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = queue.Queue()
+        self._error = None
+        self._next_key = 0
+        self._images = self._bytes = 0
+        self._encode_s = self._write_s = self._blocked_s = 0.0
+        self._first_submit = self._last_write = None
+        self._writer_thread = threading.Thread(target=self._write_loop, name="output-sink-writer", daemon=True)
+        self._writer_thread.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            key, future = item
+            try:
+                if self._error is None:
+                    data, encode_s = future.result()
+                    start = time.perf_counter()
+                    location = self.writer.write(key + self.extension, data)
+                    self._last_write = time.perf_counter()
+                    self._write_s += self._last_write - start
+                    self._encode_s += encode_s
+                    self._images += 1
+                    self._bytes += len(data)
+                    if self.on_write is not None:
+                        self.on_write(key, location)
+            except Exception as e:  # noqa: BLE001 - re-raised by the next `submit` or by `close`
+                self._error = e
+            finally:
+                self._slots.release()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Writing an output image failed: {self._error}") from self._error
+
+    def submit(
+        self,
+        images: Union[torch.Tensor, np.ndarray, Sequence[PIL.Image.Image]],
+        keys: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        r"""
+        Queues images for encoding and writing and returns their keys.
+
+        Args:
+            images (`torch.Tensor`, `np.ndarray` or `List[PIL.Image.Image]`):
+                `uint8` images of shape `(batch_size, height, width, num_channels)`, as returned by [`to_uint8`], or
+                PIL images.
+            keys (`Sequence[str]`, *optional*):
+                Names the images are stored under, without extension; may contain `/`. Defaults to a running
+                zero-padded counter.
+        """
+        self._check_error()
+        if self._executor is None:
+            raise RuntimeError("The output sink is closed.")
+        if isinstance(images, torch.Tensor):
+            images = images.cpu().numpy()
+        if isinstance(images, np.ndarray):
+            if images.dtype != np.uint8 or images.ndim != 4:
+                raise ValueError(f"`images` have to be `uint8` (N, H, W, C) but are {images.dtype} {images.shape}.")
+            arrays = list(images)
+        else:
+            arrays = [np.asarray(image) for image in images]
+        if keys is None:
+            keys = self.reserve_keys(len(arrays))
+        elif len(keys) != len(arrays):
+            raise ValueError(f"Got {len(keys)} keys for {len(arrays)} images.")
+
+        if self._first_submit is None:
+            self._first_submit = time.perf_counter()
+        for key, array in zip(keys, arrays):
+            start = time.perf_counter()
+            self._slots.acquire()
+            self._blocked_s += time.perf_counter() - start
+            future = self._executor.submit(encode_image, array, self.format, **self.encode_kwargs)
+            self._queue.put((key, future))
+        return list(keys)
+
+    def reserve_keys(self, count: int) -> List[str]:
+        r"""Returns the next `count` keys of the running counter, for callers that submit the images out of order."""
+        keys = [f"{self._next_key + i:08d}" for i in range(count)]
+        self._next_key += count
+        return keys
+
+    def flush(self):
+        r"""Waits until every queued image is written."""
+        self._queue.put(None)
+        self._writer_thread.join()
+        if self._executor is not None:
+            self._writer_thread = threading.Thread(target=self._write_loop, name="output-sink-writer", daemon=True)
+            self._writer_thread.start()
+        self._check_error()
+
+    def close(self):
+        r"""Writes every queued image, closes the writer and re-raises the first error."""
+        if self._executor is None:
+            return
+        executor, self._executor = self._executor, None
+        try:
+            self.flush()
+        finally:
+            executor.shutdown(wait=True)
+            self.writer.close()
+
+    @property
+    def stats(self) -> SinkStats:
+        wall = 0.0 if self._first_submit is None else (self._last_write or self._first_submit) - self._first_submit
+        return SinkStats(
+            images=self._images,
+            bytes=self._bytes,
+            encode_seconds=self._encode_s,
+            write_seconds=self._write_s,
+            blocked_seconds=self._blocked_s,
+            wall_seconds=wall,
+            encode_images_per_second=self._images / self._encode_s if self._encode_s > 0 else 0.0,
+            images_per_second=self._images / wall if wall > 0 else 0.0,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
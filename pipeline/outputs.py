@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import torch
+
+from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
+
+
+@dataclass
+class DecorruptorPipelineOutput(StableDiffusionPipelineOutput):
+    """
+    Output class for the decorruptor pipelines.
+
+    Args:
+        images (`List[PIL.Image.Image]`, `np.ndarray` or `torch.Tensor`)
+            List of denoised PIL images of length `batch_size` or NumPy array of shape `(batch_size, height, width,
+            num_channels)`. With `output_type="classifier"`, a normalised tensor of shape `(batch_size, num_channels,
+            height, width)` on the execution device.
+        nsfw_content_detected (`List[bool]`)
+            List indicating whether the corresponding generated image contains "not-safe-for-work" (nsfw) content or
+            `None` if safety checking could not be performed.
+        num_inference_steps_used (`List[int]`, *optional*)
+            Number of denoising steps every image actually ran. Smaller than the scheduled number of steps for images
+            that left the loop early.
+        classifier_logits (`torch.Tensor`, *optional*)
+            Output of the `classifier` passed to the pipeline, or `None` if no classifier was run.
+        timings (`List[Dict]`, *optional*)
+            Stage and denoising-step events recorded while profiling is enabled, see
+            [`~pipeline.profiling.PipelineProfiler`]; `None` otherwise.
+        corruption_detected (`List[bool]`, *optional*)
+            With a corruption gate enabled, whether every image was sent to the decorruptor (`True`) or passed through
+            unchanged (`False`); `None` otherwise.
+        corruption_scores (`List[float]`, *optional*)
+            The gate's corruption probability of every image, or `None` without a gate.
+        severity (`List[float]`, *optional*)
+            With a `severity_schedule`, the estimated corruption severity that picked every image's SDEdit schedule;
+            `None` otherwise.
+    """
+
+    num_inference_steps_used: Optional[List[int]] = None
+    classifier_logits: Optional[torch.Tensor] = None
+    timings: Optional[List[Dict]] = None
+    corruption_detected: Optional[List[bool]] = None
+    corruption_scores: Optional[List[float]] = None
+    severity: Optional[List[float]] = None
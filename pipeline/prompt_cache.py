@@ -0,0 +1,165 @@
+import weakref
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Union
+
+import torch
+
+
+class PromptCacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    max_size: int
+    current_size: int
+
+
+class PromptEmbedsCache:
+    r"""
+    Bounded LRU cache of text-encoder outputs, keyed by everything `_encode_prompt` depends on.
+
+    Entries are bound to a single text encoder instance; the cache empties itself as soon as it is queried on behalf
+    of a different encoder.
+
+    Args:
+        max_size (`int`, *optional*, defaults to 8):
+            Maximum number of cached embeddings. The least recently used entry is evicted first.
+    """
+
+    def __init__(self, max_size: int = 8):
+        if max_size < 1:
+            raise ValueError(f"`max_size` has to be a positive integer but is {max_size}.")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._text_encoder_ref = None
+
+    @staticmethod
+    def make_key(
+        prompt: Union[str, List[str]],
+        negative_prompt: Optional[Union[str, List[str]]],
+        num_images_per_prompt: int,
+        do_classifier_free_guidance: bool,
+        dtype: torch.dtype,
+        device: torch.device,
+    ):
+        if isinstance(prompt, list):
+            prompt = tuple(prompt)
+        if isinstance(negative_prompt, list):
+            negative_prompt = tuple(negative_prompt)
+        return (prompt, negative_prompt, num_images_per_prompt, do_classifier_free_guidance, dtype, str(device))
+
+    def bind(self, text_encoder):
+        owner = self._text_encoder_ref() if self._text_encoder_ref is not None else None
+        if owner is not text_encoder:
+            self.clear()
+            self._text_encoder_ref = weakref.ref(text_encoder) if text_encoder is not None else None
+
+    def get(self, key) -> Optional[torch.FloatTensor]:
+        embeds = self._entries.get(key)
+        if embeds is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return embeds
+
+    def put(self, key, embeds: torch.FloatTensor):
+        self._entries[key] = embeds
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self) -> PromptCacheInfo:
+        return PromptCacheInfo(self.hits, self.misses, self.max_size, len(self._entries))
+
+    def __getstate__(self):
+        # pickled (e.g. to send a pipeline to worker processes) without the encoder reference, which cannot be
+        # pickled, and without the entries, which are bound to it
+        state = self.__dict__.copy()
+        state["_entries"] = OrderedDict()
+        state["_text_encoder_ref"] = None
+        return state
+
+
+class PromptCacheMixin:
+    r"""
+    Adds a prompt-embedding cache to a pipeline that implements `_encode_prompt`.
+
+    The cache is enabled by default and only serves calls where the embeddings are computed from `prompt` and
+    `negative_prompt` strings. Loaders that change what the text encoder produces (textual inversion, LoRA) invalidate
+    it; call [`~PromptCacheMixin.invalidate_prompt_cache`] after editing text-encoder weights by hand.
+    """
+
+    _prompt_cache_max_size = 8
+
+    @property
+    def prompt_cache(self) -> Optional[PromptEmbedsCache]:
+        if "_prompt_cache" not in self.__dict__:
+            self._prompt_cache = PromptEmbedsCache(self._prompt_cache_max_size)
+        return self._prompt_cache
+
+    def enable_prompt_cache(self, max_size: int = 8):
+        r"""
+        Enables (or resizes) the prompt-embedding cache. Resizing drops the cached entries and statistics.
+
+        Args:
+            max_size (`int`, *optional*, defaults to 8):
+                Maximum number of `(prompt, negative_prompt, num_images_per_prompt, cfg, dtype, device)` entries.
+        """
+        self._prompt_cache = PromptEmbedsCache(max_size)
+
+    def disable_prompt_cache(self):
+        r"""Disables the prompt-embedding cache and frees the cached embeddings."""
+        self._prompt_cache = None
+
+    def invalidate_prompt_cache(self):
+        r"""Drops all cached prompt embeddings, keeping the hit and miss counters."""
+        if self.prompt_cache is not None:
+            self.prompt_cache.clear()
+
+    def prompt_cache_info(self) -> Optional[PromptCacheInfo]:
+        r"""Returns the `(hits, misses, max_size, current_size)` of the prompt cache, or `None` if it is disabled."""
+        return self.prompt_cache.info() if self.prompt_cache is not None else None
+
+    def load_textual_inversion(self, *args, **kwargs):
+        super().load_textual_inversion(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def unload_textual_inversion(self, *args, **kwargs):
+        super().unload_textual_inversion(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def load_lora_weights(self, *args, **kwargs):
+        super().load_lora_weights(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def unload_lora_weights(self, *args, **kwargs):
+        super().unload_lora_weights(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def fuse_lora(self, *args, **kwargs):
+        super().fuse_lora(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def unfuse_lora(self, *args, **kwargs):
+        super().unfuse_lora(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def set_adapters(self, *args, **kwargs):
+        super().set_adapters(*args, **kwargs)
+        self.invalidate_prompt_cache()
+
+    def enable_lora(self):
+        super().enable_lora()
+        self.invalidate_prompt_cache()
+
+    def disable_lora(self):
+        super().disable_lora()
+        self.invalidate_prompt_cache()
+
+    def delete_adapters(self, *args, **kwargs):
+        super().delete_adapters(*args, **kwargs)
+        self.invalidate_prompt_cache()
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import torch
+from torch.ao.nn.quantized import dynamic as nnqd
+
+from diffusers.utils import logging
+
+from .latent_cache import forget_fingerprint, module_content_hash
+
+logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
+
+# bumped whenever the stored layout changes, so that stale cache files are ignored
+_CACHE_VERSION = 1
+
+
+def _linear_names(module: torch.nn.Module) -> List[str]:
+    return [name for name, child in module.named_modules() if type(child) is torch.nn.Linear]
+
+
+def _set_submodule(module: torch.nn.Module, name: str, child: torch.nn.Module):
+    parent_name, _, attribute = name.rpartition(".")
+    parent = module.get_submodule(parent_name) if parent_name else module
+    setattr(parent, attribute, child)
+
+
+def quantize_linear_int8(module: torch.nn.Module) -> List[str]:
+    r"""
+    Replaces every `nn.Linear` of `module` in place with a dynamically quantized int8 linear layer and returns the
+    names of the replaced layers.
+
+    Weights are quantized once; activations are quantized on the fly at every call, so no calibration data is needed.
+    In the UNet this covers the attention projections (`to_q`, `to_k`, `to_v`, `to_out`), the feed-forward layers and
+    the time embeddings; convolutions stay in fp32.
+    """
+    names = _linear_names(module)
+    for name in names:
+        linear = module.get_submodule(name)
+        _set_submodule(module, name, nnqd.Linear.from_float(_with_qconfig(linear)))
+    return names
+
+
+def _with_qconfig(linear: torch.nn.Linear) -> torch.nn.Linear:
+    linear.qconfig = torch.ao.quantization.default_dynamic_qconfig
+    return linear
+
+
+def _empty_quantized_linears(module: torch.nn.Module, names: List[str]):
+    # builds the quantized layout without quantizing anything; the weights come from the cache
+    for name in names:
+        linear = module.get_submodule(name)
+        quantized = nnqd.Linear(linear.in_features, linear.out_features, bias_=linear.bias is not None)
+        _set_submodule(module, name, quantized)
+
+
+class QuantizedWeightCache:
+    r"""
+    On-disk cache of dynamically quantized layers, keyed by the content hash of the fp32 model they were made from and
+    the torch version, so a process start only loads the packed int8 weights instead of quantizing again.
+
+    Args:
+        cache_dir (`str`):
+            Directory the quantized weights are written to.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, module: torch.nn.Module) -> str:
+        # every weight is hashed: a fine-tune that shares the sparse fingerprint must not load these weights
+        key = f"{module_content_hash(module)[:32]}-torch{torch.__version__}-v{_CACHE_VERSION}"
+        return os.path.join(self.cache_dir, f"int8-{key}.pt")
+
+    def load(self, module: torch.nn.Module) -> Optional[List[str]]:
+        r"""Quantizes `module` from the cache and returns the replaced layer names, or `None` on a cache miss."""
+        path = self.path(module)
+        if not os.path.exists(path):
+            return None
+        entry = torch.load(path, map_location="cpu", weights_only=False)
+        names = entry["names"]
+        if names != _linear_names(module):
+            logger.warning(f"Ignoring {path}: its layers do not match the model.")
+            return None
+        prefixes = tuple(name + "." for name in names)
+        unexpected = [name for name in entry["state_dict"] if not name.startswith(prefixes)]
+        if len(unexpected) > 0:
+            raise ValueError(f"{path} holds weights of layers that are not quantized: {unexpected[:5]}.")
+        _empty_quantized_linears(module, names)
+        module.load_state_dict(entry["state_dict"], strict=False)
+        return names
+
+    def save(self, path: str, module: torch.nn.Module, names: List[str]):
+        prefixes = tuple(name + "." for name in names)
+        full_state_dict = module.state_dict()
+        state_dict = OrderedDict((key, value) for key, value in full_state_dict.items() if key.startswith(prefixes))
+        # the quantized layers read their serialisation version from the metadata
+        state_dict._metadata = full_state_dict._metadata
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".tmp", delete=False) as f:
+            torch.save({"names": names, "state_dict": state_dict}, f)
+        os.replace(f.name, path)
+
+
+class Int8QuantizationMixin:
+    r"""
+    Opt-in dynamic int8 quantization of the UNet, and optionally the text encoder, for CPU inference.
+    """
+
+    int8_quantized: Dict[str, int] = {}
+
+    def enable_int8_quantization(self, quantize_text_encoder: bool = False, cache_dir: Optional[str] = None):
+        r"""
+        Quantizes the linear layers of the UNet, and of the text encoder if `quantize_text_encoder`, to int8 in place.
+
+        Dynamically quantized layers run on the CPU only and expect fp32 inputs, so the pipeline has to be an fp32 CPU
+        pipeline. The quantization cannot be undone; reload the pipeline to go back to fp32.
+
+        Args:
+            quantize_text_encoder (`bool`, *optional*, defaults to `False`):
+                Whether to quantize the text encoder as well. Its cost is small next to the UNet's, and text embeddings
+                are memoised by the prompt cache.
+            cache_dir (`str`, *optional*):
+                Directory of a [`~pipeline.quantization.QuantizedWeightCache`]. Quantized weights are loaded from it if
+                present and written to it otherwise.
+
+        Returns:
+            `Dict[str, int]`: the number of quantized layers per component.
+        """
+        if self.device.type != "cpu":
+            raise ValueError(f"Int8 dynamic quantization runs on the CPU but the pipeline is on {self.device}.")
+        if self.unet.dtype != torch.float32:
+            raise ValueError(f"Int8 dynamic quantization needs an fp32 pipeline but the UNet is {self.unet.dtype}.")
+
+        cache = QuantizedWeightCache(cache_dir) if cache_dir is not None else None
+        components = ["unet", "text_encoder"] if quantize_text_encoder else ["unet"]
+        quantized = dict(self.int8_quantized)
+        for name in components:
+            if name in quantized:
+                continue
+            module = getattr(self, name)
+            start = time.perf_counter()
+            names = None
+            if cache is not None:
+                path = cache.path(module)
+                names = cache.load(module)
+            source = "cache"
+            if names is None:
+                names = quantize_linear_int8(module)
+                source = "quantized"
+                if cache is not None:
+                    cache.save(path, module, names)
+            forget_fingerprint(module)
+            if name == "text_encoder" and getattr(self, "prompt_cache", None) is not None:
+                # the cache is bound to the text encoder object, which keeps its identity
+                self.prompt_cache.clear()
+            logger.info(f"{name}: {len(names)} linear layers to int8 ({source}) in {time.perf_counter() - start:.2f}s.")
+            quantized[name] = len(names)
+
+        # per-instance, so that the class-level default is never mutated
+        self.int8_quantized = quantized
+        compiled_step = getattr(self, "_compiled_step", None)
+        if compiled_step is not None:
+            compiled_step.reset()
+        return quantized
@@ -0,0 +1,207 @@
+from typing import List, Optional, Tuple
+
+import torch
+
+try:
+    from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+    from diffusers.models.modeling_outputs import AutoencoderKLOutput
+except ImportError:  # diffusers < 0.25
+    from diffusers.models.autoencoder_kl import AutoencoderKLOutput
+    from diffusers.models.vae import DiagonalGaussianDistribution
+
+# number of full-resolution activation tensors alive at the widest point of a VAE block (residual, two convs, norm)
+_LIVE_ACTIVATIONS = 4
+
+
+def _tile_starts(size: int, tile: int, stride: int, multiple: int) -> List[int]:
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    last = (size - tile) // multiple * multiple
+    if starts[-1] != last:
+        starts.append(last)
+    return starts
+
+
+def _ramp(length: int, overlap: int, fade_in: bool, fade_out: bool, device, dtype) -> torch.Tensor:
+    weight = torch.ones(length, device=device, dtype=dtype)
+    overlap = min(overlap, length // 2)
+    if overlap > 0:
+        ramp = torch.linspace(0, 1, overlap + 2, device=device, dtype=dtype)[1:-1]
+        if fade_in:
+            weight[:overlap] = ramp
+        if fade_out:
+            weight[-overlap:] = ramp.flip(0)
+    return weight
+
+
+def _blend_tiles(fn, x: torch.Tensor, tile: int, overlap: int, scale: float, multiple: int) -> torch.Tensor:
+    r"""
+    Applies `fn` to overlapping `tile x tile` windows of `x` and blends the results with linear ramps over the overlap.
+
+    `scale` is the output/input resolution ratio of `fn`, `multiple` the input granularity tile offsets are aligned to.
+    """
+    height, width = x.shape[-2:]
+    stride = max(multiple, (tile - overlap) // multiple * multiple)
+    rows = _tile_starts(height, tile, stride, multiple)
+    cols = _tile_starts(width, tile, stride, multiple)
+
+    out, weights = None, None
+    for i, top in enumerate(rows):
+        for j, left in enumerate(cols):
+            tile_out = fn(x[..., top : top + tile, left : left + tile])
+            if out is None:
+                out_shape = tile_out.shape[:-2] + (int(height * scale), int(width * scale))
+                out = torch.zeros(out_shape, device=tile_out.device, dtype=torch.float32)
+                weights = torch.zeros(out_shape[-2:], device=tile_out.device, dtype=torch.float32)
+
+            tile_h, tile_w = tile_out.shape[-2:]
+            blend = int(overlap * scale)
+            weight_h = _ramp(tile_h, blend, i > 0, i < len(rows) - 1, out.device, out.dtype)
+            weight_w = _ramp(tile_w, blend, j > 0, j < len(cols) - 1, out.device, out.dtype)
+            weight = weight_h[:, None] * weight_w[None, :]
+
+            out_top, out_left = int(top * scale), int(left * scale)
+            out[..., out_top : out_top + tile_h, out_left : out_left + tile_w] += tile_out.float() * weight
+            weights[out_top : out_top + tile_h, out_left : out_left + tile_w] += weight
+
+    return (out / weights).to(tile_out.dtype)
+
+
+def estimate_vae_memory(vae, tile_size: int, batch_size: int = 1, dtype: Optional[torch.dtype] = None) -> int:
+    r"""
+    Estimates the peak activation memory, in bytes, of encoding or decoding one `tile_size x tile_size` pixel tile.
+
+    The estimate accounts for the convolutional activations of every resolution level and for the attention matrix of
+    the mid block, which grows with the square of the tile area and dominates for large tiles.
+    """
+    dtype = dtype or vae.dtype
+    element_size = torch.tensor([], dtype=dtype).element_size()
+    channels = list(vae.config.block_out_channels)
+    num_levels = len(channels)
+
+    conv = 0
+    for level, c in enumerate(channels):
+        side = tile_size // (2**level)
+        conv = max(conv, _LIVE_ACTIVATIONS * c * side * side)
+    latent_side = tile_size // (2 ** (num_levels - 1))
+    attention = latent_side**4
+
+    return batch_size * (conv + attention) * element_size
+
+
+def tile_size_for_budget(
+    vae,
+    memory_budget: int,
+    batch_size: int = 1,
+    dtype: Optional[torch.dtype] = None,
+    min_tile_size: int = 64,
+    max_tile_size: int = 2048,
+) -> int:
+    r"""
+    Returns the largest pixel tile size, a multiple of 64, whose [`estimate_vae_memory`] stays within `memory_budget`
+    bytes. Falls back to `min_tile_size` if even that exceeds the budget.
+    """
+    tile = max_tile_size
+    while tile > min_tile_size and estimate_vae_memory(vae, tile, batch_size, dtype) > memory_budget:
+        tile -= 64
+    return max(tile, min_tile_size)
+
+
+def tiled_encode(vae, image: torch.Tensor, tile_size: int, overlap: int) -> AutoencoderKLOutput:
+    r"""
+    Encodes `image` tile by tile. The mean and log-variance of the overlapping tiles are blended, so the result is a
+    regular latent distribution that can be sampled or reduced to its mode.
+    """
+    scale_factor = 2 ** (len(vae.config.block_out_channels) - 1)
+
+    def encode(tile):
+        return vae.encode(tile).latent_dist.parameters
+
+    parameters = _blend_tiles(encode, image, tile_size, overlap, 1 / scale_factor, scale_factor)
+    return AutoencoderKLOutput(latent_dist=DiagonalGaussianDistribution(parameters))
+
+
+def tiled_decode(vae, latents: torch.Tensor, tile_size: int, overlap: int) -> torch.Tensor:
+    r"""Decodes `latents`, already divided by the VAE scaling factor, tile by tile. `tile_size` is given in pixels."""
+    scale_factor = 2 ** (len(vae.config.block_out_channels) - 1)
+
+    def decode(tile):
+        return vae.decode(tile, return_dict=False)[0]
+
+    return _blend_tiles(
+        decode, latents, max(1, tile_size // scale_factor), max(0, overlap // scale_factor), scale_factor, 1
+    )
+
+
+class VaeTilingMixin:
+    r"""
+    Runs the VAE encoder and decoder of a pipeline on overlapping tiles so that peak memory is bounded by the tile
+    size instead of the image area.
+
+    Tiling is disabled by default. Images that fit into a single tile take the untiled path and are bit-identical to
+    it; larger images are blended across tiles with linear ramps, which removes seams.
+    """
+
+    _vae_tile_size: Optional[int] = None
+    _vae_tile_overlap: Optional[int] = None
+    _vae_memory_budget: Optional[int] = None
+
+    def enable_tiled_vae(
+        self, memory_budget: Optional[int] = None, tile_size: Optional[int] = None, overlap: Optional[int] = None
+    ):
+        r"""
+        Enables tiled VAE encoding and decoding.
+
+        Args:
+            memory_budget (`int`, *optional*):
+                Peak activation memory, in bytes, one VAE pass may use. The tile size is derived from it for every
+                batch with [`tile_size_for_budget`].
+            tile_size (`int`, *optional*):
+                Fixed tile side in pixels, a multiple of 64. Takes precedence over `memory_budget`. Defaults to 512 if
+                neither is given.
+            overlap (`int`, *optional*):
+                Overlap between neighbouring tiles in pixels, a multiple of 8. Defaults to a quarter of the tile.
+        """
+        if tile_size is not None and tile_size % 64 != 0:
+            raise ValueError(f"`tile_size` has to be a multiple of 64 but is {tile_size}.")
+        if overlap is not None and overlap % 8 != 0:
+            raise ValueError(f"`overlap` has to be a multiple of 8 but is {overlap}.")
+        if tile_size is None and memory_budget is None:
+            tile_size = 512
+
+        self._vae_tile_size = tile_size
+        self._vae_tile_overlap = overlap
+        self._vae_memory_budget = memory_budget
+
+    def disable_tiled_vae(self):
+        r"""Disables tiled VAE encoding and decoding."""
+        self._vae_tile_size = None
+        self._vae_tile_overlap = None
+        self._vae_memory_budget = None
+
+    @property
+    def vae_tiling_enabled(self) -> bool:
+        return self._vae_tile_size is not None or self._vae_memory_budget is not None
+
+    def vae_tiling(self, batch_size: int = 1) -> Optional[Tuple[int, int]]:
+        r"""Returns the `(tile_size, overlap)` in pixels used for a batch of `batch_size` images, or `None`."""
+        if not self.vae_tiling_enabled:
+            return None
+        tile_size = self._vae_tile_size
+        if tile_size is None:
+            tile_size = tile_size_for_budget(self.vae, self._vae_memory_budget, batch_size)
+        overlap = self._vae_tile_overlap if self._vae_tile_overlap is not None else tile_size // 32 * 8
+        return tile_size, min(overlap, tile_size // 2)
+
+    def _vae_encode_pixels(self, image: torch.Tensor):
+        tiling = self.vae_tiling(image.shape[0])
+        if tiling is None or max(image.shape[-2:]) <= tiling[0]:
+            return self.vae.encode(image)
+        return tiled_encode(self.vae, image, *tiling)
+
+    def _vae_decode_latents(self, latents: torch.Tensor) -> torch.Tensor:
+        tiling = self.vae_tiling(latents.shape[0])
+        if tiling is None or max(latents.shape[-2:]) * self.vae_scale_factor <= tiling[0]:
+            return self.vae.decode(latents, return_dict=False)[0]
+        return tiled_decode(self.vae, latents, *tiling)
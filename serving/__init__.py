@@ -0,0 +1,4 @@
+"""Local serving runtime for the decorruptor pipelines."""
+
+from .batcher import DynamicBatcher, QueueFullError
+from .metrics import MetricsRegistry
@@ -0,0 +1,260 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, List, Optional
+
+from .metrics import MetricsRegistry
+
+BATCH_FILL_BUCKETS = (0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class QueueFullError(RuntimeError):
+    r"""Raised by [`DynamicBatcher.submit`] when the queue holds `max_queue_size` requests."""
+
+
+class _Entry:
+    __slots__ = ("item", "key", "future", "enqueued")
+
+    def __init__(self, item, key, future, enqueued):
+        self.item = item
+        self.key = key
+        self.future = future
+        self.enqueued = enqueued
+
+
+class DynamicBatcher:
+    r"""
+    Queues requests from concurrent coroutines and runs them in batches.
+
+    A batch starts with the oldest queued request and collects the following requests with the same batch key until it
+    holds `max_batch_size` requests or the oldest one has waited `max_wait_ms`. Batches run one at a time on a worker
+    thread, so the event loop keeps accepting requests while the model runs and those requests form the next batch.
+
+    Args:
+        run_batch (`Callable[[List[Any]], List[Any]]`):
+            Blocking function that processes a list of request items and returns one result per item, in order.
+        max_batch_size (`int`, *optional*, defaults to 8):
+            Maximum number of requests per batch.
+        max_wait_ms (`float`, *optional*, defaults to 10):
+            How long the oldest queued request waits for the batch to fill before the batch is run anyway.
+        max_queue_size (`int`, *optional*, defaults to 64):
+            Number of queued requests beyond which [`~DynamicBatcher.submit`] rejects new ones with a
+            [`QueueFullError`].
+        batch_key (`Callable[[Any], Hashable]`, *optional*):
+            Returns the key of a request item; only items with equal keys share a batch. All items are compatible if
+            not defined.
+        metrics ([`~serving.metrics.MetricsRegistry`], *optional*):
+            Registry the queue depth, batch fill and latency metrics are recorded in. A new one is created if not
+            defined.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        max_queue_size: int = 64,
+        batch_key: Optional[Callable[[Any], Hashable]] = None,
+        metrics: Optional[MetricsRegistry] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"`max_batch_size` has to be a positive integer but is {max_batch_size}.")
+        if max_queue_size < 1:
+            raise ValueError(f"`max_queue_size` has to be a positive integer but is {max_queue_size}.")
+        if max_wait_ms < 0:
+            raise ValueError(f"`max_wait_ms` has to be non-negative but is {max_wait_ms}.")
+
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.batch_key = batch_key
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+
+        self._queue_depth = self.metrics.gauge("queue_depth", "Requests waiting to be batched.")
+        self._in_flight = self.metrics.gauge("batch_in_flight", "Requests in the batch currently running.")
+        self._requests = self.metrics.counter("requests_total", "Requests by outcome.")
+        self._batches = self.metrics.counter("batches_total", "Batches run.")
+        self._batch_size = self.metrics.histogram(
+            "batch_size", "Requests per batch.", range(1, max_batch_size + 1)
+        )
+        self._batch_fill = self.metrics.histogram(
+            "batch_fill_ratio", "Batch size relative to max_batch_size.", BATCH_FILL_BUCKETS
+        )
+        self._queue_wait = self.metrics.histogram(
+            "queue_wait_seconds", "Time from submission to the start of the batch.", LATENCY_BUCKETS
+        )
+        self._batch_latency = self.metrics.histogram("batch_seconds", "Run time of a batch.", LATENCY_BUCKETS)
+        self._request_latency = self.metrics.histogram(
+            "request_seconds", "Time from submission to the result.", LATENCY_BUCKETS
+        )
+
+        self._pending: List[_Entry] = []
+        self._running: List[_Entry] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        r"""Number of requests waiting for a batch."""
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        r"""Starts the batching loop on the running event loop."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decorruptor-batch")
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        r"""Stops the batching loop and fails the requests still queued or running."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for entry in self._pending + self._running:
+            if not entry.future.done():
+                entry.future.set_exception(RuntimeError("The batcher was stopped."))
+        self._pending = []
+        self._running = []
+        self._queue_depth.set(0)
+        if self._executor is not None:
+            # waits for the abandoned batch off the event loop, which keeps serving meanwhile
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+
+    async def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        r"""
+        Queues `item` and waits for its result.
+
+        Args:
+            item (`Any`):
+                The request passed to `run_batch`.
+            timeout (`float`, *optional*):
+                Seconds to wait for the result. A request that times out while queued is dropped from the queue; one
+                that times out while its batch runs is discarded once the batch finishes.
+
+        Raises:
+            [`QueueFullError`]: if `max_queue_size` requests are already queued.
+            `asyncio.TimeoutError`: if the result is not ready within `timeout`.
+        """
+        if not self.running:
+            raise RuntimeError("The batcher is not running; call `start()` first.")
+        if len(self._pending) >= self.max_queue_size:
+            self._requests.inc(status="rejected")
+            raise QueueFullError(f"The request queue is full ({self.max_queue_size} requests).")
+
+        key = self.batch_key(item) if self.batch_key is not None else None
+        entry = _Entry(item, key, asyncio.get_running_loop().create_future(), time.perf_counter())
+        self._pending.append(entry)
+        self._queue_depth.set(len(self._pending))
+        self._wakeup.set()
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+        except asyncio.TimeoutError:
+            self._requests.inc(status="timeout")
+            entry.future.cancel()
+            self._drop_cancelled()
+            raise
+        except asyncio.CancelledError:
+            # the caller went away, e.g. the client disconnected
+            self._requests.inc(status="cancelled")
+            entry.future.cancel()
+            self._drop_cancelled()
+            raise
+        except Exception:
+            self._requests.inc(status="error")
+            raise
+        self._requests.inc(status="ok")
+        self._request_latency.observe(time.perf_counter() - entry.enqueued)
+        return result
+
+    def _drop_cancelled(self):
+        self._pending = [entry for entry in self._pending if not entry.future.done()]
+        self._queue_depth.set(len(self._pending))
+
+    def _ready_count(self, key) -> int:
+        return sum(1 for entry in self._pending if entry.key == key and not entry.future.done())
+
+    def _take_batch(self) -> List[_Entry]:
+        self._drop_cancelled()
+        if len(self._pending) == 0:
+            return []
+        key = self._pending[0].key
+        batch, rest = [], []
+        for entry in self._pending:
+            if entry.key == key and len(batch) < self.max_batch_size:
+                batch.append(entry)
+            else:
+                rest.append(entry)
+        self._pending = rest
+        self._queue_depth.set(len(self._pending))
+        return batch
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._drop_cancelled()
+            if len(self._pending) == 0:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # wait until the oldest request's batch is full or it has waited long enough
+            head = self._pending[0]
+            deadline = head.enqueued + self.max_wait_s
+            while self._ready_count(head.key) < self.max_batch_size and not head.future.done():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            if len(batch) == 0:
+                continue
+
+            start = time.perf_counter()
+            for entry in batch:
+                self._queue_wait.observe(start - entry.enqueued)
+            self._batches.inc()
+            self._batch_size.observe(len(batch))
+            self._batch_fill.observe(len(batch) / self.max_batch_size)
+            self._in_flight.set(len(batch))
+            self._running = batch
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, [entry.item for entry in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"`run_batch` returned {len(results)} results for {len(batch)} requests.")
+            except asyncio.CancelledError:
+                # `stop` cancelled the loop: the running batch is abandoned, so its requests have to fail here
+                for entry in batch:
+                    if not entry.future.done():
+                        entry.future.set_exception(RuntimeError("The batcher was stopped."))
+                raise
+            except Exception as e:  # noqa: BLE001 - the failure is reported to every request of the batch
+                for entry in batch:
+                    if not entry.future.done():
+                        entry.future.set_exception(e)
+            else:
+                for entry, result in zip(batch, results):
+                    if not entry.future.done():
+                        entry.future.set_result(result)
+            finally:
+                self._running = []
+                self._in_flight.set(0)
+                self._batch_latency.observe(time.perf_counter() - start)
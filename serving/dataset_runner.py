@@ -0,0 +1,424 @@
+"""
+Streaming test-time adaptation over an image dataset: cleans every image of a directory tree, such as ImageNet-C
+(`<corruption>/<severity>/<class>/<image>.JPEG`), and mirrors the tree with the results. Every result keeps the name
+of its input and gets the output extension appended (`x.JPEG` -> `x.JPEG.png`), so `x.jpg` and `x.png` do not collide.
+
+    python -m serving.dataset_runner /data/ImageNet-C /data/ImageNet-C-decorrupted --batch-size 16
+    python -m serving.dataset_runner /data/ImageNet-C out --pipeline dpm --num-inference-steps 20
+    python -m serving.dataset_runner __assets__/corrupt_images /tmp/out --tiny    # random tiny CPU model
+
+Images are decoded on a thread pool a few batches ahead of the pipeline, run through it in batches, and handed to a
+`pipeline.output_sink.OutputSink` as `uint8` arrays, which encodes and writes them while the next batch runs, to files
+or, with `--tar-shard-size`, to tar shards. Every written image is appended to `manifest.jsonl` in the output
+directory; running the same command again skips the images listed there, so an interrupted run continues where it
+stopped. Progress, throughput and the estimated time to completion are logged as the run goes, and the summary reports
+the encoding throughput separately.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import PIL.Image
+
+from .server import EditRequest, PipelineBatchRunner, load_pipeline
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png", ".bmp", ".webp")
+OUTPUT_FORMATS = ("png", "jpeg", "webp")
+
+
+def find_images(root: str) -> List[str]:
+    r"""Paths, relative to `root` and in a stable order, of every image below `root`."""
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, name), root))
+    return paths
+
+
+class RunManifest:
+    r"""
+    Append-only record of the images a run has finished, stored as JSON lines. The first line holds the run
+    configuration; a run is only resumed with the configuration it was started with.
+
+    Args:
+        path (`str`):
+            The manifest file. Created if it does not exist.
+        config (`dict`):
+            Settings that change the outputs, e.g. the model and the call arguments.
+        restart (`bool`, *optional*, defaults to `False`):
+            Discards an existing manifest instead of resuming from it.
+        sync_every (`int`, *optional*, defaults to 64):
+            Records after which the file is flushed to disk with `fsync`.
+        before_sync (`Callable`, *optional*):
+            Called before every `fsync`, e.g. to force the recorded outputs to disk first.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        config: dict,
+        restart: bool = False,
+        sync_every: int = 64,
+        before_sync: Optional[Callable[[], None]] = None,
+    ):
+        self.path = path
+        self.config = config
+        self.sync_every = sync_every
+        self.before_sync = before_sync
+        self.done = set()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+        if os.path.exists(path) and not restart:
+            self._load()
+            self._file = open(path, "a")
+        else:
+            self._file = open(path, "w")
+            self._write({"config": config})
+
+    def _load(self):
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        if len(lines) == 0:
+            raise ValueError(f"{self.path} is empty; pass `restart=True` to start a new run.")
+        stored = json.loads(lines[0]).get("config")
+        if stored != self.config:
+            raise ValueError(
+                f"{self.path} was written by a run with the configuration {stored}, not {self.config}; pass"
+                " `restart=True` (`--restart`) to start over."
+            )
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                self.done.add(json.loads(line)["input"])
+            except (json.JSONDecodeError, KeyError):
+                # a line torn by an interrupted write; its image is cleaned again
+                logger.warning(f"Ignoring malformed line {number} of {self.path}.")
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def record(self, input_path: str, output_path: str):
+        r"""Marks `input_path` as done. Thread-safe."""
+        with self._lock:
+            self._write({"input": input_path, "output": output_path})
+            self.done.add(input_path)
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+                self._unsynced = 0
+
+    def _sync(self):
+        if self.before_sync is not None:
+            self.before_sync()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+                self._sync()
+                self._file.close()
+
+
+class ProgressMeter:
+    r"""Logs the images done, the throughput of the current session and the estimated time left."""
+
+    def __init__(self, total: int, done: int = 0, interval_s: float = 10.0):
+        self.total = total
+        self.done = done
+        self.interval_s = interval_s
+        self.session_done = 0
+        self.start = time.perf_counter()
+        self._last_log = self.start
+
+    @property
+    def images_per_second(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.session_done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_s(self) -> Optional[float]:
+        rate = self.images_per_second
+        return (self.total - self.done) / rate if rate > 0 else None
+
+    def update(self, images: int, force: bool = False):
+        self.done += images
+        self.session_done += images
+        now = time.perf_counter()
+        if force or now - self._last_log >= self.interval_s:
+            self._last_log = now
+            logger.info(self.format())
+
+    def format(self) -> str:
+        eta = "?" if self.eta_s is None else str(datetime.timedelta(seconds=round(self.eta_s)))
+        percent = 100 * self.done / max(self.total, 1)
+        return f"{self.done}/{self.total} images ({percent:.1f}%), {self.images_per_second:.2f} img/s, ETA {eta}"
+
+
+def _decode(path: str) -> PIL.Image.Image:
+    with PIL.Image.open(path) as image:
+        return image.convert("RGB")
+
+
+def prefetch_batches(
+    root: str, paths: List[str], batch_size: int, executor: ThreadPoolExecutor, prefetch: int = 2
+) -> Iterator[List[Tuple[str, Optional[PIL.Image.Image]]]]:
+    r"""
+    Yields `(path, image)` batches of `paths` while the images of the next `prefetch` batches are decoded on
+    `executor`. Images that cannot be read are yielded as `None` and logged.
+    """
+    pending = deque()
+    position = 0
+
+    def submit_batch():
+        nonlocal position
+        batch = paths[position : position + batch_size]
+        position += len(batch)
+        pending.append([(path, executor.submit(_decode, os.path.join(root, path))) for path in batch])
+
+    while position < len(paths) and len(pending) < prefetch + 1:
+        submit_batch()
+    while pending:
+        batch = pending.popleft()
+        if position < len(paths):
+            submit_batch()
+        decoded = []
+        for path, future in batch:
+            try:
+                decoded.append((path, future.result()))
+            except (OSError, PIL.Image.DecompressionBombError) as e:
+                logger.warning(f"Skipping {path}: {e}")
+                decoded.append((path, None))
+        yield decoded
+
+
+def run_dataset(
+    pipe,
+    input_dir: str,
+    output_dir: str,
+    request: EditRequest,
+    batch_size: int = 8,
+    resolution: int = 512,
+    output_format: str = "png",
+    decode_workers: int = 4,
+    encode_workers: int = 4,
+    encode_processes: bool = False,
+    tar_shard_size: Optional[int] = None,
+    prefetch: int = 2,
+    restart: bool = False,
+    limit: Optional[int] = None,
+    log_interval_s: float = 10.0,
+    config: Optional[dict] = None,
+) -> dict:
+    r"""
+    Cleans every image below `input_dir` with `pipe` and writes the results to the same relative paths below
+    `output_dir`, with the output extension appended, resuming from the manifest of an earlier run. Returns a summary
+    of the run.
+
+    Args:
+        request ([`EditRequest`]):
+            The call arguments every image is cleaned with. Its image is ignored.
+        resolution (`int`, *optional*, defaults to 512):
+            Base size of the resolution buckets images of mixed sizes are batched in; outputs keep their input size.
+        output_format (`str`, *optional*, defaults to `"png"`):
+            `"png"`, `"jpeg"` or `"webp"`.
+        encode_workers (`int`, *optional*, defaults to 4):
+            Size of the [`~pipeline.output_sink.OutputSink`] encoder pool.
+        encode_processes (`bool`, *optional*, defaults to `False`):
+            Encodes in processes instead of threads.
+        tar_shard_size (`int`, *optional*):
+            Writes the results to tar shards of this many images in `output_dir` instead of to individual files.
+        prefetch (`int`, *optional*, defaults to 2):
+            Batches decoded ahead of the one the pipeline runs.
+        limit (`int`, *optional*):
+            Cleans at most this many images in this session.
+        config (`dict`, *optional*):
+            Further settings recorded in the manifest, e.g. the model id.
+    """
+    from pipeline.bucketing import ResolutionBucketer, make_buckets
+    from pipeline.output_sink import OutputSink, TarShardWriter
+
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"`output_format` has to be one of {OUTPUT_FORMATS} but is {output_format}.")
+    if batch_size < 1 or prefetch < 0:
+        raise ValueError(f"Invalid `batch_size` {batch_size} or `prefetch` {prefetch}.")
+
+    config = dict(config or {})
+    config.update(
+        pipeline=type(pipe).__name__,
+        prompt=request.prompt,
+        num_inference_steps=request.num_inference_steps,
+        guidance_scale=request.guidance_scale,
+        image_guidance_scale=request.image_guidance_scale,
+        resolution=resolution,
+        output_format=output_format,
+        tar_shards=tar_shard_size is not None,
+        # outputs are named after the whole input name, extension included
+        output_names="input_name",
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    if tar_shard_size is not None:
+        writer = TarShardWriter(os.path.join(output_dir, "shard-%06d.tar"), max_count=tar_shard_size)
+        # the images of the shards are on disk before the manifest entries that point to them
+        before_sync = writer.sync
+    else:
+        writer, before_sync = output_dir, None
+    manifest = RunManifest(
+        os.path.join(output_dir, "manifest.jsonl"), config, restart=restart, before_sync=before_sync
+    )
+
+    paths = find_images(input_dir)
+    todo = [path for path in paths if path not in manifest.done]
+    already_done = len(paths) - len(todo)
+    if limit is not None:
+        todo = todo[:limit]
+    logger.info(f"{len(paths)} images in {input_dir}, {already_done} already done, {len(todo)} to clean now.")
+
+    bucketer = ResolutionBucketer(buckets=make_buckets(resolution), max_batch_size=batch_size)
+    runner = PipelineBatchRunner(pipe, bucketer)
+    # filled before an image is submitted, emptied by the sink's writer thread once it is on disk
+    inputs = {}
+    sink = OutputSink(
+        writer,
+        format=output_format,
+        num_workers=encode_workers,
+        max_pending=2 * batch_size,
+        use_processes=encode_processes,
+        on_write=lambda key, location: manifest.record(inputs.pop(key), location),
+    )
+    progress = ProgressMeter(len(paths), done=already_done, interval_s=log_interval_s)
+    failed = []
+    inference_s = 0.0
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(decode_workers, thread_name_prefix="decode") as decoder:
+            for batch in prefetch_batches(input_dir, todo, batch_size, decoder, prefetch=prefetch):
+                failed += [path for path, image in batch if image is None]
+                batch = [(path, image) for path, image in batch if image is not None]
+                if len(batch) == 0:
+                    continue
+                requests = [
+                    EditRequest(
+                        image=image,
+                        prompt=request.prompt,
+                        num_inference_steps=request.num_inference_steps,
+                        guidance_scale=request.guidance_scale,
+                        image_guidance_scale=request.image_guidance_scale,
+                    )
+                    for _, image in batch
+                ]
+                # the input extension stays in the key, so `x.jpg` and `x.png` are written to different files
+                keys = [path for path, _ in batch]
+                inputs.update(zip(keys, keys))
+                batch_start = time.perf_counter()
+                # the pipeline hands the decoded images to the sink as `uint8` arrays, without a PIL round trip
+                runner(requests, output_sink=sink, output_keys=keys)
+                inference_s += time.perf_counter() - batch_start
+                progress.update(len(batch))
+    finally:
+        try:
+            sink.close()
+        finally:
+            manifest.close()
+
+    elapsed = time.perf_counter() - start
+    progress.update(0, force=True)
+    return {
+        "images": len(paths),
+        "processed": progress.session_done,
+        "already_done": already_done,
+        "failed": failed,
+        "seconds": elapsed,
+        "images_per_second": progress.session_done / elapsed if elapsed > 0 else 0.0,
+        "inference_images_per_second": progress.session_done / inference_s if inference_s > 0 else 0.0,
+        "output": sink.stats._asdict(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--pipeline", default="cm", choices=["cm", "dpm"])
+    parser.add_argument("--model-id", default="Anonymous-12/DeCorruptor-CM")
+    parser.add_argument("--dpm-model-id", default="Anonymous-12/DeCorruptor-DPM")
+    parser.add_argument(
+        "--mmap", action="store_true", help="memory-map local directories written by `save_mmap_pretrained`"
+    )
+    parser.add_argument("--tiny", action="store_true", help="use a tiny random CPU model instead of --model-id")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--prompt", default="Clean the image")
+    parser.add_argument("--num-inference-steps", type=int, default=None, help="4 for cm, 20 for dpm if not set")
+    parser.add_argument("--guidance-scale", type=float, default=7.5)
+    parser.add_argument("--image-guidance-scale", type=float, default=None, help="1.1 for cm, 1.5 for dpm if not set")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--resolution", type=int, default=512, help="base size of the resolution buckets")
+    parser.add_argument("--format", default="png", choices=OUTPUT_FORMATS)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--encode-workers", type=int, default=4)
+    parser.add_argument("--encode-processes", action="store_true", help="encode in processes instead of threads")
+    parser.add_argument("--tar-shard-size", type=int, default=None, help="write tar shards of this many images")
+    parser.add_argument("--prefetch", type=int, default=2, help="batches decoded ahead of the pipeline")
+    parser.add_argument("--limit", type=int, default=None, help="clean at most this many images in this session")
+    parser.add_argument("--restart", action="store_true", help="discard the manifest of an earlier run")
+    parser.add_argument("--log-interval-s", type=float, default=10.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args(argv)
+    if args.tiny:
+        args.device, args.dtype = "cpu", "float32"
+    if args.num_inference_steps is None:
+        args.num_inference_steps = 4 if args.pipeline == "cm" else 20
+    if args.image_guidance_scale is None:
+        args.image_guidance_scale = 1.1 if args.pipeline == "cm" else 1.5
+
+    pipe = load_pipeline(args, args.pipeline)
+    request = EditRequest(
+        image=None,
+        prompt=args.prompt,
+        num_inference_steps=args.num_inference_steps,
+        guidance_scale=args.guidance_scale,
+        image_guidance_scale=args.image_guidance_scale,
+    )
+    model_id = "tiny" if args.tiny else (args.model_id if args.pipeline == "cm" else args.dpm_model_id)
+    summary = run_dataset(
+        pipe,
+        args.input_dir,
+        args.output_dir,
+        request,
+        batch_size=args.batch_size,
+        resolution=args.resolution,
+        output_format=args.format,
+        decode_workers=args.decode_workers,
+        encode_workers=args.encode_workers,
+        encode_processes=args.encode_processes,
+        tar_shard_size=args.tar_shard_size,
+        prefetch=args.prefetch,
+        restart=args.restart,
+        limit=args.limit,
+        log_interval_s=args.log_interval_s,
+        config={"model_id": model_id, "dtype": args.dtype},
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def _samples(self) -> Iterable[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    r"""Monotonic counter, optionally split by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[Tuple, float] = OrderedDict()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def _samples(self):
+        return [(self.name, key, value) for key, value in list(self._values.items())]
+
+
+class Gauge(_Metric):
+    r"""Value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def value(self) -> float:
+        return self._value
+
+    def _samples(self):
+        return [(self.name, (), self._value)]
+
+
+class Histogram(_Metric):
+    r"""Cumulative histogram over fixed upper `buckets`, with `_sum` and `_count` like the Prometheus client."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float]):
+        super().__init__(name, documentation)
+        self.buckets = sorted(float(bucket) for bucket in buckets) + [float("inf")]
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / self._count if self._count > 0 else None
+
+    def _samples(self):
+        samples = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self._counts):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", (("le", _format_value(bucket)),), cumulative))
+        samples.append((f"{self.name}_sum", (), self._sum))
+        samples.append((f"{self.name}_count", (), self._count))
+        return samples
+
+
+class MetricsRegistry:
+    r"""
+    A minimal, dependency-free set of metrics rendered in the Prometheus text exposition format.
+
+    Metrics are registered once by name; registering an existing name returns the existing metric.
+    """
+
+    def __init__(self, namespace: str = "decorruptor"):
+        self.namespace = namespace
+        self._metrics: Dict[str, _Metric] = OrderedDict()
+
+    def _register(self, cls, name: str, *args):
+        name = f"{self.namespace}_{name}" if self.namespace else name
+        if name not in self._metrics:
+            self._metrics[name] = cls(name, *args)
+        elif not isinstance(self._metrics[name], cls):
+            raise ValueError(f"Metric {name} is already registered as a {self._metrics[name].kind}.")
+        return self._metrics[name]
+
+    def get(self, name: str) -> _Metric:
+        r"""Returns the metric registered as `name`, without the namespace prefix."""
+        return self._metrics[f"{self.namespace}_{name}" if self.namespace else name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Iterable[float]) -> Histogram:
+        return self._register(Histogram, name, documentation, buckets)
+
+    def render(self) -> str:
+        r"""Returns all metrics in the Prometheus text format, as served on `/metrics`."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
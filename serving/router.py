@@ -0,0 +1,257 @@
+import dataclasses
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .batcher import DynamicBatcher
+from .metrics import MetricsRegistry
+
+# (pipeline, num_inference_steps) options from the highest to the lowest quality
+DEFAULT_LADDER = (("dpm", 20), ("dpm", 10), ("cm", 4), ("cm", 2), ("cm", 1))
+
+# the best option every quality tier starts from
+QUALITY_TIERS = {"high": ("dpm", 20), "balanced": ("dpm", 10), "fast": ("cm", 4)}
+
+# call arguments of the released checkpoints
+PIPELINE_DEFAULTS = {
+    "dpm": {"guidance_scale": 7.5, "image_guidance_scale": 1.5},
+    "cm": {"guidance_scale": 7.5, "image_guidance_scale": 1.1},
+}
+
+
+class RouteDecision(NamedTuple):
+    r"""The option a request is run with and the latency predicted for it when it was routed."""
+
+    pipeline: str
+    num_inference_steps: int
+    predicted_latency_s: float
+    backlog_s: float
+    downgraded: bool
+    meets_deadline: bool
+
+
+class CostModel:
+    r"""
+    Per-image latency of every pipeline as `overhead_s + num_inference_steps * step_s`.
+
+    The overhead covers prompt and VAE encoding, decoding and post-processing, the step cost one denoising step with
+    its classifier-free guidance batch. Both come from [`~CostModel.calibrate`] or [`~CostModel.set`]; afterwards every
+    finished batch updates the step cost with an exponential moving average.
+
+    Args:
+        smoothing (`float`, *optional*, defaults to 0.2):
+            Weight of a new observation in the moving average.
+    """
+
+    def __init__(self, smoothing: float = 0.2):
+        if not 0 < smoothing <= 1:
+            raise ValueError(f"`smoothing` has to be in (0, 1] but is {smoothing}.")
+        self.smoothing = smoothing
+        self.overhead_s: Dict[str, float] = {}
+        self.step_s: Dict[str, float] = {}
+
+    def set(self, pipeline: str, overhead_s: float, step_s: float):
+        self.overhead_s[pipeline] = max(0.0, overhead_s)
+        self.step_s[pipeline] = max(0.0, step_s)
+
+    def predict(self, pipeline: str, num_inference_steps: int) -> float:
+        if pipeline not in self.step_s:
+            raise ValueError(f"No cost is known for pipeline {pipeline!r}; calibrate the router first.")
+        return self.overhead_s[pipeline] + num_inference_steps * self.step_s[pipeline]
+
+    def observe(self, pipeline: str, num_inference_steps: int, batch_size: int, seconds: float):
+        r"""Updates the step cost of `pipeline` from a batch of `batch_size` images that took `seconds`."""
+        if pipeline not in self.step_s:
+            return
+        per_image = seconds / batch_size
+        step_s = max(0.0, per_image - self.overhead_s[pipeline]) / num_inference_steps
+        self.step_s[pipeline] += self.smoothing * (step_s - self.step_s[pipeline])
+
+    def calibrate(self, pipeline: str, runner, request, steps: Tuple[int, int], repeats: int = 1):
+        r"""
+        Fits overhead and step cost of `pipeline` by timing `runner` on `request` at the two step counts in `steps`.
+        """
+        low, high = sorted(steps)
+        if low == high:
+            raise ValueError(f"Calibration needs two different step counts but got {steps}.")
+        latency = {}
+        for num_inference_steps in (low, high):
+            item = dataclasses.replace(request, num_inference_steps=num_inference_steps)
+            runner([item])  # warm-up
+            start = time.perf_counter()
+            for _ in range(repeats):
+                runner([item])
+            latency[num_inference_steps] = (time.perf_counter() - start) / repeats
+        step_s = max(0.0, latency[high] - latency[low]) / (high - low)
+        self.set(pipeline, latency[low] - low * step_s, step_s)
+
+
+class LatencyRouter:
+    r"""
+    Routes every request to the decorruptor DPM (20 NFEs) or CM (4 NFEs) pipeline and a step count so that it meets
+    its latency deadline.
+
+    The options in `ladder` are tried from the request's quality tier downwards. An option is taken if the predicted
+    backlog, i.e. the predicted service time of all requests routed but not finished yet, plus its own predicted
+    latency fits the deadline; if none fits, the cheapest option is taken. Bursts therefore move requests to fewer steps
+    and to the CM pipeline, and the router returns to the tier's option once the backlog has drained.
+
+    Every pipeline has its own [`~serving.batcher.DynamicBatcher`]; requests routed to the same option share batches.
+
+    Args:
+        runners (`Dict[str, Callable]`):
+            A [`~serving.server.PipelineBatchRunner`] per pipeline name used in `ladder`, e.g. `{"dpm": ..., "cm": ...}`.
+            Options of missing pipelines are skipped.
+        ladder (`Sequence[Tuple[str, int]]`, *optional*, defaults to `DEFAULT_LADDER`):
+            `(pipeline, num_inference_steps)` options from the highest to the lowest quality.
+        tiers (`Dict[str, Tuple[str, int]]`, *optional*, defaults to `QUALITY_TIERS`):
+            The ladder option every quality tier starts from.
+        default_tier (`str`, *optional*, defaults to `"high"`):
+            Tier of requests that do not name one.
+        default_deadline_s (`float`, *optional*):
+            Deadline of requests that do not set one. Without a deadline a request runs with its tier's option.
+        cost_model ([`CostModel`], *optional*):
+            Latency predictions. Has to be calibrated before requests are routed.
+        metrics ([`~serving.metrics.MetricsRegistry`], *optional*):
+            Registry of the routing metrics. Every batcher records into its own registry, prefixed with its pipeline
+            name.
+        batcher_kwargs:
+            Forwarded to every [`~serving.batcher.DynamicBatcher`], e.g. `max_batch_size`.
+    """
+
+    def __init__(
+        self,
+        runners: Dict,
+        ladder: Sequence[Tuple[str, int]] = DEFAULT_LADDER,
+        tiers: Optional[Dict[str, Tuple[str, int]]] = None,
+        default_tier: str = "high",
+        default_deadline_s: Optional[float] = None,
+        cost_model: Optional[CostModel] = None,
+        metrics: Optional[MetricsRegistry] = None,
+        **batcher_kwargs,
+    ):
+        self.ladder: List[Tuple[str, int]] = [tuple(option) for option in ladder if option[0] in runners]
+        if len(self.ladder) == 0:
+            raise ValueError(f"No option of `ladder` uses one of the pipelines {list(runners)}.")
+        self.tiers = dict(QUALITY_TIERS if tiers is None else tiers)
+        if default_tier not in self.tiers:
+            raise ValueError(f"`default_tier` has to be one of {list(self.tiers)} but is {default_tier}.")
+        self.default_tier = default_tier
+        self.default_deadline_s = default_deadline_s
+        self.cost_model = cost_model if cost_model is not None else CostModel()
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.runners = dict(runners)
+        self.batchers = {
+            name: DynamicBatcher(
+                self._observed(name, runner),
+                batch_key=_batch_key,
+                metrics=MetricsRegistry(namespace=f"{self.metrics.namespace}_{name}"),
+                **batcher_kwargs,
+            )
+            for name, runner in runners.items()
+        }
+        self.max_wait_s = max(batcher.max_wait_s for batcher in self.batchers.values())
+        self.backlog_s = 0.0
+
+        self._routed = self.metrics.counter("routed_total", "Requests by routed pipeline and step count.")
+        self._downgrades = self.metrics.counter("downgrades_total", "Requests routed below their tier's option.")
+        self._missed = self.metrics.counter("predicted_misses_total", "Requests no option was predicted to meet.")
+        self._backlog = self.metrics.gauge("backlog_seconds", "Predicted service time of unfinished requests.")
+
+    def _observed(self, name, runner):
+        def run_batch(requests):
+            start = time.perf_counter()
+            results = runner(requests)
+            self.cost_model.observe(name, requests[0].num_inference_steps, len(requests), time.perf_counter() - start)
+            return results
+
+        return run_batch
+
+    def calibrate(self, request, repeats: int = 1):
+        r"""
+        Measures overhead and step cost of every pipeline on `request` ([`~serving.server.EditRequest`]), at the
+        smallest and largest step count the ladder uses for it (or 1 and that count if it uses only one).
+        """
+        for name, runner in self.runners.items():
+            steps = sorted({num_inference_steps for pipeline, num_inference_steps in self.ladder if pipeline == name})
+            low, high = (steps[0], steps[-1]) if len(steps) > 1 else (1, max(2, steps[0]))
+            item = dataclasses.replace(request, **PIPELINE_DEFAULTS.get(name, {}))
+            self.cost_model.calibrate(name, runner, item, (low, high), repeats=repeats)
+
+    def route(self, deadline_s: Optional[float] = None, tier: Optional[str] = None) -> RouteDecision:
+        r"""Picks the option for a request with the given deadline and tier under the current backlog."""
+        tier = self.default_tier if tier is None else tier
+        if tier not in self.tiers:
+            raise ValueError(f"`tier` has to be one of {list(self.tiers)} but is {tier}.")
+        deadline_s = self.default_deadline_s if deadline_s is None else deadline_s
+
+        top = self.tiers[tier]
+        start = self.ladder.index(top) if top in self.ladder else 0
+        candidates = self.ladder[start:]
+        predictions = [self.cost_model.predict(*option) for option in candidates]
+
+        if deadline_s is None:
+            index, meets_deadline = 0, True
+        else:
+            fitting = [i for i, latency in enumerate(predictions) if self.backlog_s + latency <= deadline_s]
+            meets_deadline = len(fitting) > 0
+            index = fitting[0] if meets_deadline else min(range(len(candidates)), key=predictions.__getitem__)
+
+        pipeline, num_inference_steps = candidates[index]
+        return RouteDecision(
+            pipeline=pipeline,
+            num_inference_steps=num_inference_steps,
+            predicted_latency_s=self.backlog_s + predictions[index],
+            backlog_s=self.backlog_s,
+            downgraded=index > 0,
+            meets_deadline=meets_deadline,
+        )
+
+    async def start(self):
+        for batcher in self.batchers.values():
+            await batcher.start()
+
+    async def stop(self):
+        for batcher in self.batchers.values():
+            await batcher.stop()
+
+    async def submit(self, request, timeout: Optional[float] = None, tier: Optional[str] = None):
+        r"""
+        Routes `request` ([`~serving.server.EditRequest`]) and waits for its result. The step count and guidance
+        scales of the request are replaced with those of the chosen option.
+
+        Args:
+            timeout (`float`, *optional*):
+                The deadline in seconds. It is used for routing and as the timeout of the request.
+            tier (`str`, *optional*):
+                One of the router's quality tiers.
+
+        Returns:
+            `Tuple[PIL.Image.Image, RouteDecision]`: the cleaned image and how it was produced.
+        """
+        decision = self.route(timeout, tier)
+        self._routed.inc(pipeline=decision.pipeline, steps=str(decision.num_inference_steps))
+        if decision.downgraded:
+            self._downgrades.inc()
+        if not decision.meets_deadline:
+            self._missed.inc()
+
+        request = dataclasses.replace(
+            request, num_inference_steps=decision.num_inference_steps, **PIPELINE_DEFAULTS.get(decision.pipeline, {})
+        )
+        cost = decision.predicted_latency_s - decision.backlog_s
+        self.backlog_s += cost
+        self._backlog.set(self.backlog_s)
+        try:
+            image = await self.batchers[decision.pipeline].submit(request, timeout=timeout)
+        finally:
+            self.backlog_s = max(0.0, self.backlog_s - cost)
+            self._backlog.set(self.backlog_s)
+        return image, decision
+
+    def render_metrics(self) -> str:
+        r"""Router metrics followed by the metrics of every pipeline's batcher."""
+        return self.metrics.render() + "".join(batcher.metrics.render() for batcher in self.batchers.values())
+
+
+def _batch_key(request):
+    return request.batch_key()
@@ -0,0 +1,418 @@
+"""
+Local HTTP server for the decorruptor pipelines with dynamic batching.
+
+    python -m serving.server --model-id Anonymous-12/DeCorruptor-CM --port 8000
+    python -m serving.server --tiny --unix-socket /tmp/decorruptor.sock    # random tiny CPU model, no download
+    python -m serving.server --route --timeout-s 2                          # DPM or CM per request deadline
+
+Endpoints:
+
+- `POST /v1/edit` takes the raw bytes of an image (any format PIL reads) and returns the cleaned image as PNG. The query
+  string may set `prompt`, `num_inference_steps`, `guidance_scale`, `image_guidance_scale` and `timeout_s`. With
+  `--route`, both pipelines are loaded, `timeout_s` is the latency deadline the pipeline and step count are picked
+  for, `tier` one of `high`, `balanced` or `fast`, and the `X-Decorruptor-Route` response header names the choice.
+- `GET /metrics` returns the queue depth, batch fill and latency metrics in the Prometheus text format.
+- `GET /healthz` returns `ok`.
+
+A full queue is answered with `503` and a `Retry-After` header, a request that misses its timeout with `504`.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import PIL.Image
+
+from .batcher import DynamicBatcher, QueueFullError
+from .metrics import MetricsRegistry
+from .router import LatencyRouter
+
+logger = logging.getLogger(__name__)
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    408: "Request Timeout",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+# the paths `http_requests_total` is split by; every other path is counted as "other"
+ROUTES = ("/v1/edit", "/metrics", "/healthz")
+
+
+@dataclass
+class EditRequest:
+    r"""One image to clean and the call arguments it is cleaned with."""
+
+    image: PIL.Image.Image
+    prompt: str = "Clean the image"
+    num_inference_steps: int = 4
+    guidance_scale: float = 7.5
+    image_guidance_scale: float = 1.1
+
+    def batch_key(self):
+        r"""Requests with equal keys can share one pipeline call."""
+        return (self.prompt, self.num_inference_steps, self.guidance_scale, self.image_guidance_scale)
+
+
+class PipelineBatchRunner:
+    r"""
+    Runs a batch of [`EditRequest`]s, all with the same [`~EditRequest.batch_key`], as one pipeline call.
+
+    Images of different sizes are grouped by a [`~pipeline.bucketing.ResolutionBucketer`], so a batch runs as one UNet
+    batch per bucket, and every output is returned at its input size.
+
+    Args:
+        pipe ([`IP2PLatentConsistencyModelPipeline`] or [`ConsistInstructPix2PixPipeline`]):
+            The pipeline to run.
+        bucketer ([`~pipeline.bucketing.ResolutionBucketer`], *optional*):
+            Groups mixed image sizes. Defaults to 512-pixel buckets with the `"resize"` policy.
+    """
+
+    def __init__(self, pipe, bucketer=None):
+        from pipeline.bucketing import ResolutionBucketer
+
+        self.pipe = pipe
+        self.bucketer = bucketer if bucketer is not None else ResolutionBucketer()
+        self.images_processed = 0
+
+    def __call__(self, requests: List[EditRequest], output_sink=None, output_keys: Optional[List[str]] = None) -> list:
+        r"""
+        Returns the cleaned images in request order. With an [`~pipeline.output_sink.OutputSink`], they are handed to
+        it as `uint8` arrays under `output_keys` instead, and their keys are returned.
+        """
+        first = requests[0]
+        image_guidance_scale = first.image_guidance_scale
+        if self.pipe.__class__.__name__ == "ConsistInstructPix2PixPipeline":
+            image_guidance_scale = [image_guidance_scale] * first.num_inference_steps
+        output = self.bucketer(
+            self.pipe,
+            [request.image for request in requests],
+            prompt=first.prompt,
+            num_inference_steps=first.num_inference_steps,
+            guidance_scale=first.guidance_scale,
+            image_guidance_scale=image_guidance_scale,
+            output_sink=output_sink,
+            output_keys=output_keys,
+        )
+        self.images_processed += len(requests)
+        return output.images
+
+
+class DecorruptorServer:
+    r"""
+    A small asyncio HTTP/1.1 server in front of a [`~serving.batcher.DynamicBatcher`], listening on TCP or on a Unix
+    socket. Every connection carries one request.
+
+    Args:
+        batcher ([`~serving.batcher.DynamicBatcher`] or [`~serving.router.LatencyRouter`]):
+            Batches the [`EditRequest`]s of concurrent connections, or routes them to one of several pipelines.
+        request_timeout_s (`float`, *optional*, defaults to 30):
+            Default time a request may take from arrival to result; the `timeout_s` query parameter overrides it.
+        max_body_bytes (`int`, *optional*, defaults to 32 MiB):
+            Largest accepted upload.
+        defaults ([`EditRequest`], *optional*):
+            Provides the call arguments requests do not set. Its image is ignored.
+    """
+
+    def __init__(
+        self,
+        batcher: DynamicBatcher,
+        request_timeout_s: float = 30.0,
+        max_body_bytes: int = 32 << 20,
+        defaults: Optional[EditRequest] = None,
+    ):
+        self.batcher = batcher
+        self.request_timeout_s = request_timeout_s
+        self.max_body_bytes = max_body_bytes
+        self.defaults = defaults if defaults is not None else EditRequest(image=None)
+        self._http_requests = batcher.metrics.counter("http_requests_total", "HTTP requests by path and status code.")
+        self._server = None
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None, unix_socket: Optional[str] = None):
+        r"""Starts the batcher and listens on `unix_socket` if defined, else on `host:port`."""
+        await self.batcher.start()
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host or "127.0.0.1", port=port or 8000)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _parse_edit(self, query: dict, body: bytes) -> EditRequest:
+        if len(body) == 0:
+            raise ValueError("The request body has to hold an image.")
+        try:
+            image = PIL.Image.open(io.BytesIO(body))
+            image = image.convert("RGB")
+        except (OSError, PIL.Image.DecompressionBombError) as e:
+            raise ValueError(f"The request body is not a readable image: {e}")
+
+        def get(name, cast):
+            values = query.get(name)
+            if not values:
+                return getattr(self.defaults, name)
+            try:
+                return cast(values[-1])
+            except ValueError:
+                raise ValueError(f"Invalid value for `{name}`: {values[-1]!r}.")
+
+        request = EditRequest(
+            image=image,
+            prompt=get("prompt", str),
+            num_inference_steps=get("num_inference_steps", int),
+            guidance_scale=get("guidance_scale", float),
+            image_guidance_scale=get("image_guidance_scale", float),
+        )
+        if request.num_inference_steps < 1:
+            raise ValueError(f"`num_inference_steps` has to be positive but is {request.num_inference_steps}.")
+        return request
+
+    async def _dispatch(self, method: str, target: str, body: bytes):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/healthz":
+            return 200, "text/plain", b"ok\n", {}
+        if url.path == "/metrics":
+            if isinstance(self.batcher, LatencyRouter):
+                metrics = self.batcher.render_metrics()
+            else:
+                metrics = self.batcher.metrics.render()
+            return 200, "text/plain; version=0.0.4", metrics.encode(), {}
+        if url.path != "/v1/edit":
+            return 404, "text/plain", b"not found\n", {}
+        if method != "POST":
+            return 405, "text/plain", b"use POST\n", {"Allow": "POST"}
+
+        try:
+            request = self._parse_edit(query, body)
+            timeout = float(query["timeout_s"][-1]) if "timeout_s" in query else self.request_timeout_s
+            tier = query.get("tier", [None])[-1]
+            if isinstance(self.batcher, LatencyRouter) and tier is not None and tier not in self.batcher.tiers:
+                raise ValueError(f"`tier` has to be one of {list(self.batcher.tiers)} but is {tier}.")
+        except ValueError as e:
+            return 400, "application/json", json.dumps({"error": str(e)}).encode(), {}
+
+        route_headers = {}
+        try:
+            if isinstance(self.batcher, LatencyRouter):
+                image, decision = await self.batcher.submit(request, timeout=timeout, tier=tier)
+                route_headers["X-Decorruptor-Route"] = f"{decision.pipeline}/{decision.num_inference_steps}"
+            else:
+                image = await self.batcher.submit(request, timeout=timeout)
+        except QueueFullError as e:
+            retry_after = max(1, round(self.batcher.max_wait_s + 1))
+            return 503, "application/json", json.dumps({"error": str(e)}).encode(), {"Retry-After": str(retry_after)}
+        except asyncio.TimeoutError:
+            error = f"The request did not finish within {timeout} s."
+            return 504, "application/json", json.dumps({"error": error}).encode(), {}
+        except Exception as e:  # noqa: BLE001 - pipeline failures become 500 responses
+            logger.exception("Batch failed")
+            return 500, "application/json", json.dumps({"error": str(e)}).encode(), {}
+
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return 200, "image/png", buffer.getvalue(), route_headers
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise ValueError("Malformed request line.")
+        method, target, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body_bytes:
+            return method, target, None
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, target, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        path = "-"
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), self.request_timeout_s)
+            except asyncio.TimeoutError:
+                request, status, content_type, payload, headers = None, 408, "text/plain", b"timeout\n", {}
+            except (ValueError, asyncio.IncompleteReadError):
+                request, status, content_type, payload, headers = None, 400, "text/plain", b"bad request\n", {}
+            else:
+                if request is None:
+                    return
+                method, target, body = request
+                path = urlsplit(target).path
+                path = path if path in ROUTES else "other"
+                if body is None:
+                    status, content_type, payload, headers = 413, "text/plain", b"payload too large\n", {}
+                else:
+                    status, content_type, payload, headers = await self._dispatch(method, target, body)
+
+            self._http_requests.inc(path=path, code=str(status))
+            head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}"]
+            head += [f"Content-Length: {len(payload)}", "Connection: close"]
+            head += [f"{name}: {value}" for name, value in headers.items()]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+def load_pipeline(args, kind: str = "cm"):
+    import torch
+
+    if args.tiny:
+        from benchmarks.components import tiny_dpm_pipeline, tiny_lcm_pipeline
+
+        return tiny_lcm_pipeline() if kind == "cm" else tiny_dpm_pipeline()
+
+    from diffusers import DDIMScheduler, LCMScheduler
+
+    torch_dtype = torch.float16 if args.dtype == "float16" else torch.float32
+    if kind == "cm":
+        from pipeline.deccoruptor_lcm_pipe import IP2PLatentConsistencyModelPipeline
+
+        if args.mmap:
+            pipe = IP2PLatentConsistencyModelPipeline.from_mmap_pretrained(
+                args.model_id, torch_dtype=torch_dtype, safety_checker=None
+            )
+        else:
+            scheduler = LCMScheduler.from_pretrained(args.model_id, subfolder="scheduler")
+            pipe = IP2PLatentConsistencyModelPipeline.from_pretrained(
+                args.model_id, torch_dtype=torch_dtype, scheduler=scheduler, use_safetensors=True, safety_checker=None
+            )
+    else:
+        from pipeline.deccoruptor_dpm_pipe import ConsistInstructPix2PixPipeline
+
+        scheduler = DDIMScheduler(
+            beta_start=0.00085,
+            beta_end=0.012,
+            num_train_timesteps=1000,
+            beta_schedule="scaled_linear",
+            clip_sample=False,
+            set_alpha_to_one=False,
+        )
+        if args.mmap:
+            pipe = ConsistInstructPix2PixPipeline.from_mmap_pretrained(
+                args.dpm_model_id, torch_dtype=torch_dtype, scheduler=scheduler, safety_checker=None
+            )
+        else:
+            pipe = ConsistInstructPix2PixPipeline.from_pretrained(
+                args.dpm_model_id,
+                torch_dtype=torch_dtype,
+                scheduler=scheduler,
+                use_safetensors=True,
+                safety_checker=None,
+            )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe.to(args.device)
+
+
+def build_server(pipe, args) -> DecorruptorServer:
+    r"""
+    Builds the server for `pipe`, or for a latency router over the pipelines of a `{"dpm": ..., "cm": ...}` dict. The
+    router is calibrated on a blank image at the bucket resolution before it is returned.
+    """
+    from pipeline.bucketing import ResolutionBucketer, make_buckets
+
+    def runner(pipe):
+        bucketer = ResolutionBucketer(buckets=make_buckets(args.resolution), max_batch_size=args.max_batch_size)
+        return PipelineBatchRunner(pipe, bucketer)
+
+    batcher_kwargs = dict(
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms, max_queue_size=args.max_queue_size
+    )
+    if isinstance(pipe, dict):
+        batcher = LatencyRouter({name: runner(p) for name, p in pipe.items()}, **batcher_kwargs)
+        blank = PIL.Image.new("RGB", (args.resolution, args.resolution), (128, 128, 128))
+        batcher.calibrate(EditRequest(image=blank))
+    else:
+        batcher = DynamicBatcher(
+            runner(pipe), batch_key=EditRequest.batch_key, metrics=MetricsRegistry(), **batcher_kwargs
+        )
+    defaults = EditRequest(image=None, num_inference_steps=args.num_inference_steps)
+    return DecorruptorServer(batcher, request_timeout_s=args.timeout_s, defaults=defaults)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-id", default="Anonymous-12/DeCorruptor-CM")
+    parser.add_argument("--dpm-model-id", default="Anonymous-12/DeCorruptor-DPM")
+    parser.add_argument(
+        "--mmap", action="store_true", help="memory-map local directories written by `save_mmap_pretrained`"
+    )
+    parser.add_argument("--route", action="store_true", help="load both pipelines and route requests by deadline")
+    parser.add_argument("--tiny", action="store_true", help="serve a tiny random CPU model instead of --model-id")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--max-queue-size", type=int, default=64)
+    parser.add_argument("--timeout-s", type=float, default=30.0)
+    parser.add_argument("--num-inference-steps", type=int, default=4)
+    parser.add_argument("--resolution", type=int, default=512, help="base size of the resolution buckets")
+    return parser.parse_args(argv)
+
+
+async def _serve(args):
+    if args.route:
+        pipe = {"dpm": load_pipeline(args, "dpm"), "cm": load_pipeline(args, "cm")}
+    else:
+        pipe = load_pipeline(args)
+    server = build_server(pipe, args)
+    await server.start(host=args.host, port=args.port, unix_socket=args.unix_socket)
+    where = args.unix_socket or f"http://{args.host}:{args.port}"
+    logger.info(f"Serving the decorruptor on {where}")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    if args.tiny:
+        args.device, args.dtype = "cpu", "float32"
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import queue
+import time
+import traceback
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+import torch.multiprocessing as mp
+
+_STOP = None
+
+
+def available_cores() -> int:
+    r"""Number of CPU cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def share_pipeline_weights(pipe) -> int:
+    r"""
+    Moves the parameters and buffers of every model of `pipe` into shared memory, so that worker processes map the
+    same pages instead of holding a copy each. Returns the number of shared bytes.
+    """
+    shared = 0
+    for component in pipe.components.values():
+        if isinstance(component, torch.nn.Module):
+            component.share_memory()
+            for tensor in list(component.parameters()) + list(component.buffers()):
+                shared += tensor.numel() * tensor.element_size()
+    return shared
+
+
+def _worker_main(pipe, num_threads: int, tasks, results):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # the inter-op pool of a forked worker may already be initialised
+        pass
+    pipe.set_progress_bar_config(disable=True)
+
+    while True:
+        task = tasks.get()
+        if task is _STOP:
+            break
+        task_id, images, call_kwargs = task
+        try:
+            with torch.inference_mode():
+                output = pipe(image=images, **call_kwargs)
+            results.put((task_id, output.images, None))
+        except Exception:  # noqa: BLE001 - reported to the parent, which re-raises it
+            results.put((task_id, None, traceback.format_exc()))
+
+
+class CPUWorkerPool:
+    r"""
+    Runs a decorruptor pipeline in several CPU worker processes that share one copy of the model weights.
+
+    The weights are moved into shared memory once (see [`share_pipeline_weights`]) and every worker receives the
+    pipeline by reference to that memory, so `N` workers cost one set of weights plus their activations. Every worker
+    uses `threads_per_worker` intra-op threads; work is handed out from one queue, so a worker that finishes early takes
+    the next batch.
+
+    Args:
+        pipe ([`IP2PLatentConsistencyModelPipeline`] or [`ConsistInstructPix2PixPipeline`]):
+            A pipeline on the CPU.
+        num_workers (`int`, *optional*):
+            Number of worker processes. Defaults to one per 4 available cores.
+        threads_per_worker (`int`, *optional*):
+            Intra-op threads of every worker. Defaults to the available cores divided by `num_workers`.
+        start_method (`str`, *optional*, defaults to `"spawn"`):
+            `"spawn"` passes the shared weights to fresh interpreters and is safe with OpenMP; `"fork"` starts faster
+            but must not be used once the parent has run multi-threaded torch operations.
+        poll_interval_s (`float`, *optional*, defaults to 1.0):
+            How often [`~CPUWorkerPool.map`] checks that the workers are still alive while it waits for results; a
+            worker that died (killed for lack of memory, crashed) makes it raise instead of waiting forever.
+    """
+
+    def __init__(
+        self,
+        pipe,
+        num_workers: Optional[int] = None,
+        threads_per_worker: Optional[int] = None,
+        start_method: str = "spawn",
+        poll_interval_s: float = 1.0,
+    ):
+        cores = available_cores()
+        if num_workers is None:
+            num_workers = max(1, cores // 4)
+        if threads_per_worker is None:
+            threads_per_worker = max(1, cores // num_workers)
+        if num_workers < 1 or threads_per_worker < 1:
+            raise ValueError(
+                f"`num_workers` and `threads_per_worker` have to be positive but are {num_workers} and"
+                f" {threads_per_worker}."
+            )
+        if pipe.device.type != "cpu":
+            raise ValueError(f"`CPUWorkerPool` runs CPU pipelines but the pipeline is on {pipe.device}.")
+
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.poll_interval_s = poll_interval_s
+        self.shared_bytes = share_pipeline_weights(pipe)
+
+        context = mp.get_context(start_method)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(
+                target=_worker_main, args=(pipe, threads_per_worker, self._tasks, self._results), daemon=True
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._next_task = 0
+
+    @property
+    def worker_pids(self) -> List[int]:
+        return [worker.pid for worker in self._workers or []]
+
+    def map(self, images: Sequence, batch_size: int = 1, **call_kwargs) -> List:
+        r"""
+        Cleans `images` in batches of `batch_size` spread over the workers and returns the outputs in input order.
+
+        Args:
+            images (`Sequence[PIL.Image.Image]`):
+                The corrupted images. Images of one batch have to share a size.
+            batch_size (`int`, *optional*, defaults to 1):
+                Images per pipeline call.
+            call_kwargs:
+                Forwarded to the pipeline, e.g. `prompt`, `num_inference_steps` or `output_type`.
+        """
+        if batch_size < 1:
+            raise ValueError(f"`batch_size` has to be a positive integer but is {batch_size}.")
+        if self._workers is None:
+            raise RuntimeError("The worker pool is closed.")
+        call_kwargs.setdefault("prompt", "Clean the image")
+        call_kwargs.pop("return_dict", None)
+
+        images = list(images)
+        pending: Dict[int, int] = {}
+        for start in range(0, len(images), batch_size):
+            task_id = self._next_task
+            self._next_task += 1
+            pending[task_id] = start
+            self._tasks.put((task_id, images[start : start + batch_size], call_kwargs))
+
+        outputs = [None] * len(images)
+        while pending:
+            try:
+                task_id, batch_outputs, error = self._results.get(timeout=self.poll_interval_s)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if task_id not in pending:
+                continue
+            if error is not None:
+                raise RuntimeError(f"A pool worker failed:\n{error}")
+            start = pending.pop(task_id)
+            outputs[start : start + len(batch_outputs)] = batch_outputs
+        return outputs
+
+    def _check_workers(self):
+        dead = [(worker.pid, worker.exitcode) for worker in self._workers if not worker.is_alive()]
+        if dead:
+            # the batches of a killed worker are lost, so waiting for them would never end
+            self.close()
+            raise RuntimeError(
+                f"Pool workers died while batches were pending (pid, exit code): {dead}. A negative exit code is the"
+                " signal that killed the worker, e.g. -9 when the kernel ran out of memory."
+            )
+
+    def close(self):
+        r"""Stops the workers after their current batch."""
+        if self._workers is None:
+            return
+        for _ in self._workers:
+            self._tasks.put(_STOP)
+        for worker in self._workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PoolConfig(NamedTuple):
+    num_workers: int
+    threads_per_worker: int
+    throughput_img_s: float
+
+
+def pool_candidates(cores: int, max_workers: Optional[int] = None) -> List[Tuple[int, int]]:
+    r"""`(num_workers, threads_per_worker)` splits that use all `cores`: every divisor of `cores` as worker count."""
+    max_workers = cores if max_workers is None else max_workers
+    return [(workers, cores // workers) for workers in range(1, min(cores, max_workers) + 1) if cores % workers == 0]
+
+
+def autotune_pool(
+    pipe,
+    images: Sequence,
+    candidates: Optional[Sequence[Tuple[int, int]]] = None,
+    batch_size: int = 1,
+    start_method: str = "spawn",
+    **call_kwargs,
+) -> Tuple[PoolConfig, List[PoolConfig]]:
+    r"""
+    Measures the throughput of every `(num_workers, threads_per_worker)` split on `images` and returns the fastest one
+    together with all measurements.
+
+    Every candidate pool is warmed up with one batch per worker before it is timed; process start-up is not counted.
+
+    Args:
+        candidates (`Sequence[Tuple[int, int]]`, *optional*):
+            Splits to try. Defaults to [`pool_candidates`] for the available cores.
+        batch_size (`int`, *optional*, defaults to 1):
+            Images per pipeline call.
+        call_kwargs:
+            Forwarded to the pipeline.
+    """
+    if candidates is None:
+        candidates = pool_candidates(available_cores())
+    images = list(images)
+    report = []
+    for num_workers, threads_per_worker in candidates:
+        with CPUWorkerPool(pipe, num_workers, threads_per_worker, start_method=start_method) as pool:
+            pool.map(images[:batch_size] * num_workers, batch_size=batch_size, **call_kwargs)
+            start = time.perf_counter()
+            pool.map(images, batch_size=batch_size, **call_kwargs)
+            elapsed = time.perf_counter() - start
+        report.append(PoolConfig(num_workers, threads_per_worker, len(images) / elapsed))
+    return max(report, key=lambda config: config.throughput_img_s), report
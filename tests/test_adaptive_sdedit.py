@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from pipeline import SeveritySchedule
+from pipeline.adaptive_sdedit import SeverityLevel
+
+
+def test_levels_without_a_step_raise():
+    pipe = tiny_lcm_pipeline(width=32)
+    images = load_samples(64)[1][:2]
+    schedule = SeveritySchedule([SeverityLevel(1.0, 0.25)])
+
+    assert pipe(prompt="Clean the image", image=images, num_inference_steps=4, severity_schedule=schedule).severity
+    # a quarter of two steps rounds down to none
+    with pytest.raises(ValueError, match="no denoising step"):
+        pipe(prompt="Clean the image", image=images, num_inference_steps=2, severity_schedule=schedule)
@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+import pytest
+
+from serving.batcher import DynamicBatcher
+
+
+def test_stop_fails_the_running_batch():
+    started = threading.Event()
+    release = threading.Event()
+
+    def run_batch(items):
+        started.set()
+        release.wait(5)
+        return items
+
+    async def scenario():
+        batcher = DynamicBatcher(run_batch, max_batch_size=2, max_wait_ms=0)
+        await batcher.start()
+        request = asyncio.ensure_future(batcher.submit("a"))
+        while not started.is_set():
+            await asyncio.sleep(0.001)
+        stopping = asyncio.ensure_future(batcher.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await stopping
+        with pytest.raises(RuntimeError, match="stopped"):
+            await asyncio.wait_for(request, timeout=5)
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import torch
+
+from benchmarks.components import load_samples, tiny_dpm_pipeline, tiny_lcm_pipeline
+
+NUM_IMAGES_PER_PROMPT = 2
+
+
+@pytest.fixture(scope="module")
+def images():
+    return load_samples(64)[1][:3]
+
+
+def call(pipe, images, seed, **kwargs):
+    generator = [torch.Generator().manual_seed(seed + i) for i in range(len(images) * NUM_IMAGES_PER_PROMPT)]
+    return pipe(
+        prompt="Clean the image",
+        image=images,
+        num_images_per_prompt=NUM_IMAGES_PER_PROMPT,
+        generator=generator,
+        output_type="np",
+        **kwargs,
+    ).images
+
+
+@pytest.mark.parametrize("sdedit", [None, True])
+@pytest.mark.parametrize("make_pipe", [tiny_lcm_pipeline, tiny_dpm_pipeline])
+def test_images_per_prompt_follow_their_image(images, make_pipe, sdedit):
+    pipe = make_pipe(width=32)
+    kwargs = dict(num_inference_steps=2, sdedit=sdedit, strength=0.5)
+    if make_pipe is tiny_lcm_pipeline and not sdedit:
+        # the CM loop draws the noise between its steps from the global generator; a single step draws none
+        kwargs["num_inference_steps"] = 1
+    if make_pipe is tiny_dpm_pipeline:
+        kwargs["image_guidance_scale"] = [1.5] * kwargs["num_inference_steps"]
+
+    batched = call(pipe, images, 0, **kwargs)
+    split = call(pipe, images, 0, max_batch_size=2, **kwargs)
+    np.testing.assert_allclose(split, batched, atol=1e-5)
+
+    # the samples of every image are contiguous and match running that image on its own with its generators
+    for index, image in enumerate(images):
+        alone = call(pipe, [image], index * NUM_IMAGES_PER_PROMPT, **kwargs)
+        samples = batched[index * NUM_IMAGES_PER_PROMPT : (index + 1) * NUM_IMAGES_PER_PROMPT]
+        np.testing.assert_allclose(samples, alone, atol=1e-5)
@@ -0,0 +1,40 @@
+import pytest
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from pipeline import DecorruptorPipelineOutput, ResolutionBucketer, SeveritySchedule
+
+BUCKETS = [(64, 64), (48, 96), (96, 48)]
+
+
+@pytest.fixture(scope="module")
+def images():
+    samples = load_samples(64)[1]
+    # interleave the buckets, so that bucket order differs from input order
+    return [samples[0], samples[1].resize((96, 48)), samples[2].resize((48, 96)), samples[3], samples[4].resize((40, 88))]
+
+
+@pytest.fixture(scope="module")
+def pipe():
+    return tiny_lcm_pipeline(width=32)
+
+
+def test_outputs_follow_the_input_order(pipe, images):
+    bucketer = ResolutionBucketer(BUCKETS, max_batch_size=2)
+    kwargs = dict(num_inference_steps=4, severity_schedule=SeveritySchedule())
+    output = bucketer(pipe, images, **kwargs)
+
+    assert isinstance(output, DecorruptorPipelineOutput)
+    assert [img.size for img in output.images] == [img.size for img in images]
+    assert output.severity == pytest.approx([bucketer(pipe, [img], **kwargs).severity[0] for img in images])
+
+
+def test_images_per_prompt_keep_their_input_size(pipe, images):
+    output = ResolutionBucketer(BUCKETS, max_batch_size=2)(pipe, images, num_inference_steps=1, num_images_per_prompt=2)
+
+    assert [img.size for img in output.images] == [img.size for img in images for _ in range(2)]
+    assert output.num_inference_steps_used == [1] * 2 * len(images)
+
+
+def test_non_pil_output_types_raise(pipe, images):
+    with pytest.raises(ValueError, match="output_type"):
+        ResolutionBucketer(BUCKETS)(pipe, images, output_type="np")
@@ -0,0 +1,32 @@
+import numpy as np
+import torch
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+
+NUM_STEPS = 4
+
+
+def call(pipe, images):
+    # the CM loop draws the noise between its steps from the global generator
+    torch.manual_seed(0)
+    return pipe(prompt="Clean the image", image=images, num_inference_steps=NUM_STEPS, output_type="np").images
+
+
+def test_compiled_step_matches_the_eager_loop():
+    pipe = tiny_lcm_pipeline(width=32)
+    images = load_samples(64)[1][:2]
+    expected = call(pipe, images)
+
+    # the "eager" backend traces the step with dynamo without generating code, which keeps the test fast
+    compiled_step = pipe.enable_compiled_step(backend="eager")
+    np.testing.assert_allclose(call(pipe, images), expected, atol=1e-5)
+    assert (compiled_step.compiled_calls, compiled_step.eager_calls) == (NUM_STEPS, 0)
+    assert len(compiled_step.shapes()) == 1
+
+    # shapes beyond the limit run the same step eagerly
+    compiled_step = pipe.enable_compiled_step(max_shapes=0)
+    np.testing.assert_allclose(call(pipe, images), expected, atol=1e-5)
+    assert (compiled_step.compiled_calls, compiled_step.eager_calls) == (0, NUM_STEPS)
+
+    pipe.disable_compiled_step()
+    np.testing.assert_array_equal(call(pipe, images), expected)
@@ -0,0 +1,37 @@
+import logging
+
+import pytest
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from pipeline import CorruptionGate
+
+
+@pytest.fixture(scope="module")
+def images():
+    return load_samples(64)[1][:2]
+
+
+@pytest.fixture
+def pipe():
+    pipe = tiny_lcm_pipeline(width=32)
+    # no image reaches the threshold, so a gated call skips them all
+    pipe.enable_corruption_gate(CorruptionGate(), threshold=2.0)
+    return pipe
+
+
+def test_clean_images_skip_the_diffusion(pipe, images):
+    output = pipe(prompt="Clean the image", image=images, num_inference_steps=1)
+    assert output.corruption_detected == [False, False]
+    assert pipe.corruption_gate_stats == {"images": 2, "skipped": 2}
+
+
+@pytest.mark.parametrize("call_kwargs", [dict(output_type="latent"), dict(num_images_per_prompt=2)])
+def test_unsupported_calls_bypass_the_gate(pipe, images, call_kwargs, caplog):
+    with caplog.at_level(logging.DEBUG, logger="pipeline.corruption_gate"):
+        for _ in range(2):
+            output = pipe(prompt="Clean the image", image=images, num_inference_steps=1, **call_kwargs)
+
+    assert output.corruption_detected is None
+    assert len(output.images) == len(images) * call_kwargs.get("num_images_per_prompt", 1)
+    assert pipe.corruption_gate_stats == {"images": 0, "skipped": 0}
+    assert sum("bypassed" in record.getMessage() for record in caplog.records) == 1
@@ -0,0 +1,116 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tarfile
+import time
+
+import PIL.Image
+import pytest
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from pipeline.output_sink import TarShardWriter
+from serving.dataset_runner import run_dataset
+from serving.server import EditRequest
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    images = load_samples(64)[1]
+    root = tmp_path / "input"
+    (root / "a").mkdir(parents=True)
+    images[0].save(root / "a" / "x.png")
+    images[1].save(root / "a" / "x.jpg")
+    images[2].resize((80, 48)).save(root / "a" / "y.png")
+    return str(root)
+
+
+def test_outputs_keep_the_input_name_and_size(dataset, tmp_path, monkeypatch):
+    pipe = tiny_lcm_pipeline(width=32)
+    postprocess = pipe.image_processor.postprocess
+
+    def uint8_only(image, output_type="pil", **kwargs):
+        # the images reach the sink as `uint8` arrays, never as PIL images
+        assert output_type != "pil"
+        return postprocess(image, output_type=output_type, **kwargs)
+
+    monkeypatch.setattr(pipe.image_processor, "postprocess", uint8_only)
+    output_dir = str(tmp_path / "output")
+    summary = run_dataset(pipe, dataset, output_dir, EditRequest(image=None, num_inference_steps=1), resolution=64)
+
+    assert summary["processed"] == 3
+    for name in ("x.png", "x.jpg", "y.png"):
+        with PIL.Image.open(os.path.join(dataset, "a", name)) as image, PIL.Image.open(
+            os.path.join(output_dir, "a", name + ".png")
+        ) as output:
+            assert output.size == image.size
+
+    summary = run_dataset(pipe, dataset, output_dir, EditRequest(image=None, num_inference_steps=1), resolution=64)
+    assert (summary["processed"], summary["already_done"]) == (0, 3)
+
+
+def run_cli(input_dir, output_dir):
+    command = [sys.executable, "-m", "serving.dataset_runner", input_dir, output_dir, "--tiny", "--resolution", "64"]
+    command += ["--num-inference-steps", "1", "--batch-size", "2", "--tar-shard-size", "4", "--log-interval-s", "60"]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def manifest_entries(output_dir):
+    path = os.path.join(output_dir, "manifest.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = f.read().splitlines()[1:]
+    return [json.loads(line) for line in lines if line.endswith("}")]
+
+
+def test_killed_tar_run_resumes_with_readable_shards(tmp_path):
+    input_dir, output_dir = tmp_path / "input", str(tmp_path / "output")
+    input_dir.mkdir()
+    images = load_samples(64)[1]
+    names = [f"{index:03d}.png" for index in range(48)]
+    for index, name in enumerate(names):
+        images[index % len(images)].save(input_dir / name)
+
+    process = run_cli(str(input_dir), output_dir)
+    deadline = time.time() + 120
+    while len(manifest_entries(output_dir)) < 6 and process.poll() is None and time.time() < deadline:
+        time.sleep(0.01)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    recorded = manifest_entries(output_dir)
+    assert 6 <= len(recorded) < len(names)
+
+    # the images recorded by the killed run are complete in their shard, which was never closed
+    for entry in recorded:
+        shard, member = entry["output"].rsplit(":", 1)
+        with tarfile.open(shard) as tar:
+            assert tar.extractfile(member).read()
+
+    assert run_cli(str(input_dir), output_dir).wait() == 0
+    entries = manifest_entries(output_dir)
+    assert sorted(entry["input"] for entry in entries) == names
+    for entry in entries:
+        shard, member = entry["output"].rsplit(":", 1)
+        with tarfile.open(shard) as tar:
+            tar.getmembers()
+            with PIL.Image.open(tar.extractfile(member)) as image:
+                assert image.size == (64, 64)
+
+
+def test_truncated_shard_is_repaired(tmp_path):
+    pattern = str(tmp_path / "shard-%06d.tar")
+    writer = TarShardWriter(pattern)
+    for name in ("a", "b", "c"):
+        writer.write(name, bytes(range(256)) * 4)
+    writer.close()
+    # a run killed while writing "c"
+    with open(pattern % 0, "r+b") as f:
+        f.truncate(tarfile.BLOCKSIZE * 7 + 100)
+
+    writer = TarShardWriter(pattern)
+    with tarfile.open(pattern % 0) as tar:
+        assert tar.getnames() == ["a", "b"]
+    assert writer.write("c", b"c").startswith(pattern % 1)
+    writer.close()
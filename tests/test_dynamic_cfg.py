@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+
+from benchmarks.components import load_samples, tiny_dpm_pipeline
+
+
+def call(pipe, image_guidance_scale, **kwargs):
+    return pipe(
+        prompt="Clean the image",
+        image=load_samples(64)[1][:2],
+        num_inference_steps=len(image_guidance_scale),
+        guidance_scale=7.5,
+        image_guidance_scale=image_guidance_scale,
+        generator=torch.Generator().manual_seed(0),
+        output_type="np",
+        **kwargs,
+    ).images
+
+
+def test_zero_tolerance_matches_the_full_cfg_batch():
+    pipe = tiny_dpm_pipeline(width=32)
+    # one step of each case: all branches, no unconditional branch, no image branch
+    image_guidance_scale = [1.5, 1.0, 7.5, 2.0]
+
+    full = call(pipe, image_guidance_scale)
+    assert pipe.cfg_batch_schedule == [3, 3, 3, 3]
+
+    shrunk = call(pipe, image_guidance_scale, dynamic_cfg_tolerance=0.0)
+    assert pipe.cfg_batch_schedule == [3, 2, 2, 3]
+    np.testing.assert_allclose(shrunk, full, atol=1e-5)
+
+
+def test_tolerance_drops_the_branches_of_nearby_coefficients():
+    pipe = tiny_dpm_pipeline(width=32)
+    call(pipe, [1.5, 1.05, 7.4, 1.0], dynamic_cfg_tolerance=0.1)
+    assert pipe.cfg_batch_schedule == [3, 2, 2, 2]
@@ -0,0 +1,118 @@
+import functools
+
+import pytest
+import torch
+from diffusers import DPMSolverMultistepScheduler
+
+from benchmarks.components import load_samples, tiny_dpm_pipeline, tiny_lcm_pipeline
+from pipeline import deccoruptor_dpm_pipe, deccoruptor_lcm_pipe
+from pipeline.early_exit import EarlyExitTracker
+
+NUM_STEPS = 4
+
+
+def test_tracker_retires_converged_samples():
+    tracker = EarlyExitTracker(threshold=0.5, num_samples=3, num_steps=NUM_STEPS)
+    x0 = torch.zeros(3, 2)
+    assert tracker.step(0, x0) is None
+
+    # sample 1 converges after 2 steps
+    keep = tracker.step(1, x0 + torch.tensor([[1.0], [0.25], [1.0]]))
+    assert keep.tolist() == [True, False, True]
+    assert tracker.active.tolist() == [0, 2]
+
+    # the mask of the next step is over the remaining samples 0 and 2; sample 2 converges after 3 steps
+    keep = tracker.step(2, torch.tensor([[3.0, 3.0], [1.0, 1.0]]))
+    assert keep.tolist() == [True, False]
+    # the last step never retires a sample
+    assert tracker.step(3, torch.tensor([[5.0, 5.0]])) is None
+    assert tracker.steps_used == [NUM_STEPS, 2, 3]
+
+    final = tracker.gather(torch.full((1, 2), 7.0))
+    assert final.tolist() == [[7.0, 7.0], [0.25, 0.25], [1.0, 1.0]]
+
+
+def test_tracker_waits_for_min_steps():
+    tracker = EarlyExitTracker(threshold=1.0, num_samples=1, num_steps=NUM_STEPS, min_steps=3)
+    assert tracker.step(0, torch.zeros(1, 2)) is None
+    assert tracker.step(1, torch.zeros(1, 2)) is None
+    assert tracker.step(2, torch.zeros(1, 2)).tolist() == [False]
+    assert tracker.finished and tracker.steps_used == [3]
+
+
+class ScriptedTracker(EarlyExitTracker):
+    r"""Makes sample 1 look converged after 2 steps and every other sample look far from it."""
+
+    def step(self, step, pred_original_sample):
+        if self._prev is not None:
+            retire = (self.active == 1) & torch.tensor(step == 1)
+            mask = retire.view(-1, *[1] * (pred_original_sample.ndim - 1)).to(pred_original_sample.device)
+            self._prev = torch.where(mask, pred_original_sample, pred_original_sample + 1e3)
+        return super().step(step, pred_original_sample)
+
+
+def record_steps(pipe, monkeypatch):
+    r"""Records the predicted clean latents of every scheduler step."""
+    pred_original_samples = []
+    step = pipe.scheduler.step
+
+    # keeps the signature the pipeline inspects for `eta` and `generator`
+    @functools.wraps(step)
+    def recording_step(*args, return_dict=True, **kwargs):
+        output = step(*args, return_dict=True, **kwargs)
+        pred_original_samples.append(output[1])
+        return output if return_dict else output.to_tuple()
+
+    monkeypatch.setattr(pipe.scheduler, "step", recording_step)
+    return pred_original_samples
+
+
+def call(pipe, seed=0, **kwargs):
+    images = load_samples(64)[1][:3]
+    generator = [torch.Generator().manual_seed(seed + i) for i in range(len(images))]
+    return pipe(
+        prompt="Clean the image",
+        image=images,
+        num_inference_steps=NUM_STEPS,
+        generator=generator,
+        output_type="latent",
+        **kwargs,
+    )
+
+
+def test_dpm_early_exit_keeps_the_samples_and_their_generators(monkeypatch):
+    pipe = tiny_dpm_pipeline(width=32)
+    kwargs = dict(image_guidance_scale=[1.5] * NUM_STEPS, eta=1.0)
+    pred_original_samples = record_steps(pipe, monkeypatch)
+    full = call(pipe, **kwargs).images
+
+    monkeypatch.setattr(deccoruptor_dpm_pipe, "EarlyExitTracker", ScriptedTracker)
+    output = call(pipe, early_exit_threshold=1.0, **kwargs)
+    assert output.num_inference_steps_used == [NUM_STEPS, 2, NUM_STEPS]
+    # sample 1 keeps its prediction after 2 steps; the others run on with their own generators, which the DDIM
+    # noise of every step is drawn from
+    torch.testing.assert_close(output.images[1], pred_original_samples[1][1])
+    torch.testing.assert_close(output.images[[0, 2]], full[[0, 2]])
+
+
+def test_dpm_early_exit_needs_a_single_step_scheduler():
+    pipe = tiny_dpm_pipeline(width=32)
+    pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    with pytest.raises(ValueError, match="single-step scheduler"):
+        call(pipe, image_guidance_scale=[1.5] * NUM_STEPS, early_exit_threshold=1.0)
+
+
+def test_lcm_early_exit_keeps_the_samples_in_order(monkeypatch):
+    pipe = tiny_lcm_pipeline(width=32)
+    pred_original_samples = record_steps(pipe, monkeypatch)
+    torch.manual_seed(0)
+    call(pipe)
+
+    monkeypatch.setattr(deccoruptor_lcm_pipe, "EarlyExitTracker", ScriptedTracker)
+    torch.manual_seed(0)
+    output = call(pipe, early_exit_threshold=1.0)
+    assert output.num_inference_steps_used == [NUM_STEPS, 2, NUM_STEPS]
+    # the CM loop draws the noise of later steps from the global generator for the smaller batch, so only the
+    # retired sample has a reference
+    torch.testing.assert_close(output.images[1], pred_original_samples[1][1])
+    assert output.images.shape[0] == 3
@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.import_time import DEFAULT_BUDGET_S, DEFAULT_FORBIDDEN, DEFAULT_TARGETS, measure
+
+
+@pytest.mark.parametrize("statement", DEFAULT_TARGETS)
+def test_pipeline_imports_stay_light(statement):
+    seconds, loaded = measure(statement, DEFAULT_FORBIDDEN, repeats=1)
+    assert loaded == []
+    assert seconds <= DEFAULT_BUDGET_S
@@ -0,0 +1,55 @@
+import torch
+
+from benchmarks.components import tiny_dpm_pipeline
+from pipeline.inversion import InversionNoiseStore, backward_ddim
+
+NUM_STEPS = 5
+
+
+@torch.no_grad()
+def invert_one_by_one(pipe, latents, num_inference_steps, reverse_process=True):
+    r"""The former per-latent `get_latents` loop, which looked up the alphas in the scheduler at every step."""
+    outputs = []
+    text_embeddings = pipe.get_text_embedding("")
+    for latent in latents.split(1):
+        pipe.scheduler.set_timesteps(num_inference_steps)
+        latent = latent * pipe.scheduler.init_noise_sigma
+        for t in reversed(pipe.scheduler.timesteps):
+            latent = pipe.scheduler.scale_model_input(latent, t)
+            noise_pred = pipe.unet(torch.cat([latent, latent], dim=1), t, encoder_hidden_states=text_embeddings).sample
+            prev_timestep = t - pipe.scheduler.config.num_train_timesteps // pipe.scheduler.num_inference_steps
+            alphas_cumprod = pipe.scheduler.alphas_cumprod
+            alpha_prod_t = alphas_cumprod[t]
+            alpha_prod_t_prev = (
+                alphas_cumprod[prev_timestep] if prev_timestep >= 0 else pipe.scheduler.final_alpha_cumprod
+            )
+            if reverse_process:
+                alpha_prod_t, alpha_prod_t_prev = alpha_prod_t_prev, alpha_prod_t
+            latent = backward_ddim(x_t=latent, alpha_t=alpha_prod_t, alpha_tm1=alpha_prod_t_prev, eps_xt=noise_pred)
+        outputs.append(latent)
+    return torch.cat(outputs)
+
+
+def test_batched_inversion_matches_the_per_latent_loop(tmp_path):
+    pipe = tiny_dpm_pipeline(width=32)
+    latents = torch.randn(3, 4, 8, 8, generator=torch.Generator().manual_seed(0))
+    expected = invert_one_by_one(pipe, latents, NUM_STEPS)
+
+    store = InversionNoiseStore(str(tmp_path))
+    inverted = pipe.invert_latents(latents, NUM_STEPS, batch_size=2, noise_store=store)
+    torch.testing.assert_close(inverted, expected, atol=1e-5, rtol=1e-5)
+    assert (store.hits, store.misses) == (0, 3)
+
+    # a new process loads the inverted noise instead of running the UNet
+    unet_calls = []
+    pipe.unet.register_forward_hook(lambda module, args, output: unet_calls.append(args[0].shape[0]))
+    store = InversionNoiseStore(str(tmp_path))
+    torch.testing.assert_close(pipe.invert_latents(latents, NUM_STEPS, noise_store=store), inverted)
+    assert (store.hits, store.misses) == (3, 0)
+    assert unet_calls == []
+
+    # only the new latent runs
+    more = torch.cat([latents[:1], torch.randn(1, 4, 8, 8)])
+    torch.testing.assert_close(pipe.invert_latents(more, NUM_STEPS, noise_store=store)[0], inverted[0])
+    assert (store.hits, store.misses) == (4, 1)
+    assert unet_calls == [1] * NUM_STEPS
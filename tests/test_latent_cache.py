@@ -0,0 +1,38 @@
+import torch
+
+from benchmarks.components import tiny_components
+from pipeline.latent_cache import VaeLatentCache, forget_fingerprint, module_content_hash, module_fingerprint
+
+
+def fine_tune_between_samples(vae):
+    # changes a weight that the sparse fingerprint does not sample
+    weight = vae.encoder.conv_in.weight
+    assert weight.numel() > 64
+    with torch.no_grad():
+        weight.view(-1)[1] += 1.0
+    forget_fingerprint(vae)
+
+
+@torch.no_grad()
+def test_disk_tier_is_keyed_on_all_vae_weights(tmp_path):
+    image = torch.rand(2, 3, 64, 64) * 2 - 1
+    vae = tiny_components()["vae"]
+    fingerprint, content_hash = module_fingerprint(vae), module_content_hash(vae)
+    expected = vae.encode(image).latent_dist.parameters
+    VaeLatentCache(cache_dir=str(tmp_path)).encode(vae, image)
+
+    # a new process finds the entries of the same weights on disk
+    cache = VaeLatentCache(cache_dir=str(tmp_path))
+    torch.testing.assert_close(cache.encode(vae, image).latent_dist.parameters, expected)
+    assert (cache.disk_hits, cache.misses) == (2, 0)
+
+    fine_tune_between_samples(vae)
+    assert module_fingerprint(vae) == fingerprint
+    assert module_content_hash(vae) != content_hash
+
+    # ... but never those of other weights, even when the sparse fingerprint collides
+    cache = VaeLatentCache(cache_dir=str(tmp_path))
+    parameters = cache.encode(vae, image).latent_dist.parameters
+    assert (cache.disk_hits, cache.misses) == (0, 2)
+    torch.testing.assert_close(parameters, vae.encode(image).latent_dist.parameters)
+    assert not torch.allclose(parameters, expected)
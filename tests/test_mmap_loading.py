@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+
+
+def call(pipe, images):
+    return pipe(
+        prompt="Clean the image",
+        image=images,
+        num_inference_steps=1,
+        generator=torch.Generator().manual_seed(0),
+        output_type="np",
+    ).images
+
+
+def test_mmap_round_trip_maps_every_weight(tmp_path):
+    pipe = tiny_lcm_pipeline(width=32)
+    images = load_samples(64)[1][:2]
+    expected = call(pipe, images)
+    pipe.save_mmap_pretrained(str(tmp_path), dtype=torch.float32)
+
+    loaded = type(pipe).from_mmap_pretrained(str(tmp_path))
+    loaded.set_progress_bar_config(disable=True)
+    report = loaded.load_report
+    # weights stored in the dtype they are used in are used in place
+    assert report.copied_bytes == 0
+    assert report.mapped_bytes == sum(
+        tensor.numel() * tensor.element_size()
+        for component in (pipe.unet, pipe.vae, pipe.text_encoder)
+        for tensor in component.state_dict().values()
+    )
+    for name in ("unet", "vae", "text_encoder"):
+        for key, tensor in getattr(pipe, name).state_dict().items():
+            torch.testing.assert_close(getattr(loaded, name).state_dict()[key], tensor, rtol=0, atol=0)
+    np.testing.assert_array_equal(call(loaded, images), expected)
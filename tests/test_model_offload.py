@@ -0,0 +1,40 @@
+import numpy as np
+import torch
+
+from benchmarks.components import load_samples, tiny_dpm_pipeline
+
+NUM_STEPS = 3
+
+
+def call(pipe, images):
+    return pipe(
+        prompt="Clean the image",
+        image=images,
+        num_inference_steps=NUM_STEPS,
+        image_guidance_scale=[1.5] * NUM_STEPS,
+        generator=torch.Generator().manual_seed(0),
+        output_type="np",
+    ).images
+
+
+def test_offload_matches_the_resident_pipeline():
+    pipe = tiny_dpm_pipeline(width=32)
+    # every call encodes the prompt, so the text encoder stage runs too
+    pipe.disable_prompt_cache()
+    images = load_samples(64)[1][:2]
+    expected = call(pipe, images)
+
+    # room for the UNet and one more stage next to it
+    pipe.enable_model_offload(device="cpu", memory_budget=3_300_000)
+    assert pipe.model_offload_enabled
+    np.testing.assert_array_equal(call(pipe, images), expected)
+    report = pipe.offload_report
+    assert [residency.stage for residency in report] == ["text_encoder", "vae_encoder", "unet", "vae_decoder"]
+    for residency in report:
+        assert residency.stage in residency.resident
+        assert residency.resident_bytes <= 3_300_000
+
+    pipe.disable_model_offload()
+    assert not pipe.model_offload_enabled and pipe.offload_report == []
+    assert not any(hasattr(module, "_hf_hook") for module in pipe.unet.modules())
+    np.testing.assert_array_equal(call(pipe, images), expected)
@@ -0,0 +1,65 @@
+import pytest
+import torch
+from diffusers.loaders import LoraLoaderMixin
+
+from benchmarks.components import tiny_lcm_pipeline
+
+PROMPT = "a <x> b"
+
+
+def encode(pipe):
+    return pipe._encode_prompt(PROMPT, torch.device("cpu"), 1, True)
+
+
+def encode_uncached(pipe):
+    cache = pipe.prompt_cache
+    pipe.disable_prompt_cache()
+    try:
+        return encode(pipe)
+    finally:
+        pipe._prompt_cache = cache
+
+
+@pytest.fixture
+def pipe():
+    pipe = tiny_lcm_pipeline(width=32)
+    # the second call is served from the cache
+    encode(pipe)
+    encode(pipe)
+    assert pipe.prompt_cache_info()[:2] == (1, 1)
+    return pipe
+
+
+def assert_recomputed(pipe, stale):
+    assert pipe.prompt_cache_info().current_size == 0
+    misses = pipe.prompt_cache.misses
+    embeds = encode(pipe)
+    assert pipe.prompt_cache.misses == misses + 1
+    torch.testing.assert_close(embeds, encode_uncached(pipe))
+    assert not torch.allclose(embeds, stale)
+
+
+@torch.no_grad()
+def test_textual_inversion_load_clears_the_cache(pipe):
+    stale = encode(pipe)
+    pipe.load_textual_inversion({"<x>": torch.randn(pipe.text_encoder.config.hidden_size)})
+    assert_recomputed(pipe, stale)
+
+
+@torch.no_grad()
+def test_lora_load_clears_the_cache(pipe, monkeypatch):
+    def load_lora_weights(self, *args, **kwargs):
+        # stands in for a text-encoder LoRA, which needs peft
+        self.text_encoder.text_model.final_layer_norm.bias += 1.0
+
+    monkeypatch.setattr(LoraLoaderMixin, "load_lora_weights", load_lora_weights)
+    stale = encode(pipe)
+    pipe.load_lora_weights("lora.safetensors")
+    assert_recomputed(pipe, stale)
+
+
+@torch.no_grad()
+def test_text_encoder_quantization_clears_the_cache(pipe):
+    stale = encode(pipe)
+    pipe.enable_int8_quantization(quantize_text_encoder=True)
+    assert_recomputed(pipe, stale)
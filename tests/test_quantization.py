@@ -0,0 +1,22 @@
+import torch
+
+from benchmarks.components import tiny_components
+from pipeline.quantization import QuantizedWeightCache, quantize_linear_int8
+
+
+def test_cache_is_keyed_on_all_weights(tmp_path):
+    cache = QuantizedWeightCache(str(tmp_path))
+    unet = tiny_components()["unet"]
+    path = cache.path(unet)
+    names = quantize_linear_int8(unet)
+    cache.save(path, unet, names)
+
+    # a new process loads the quantized layers of the same checkpoint
+    assert cache.load(tiny_components()["unet"]) == names
+
+    # ... but not those of a fine-tune that only differs between the samples of the sparse fingerprint
+    fine_tuned = tiny_components()["unet"]
+    with torch.no_grad():
+        fine_tuned.conv_in.weight.view(-1)[1] += 1.0
+    assert cache.path(fine_tuned) != path
+    assert cache.load(fine_tuned) is None
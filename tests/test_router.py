@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+from serving.router import CostModel, LatencyRouter
+from serving.server import EditRequest
+
+
+@pytest.fixture
+def cost_model():
+    # dpm: 1.1 s at 20 steps, 0.6 s at 10; cm: 0.13 s at 4 steps, 0.09 s at 2, 0.07 s at 1
+    cost_model = CostModel()
+    cost_model.set("dpm", overhead_s=0.1, step_s=0.05)
+    cost_model.set("cm", overhead_s=0.05, step_s=0.02)
+    return cost_model
+
+
+def make_router(cost_model, dpm=None, cm=None):
+    def echo(requests):
+        return [request.num_inference_steps for request in requests]
+
+    return LatencyRouter({"dpm": dpm or echo, "cm": cm or echo}, cost_model=cost_model, max_wait_ms=0)
+
+
+@pytest.mark.parametrize(
+    "backlog_s, option",
+    [(0.0, ("dpm", 20)), (0.5, ("dpm", 10)), (1.0, ("cm", 4)), (1.1, ("cm", 2)), (1.12, ("cm", 1))],
+)
+def test_backlog_moves_requests_down_the_ladder(cost_model, backlog_s, option):
+    router = make_router(cost_model)
+    router.backlog_s = backlog_s
+    decision = router.route(deadline_s=1.2)
+    assert (decision.pipeline, decision.num_inference_steps) == option
+    assert decision.downgraded == (option != ("dpm", 20))
+    assert decision.meets_deadline
+    assert decision.predicted_latency_s == pytest.approx(backlog_s + cost_model.predict(*option))
+
+
+def test_missed_deadline_takes_the_cheapest_option(cost_model):
+    router = make_router(cost_model)
+    router.backlog_s = 1.5
+    decision = router.route(deadline_s=1.2)
+    assert (decision.pipeline, decision.num_inference_steps) == ("cm", 1)
+    assert decision.downgraded and not decision.meets_deadline
+
+
+def test_tiers_start_from_their_option(cost_model):
+    router = make_router(cost_model)
+    router.backlog_s = 10.0
+    # without a deadline a request runs with its tier's option, whatever the backlog
+    for tier, option in [("high", ("dpm", 20)), ("balanced", ("dpm", 10)), ("fast", ("cm", 4))]:
+        decision = router.route(tier=tier)
+        assert (decision.pipeline, decision.num_inference_steps) == option
+        assert not decision.downgraded
+
+    # a deadline only moves a tier down from its own option
+    router.backlog_s = 0.0
+    decision = router.route(deadline_s=0.1, tier="fast")
+    assert (decision.pipeline, decision.num_inference_steps) == ("cm", 2)
+    with pytest.raises(ValueError, match="tier"):
+        router.route(tier="best")
+
+
+def test_observed_batches_update_the_step_cost(cost_model):
+    # 2 images of 10 steps in 2.2 s: 1.1 s per image, i.e. 0.1 s per step after the overhead
+    cost_model.observe("dpm", num_inference_steps=10, batch_size=2, seconds=2.2)
+    assert cost_model.step_s["dpm"] == pytest.approx(0.05 + 0.2 * (0.1 - 0.05))
+    assert cost_model.overhead_s["dpm"] == 0.1
+    cost_model.observe("sd", num_inference_steps=10, batch_size=1, seconds=1.0)
+    assert "sd" not in cost_model.step_s
+
+
+def test_backlog_is_released_when_a_request_fails_or_times_out(cost_model):
+    release = threading.Event()
+
+    def failing(requests):
+        raise RuntimeError("out of memory")
+
+    def blocking(requests):
+        release.wait(5)
+        return [None] * len(requests)
+
+    async def scenario():
+        router = make_router(cost_model, dpm=failing, cm=blocking)
+        await router.start()
+        request = EditRequest(image=None)
+        try:
+            # the request is routed to the fast tier's option and times out while its batch is stuck
+            submitted = asyncio.ensure_future(router.submit(request, tier="fast", timeout=0.2))
+            await asyncio.sleep(0.05)
+            assert router.backlog_s == pytest.approx(cost_model.predict("cm", 4))
+            with pytest.raises(asyncio.TimeoutError):
+                await submitted
+            assert router.backlog_s == 0.0
+
+            with pytest.raises(RuntimeError, match="out of memory"):
+                await router.submit(request)
+            assert router.backlog_s == 0.0
+        finally:
+            release.set()
+            await router.stop()
+
+    asyncio.run(scenario())
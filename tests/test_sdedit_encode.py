@@ -0,0 +1,70 @@
+import pytest
+import torch
+from diffusers.utils.torch_utils import randn_tensor
+
+from benchmarks.components import load_samples, tiny_dpm_pipeline, tiny_lcm_pipeline
+
+NUM_IMAGES_PER_PROMPT = 2
+NUM_STEPS = 4
+
+
+def generators(num_images, seed=0):
+    return [torch.Generator().manual_seed(seed + i) for i in range(num_images * NUM_IMAGES_PER_PROMPT)]
+
+
+def record(pipe, monkeypatch, name):
+    r"""Records the arguments and the result of every call of the pipeline method `name`."""
+    calls = []
+    method = getattr(pipe, name)
+
+    def recording_method(*args, **kwargs):
+        result = method(*args, **kwargs)
+        calls.append((args, kwargs, result))
+        return result
+
+    monkeypatch.setattr(pipe, name, recording_method)
+    return calls
+
+
+@pytest.mark.parametrize("make_pipe", [tiny_lcm_pipeline, tiny_dpm_pipeline])
+@torch.no_grad()
+def test_sdedit_encodes_the_batch_once(make_pipe, monkeypatch):
+    pipe = make_pipe(width=32)
+    images = load_samples(64)[1][:3]
+    encoder_calls = []
+    pipe.vae.encoder.register_forward_hook(lambda module, args, output: encoder_calls.append(args[0].shape[0]))
+    image_latents_calls = record(pipe, monkeypatch, "prepare_image_latents")
+    sdedit_latents_calls = record(pipe, monkeypatch, "prepare_sdedit_latents")
+
+    kwargs = {"image_guidance_scale": [1.5] * NUM_STEPS} if make_pipe is tiny_dpm_pipeline else {}
+    pipe(
+        prompt="Clean the image",
+        image=images,
+        num_inference_steps=NUM_STEPS,
+        num_images_per_prompt=NUM_IMAGES_PER_PROMPT,
+        generator=generators(len(images)),
+        sdedit=True,
+        strength=0.5,
+        output_type="latent",
+        **kwargs,
+    )
+    assert encoder_calls == [len(images)]
+
+    # the image latents are the mode of the shared encoder output, as if encoded on their own
+    image, *args = image_latents_calls[0][0]
+    expected = pipe.prepare_image_latents(image, *args)
+    torch.testing.assert_close(image_latents_calls[0][2], expected)
+
+    # the SDEdit latents of every image come from the first of its generators, which encodes it on its own first
+    image, timestep, *_ = sdedit_latents_calls[0][0]
+    reference_generators = generators(len(images))
+    init_latents = torch.cat(
+        [
+            pipe.vae.encode(image[i : i + 1]).latent_dist.sample(reference_generators[i * NUM_IMAGES_PER_PROMPT])
+            for i in range(len(images))
+        ]
+    )
+    init_latents = pipe.vae.config.scaling_factor * init_latents.repeat_interleave(NUM_IMAGES_PER_PROMPT, dim=0)
+    noise = randn_tensor(init_latents.shape, generator=reference_generators)
+    expected = pipe.scheduler.add_noise(init_latents, noise, timestep)
+    torch.testing.assert_close(sdedit_latents_calls[0][2], expected)
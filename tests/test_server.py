@@ -0,0 +1,50 @@
+import asyncio
+import re
+
+from serving.batcher import DynamicBatcher
+from serving.metrics import MetricsRegistry
+from serving.server import DecorruptorServer
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="([^"\\\n]|\\.)*",?)*\})? \S+$')
+
+
+async def get(socket, target):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    writer.write(f"GET {target} HTTP/1.1\r\n\r\n".encode("latin-1"))
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), body.decode()
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry(namespace="")
+    registry.counter("requests_total", "Requests.").inc(path='/a"b\\c\nd')
+    assert 'requests_total{path="/a\\"b\\\\c\\nd"} 1' in registry.render().splitlines()
+
+
+def test_http_requests_are_counted_by_route(tmp_path):
+    socket = str(tmp_path / "server.sock")
+
+    async def scenario():
+        server = DecorruptorServer(DynamicBatcher(lambda items: items))
+        await server.start(unix_socket=socket)
+        try:
+            assert (await get(socket, "/healthz"))[0] == 200
+            for index in range(3):
+                assert (await get(socket, f'/a"b{index}\\'))[0] == 404
+            assert (await get(socket, '/v1/edit?x="'))[0] == 405
+            return await get(socket, "/metrics")
+        finally:
+            await server.close()
+
+    status, metrics = asyncio.run(scenario())
+    assert status == 200
+    samples = [line for line in metrics.splitlines() if not line.startswith("#")]
+    assert all(SAMPLE.match(line) for line in samples)
+    requests = [line for line in samples if line.startswith("decorruptor_http_requests_total")]
+    assert sorted(requests) == [
+        'decorruptor_http_requests_total{code="200",path="/healthz"} 1',
+        'decorruptor_http_requests_total{code="404",path="other"} 3',
+        'decorruptor_http_requests_total{code="405",path="/v1/edit"} 1',
+    ]
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from pipeline import tiled_vae
+from pipeline.tiled_vae import DiagonalGaussianDistribution, tiled_decode, tiled_encode
+
+
+class LocalVae(torch.nn.Module):
+    r"""An 8x down-sampling "VAE" without spatial context, on which tiling has to be exact."""
+
+    config = SimpleNamespace(block_out_channels=[8, 8, 16, 16])
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.to_latent = torch.nn.Conv2d(3, 8, 1)
+        self.to_pixels = torch.nn.Conv2d(4, 3, 1)
+
+    def encode(self, image):
+        parameters = self.to_latent(F.avg_pool2d(image, 8))
+        return SimpleNamespace(latent_dist=DiagonalGaussianDistribution(parameters))
+
+    def decode(self, latents, return_dict=True):
+        return (self.to_pixels(F.interpolate(latents, scale_factor=8, mode="nearest")),)
+
+
+@pytest.fixture
+def blend_calls(monkeypatch):
+    calls = []
+    blend_tiles = tiled_vae._blend_tiles
+
+    def counting_blend_tiles(fn, *args, **kwargs):
+        def counting_fn(tile):
+            calls.append(tile.shape[-2:])
+            return fn(tile)
+
+        return blend_tiles(counting_fn, *args, **kwargs)
+
+    monkeypatch.setattr(tiled_vae, "_blend_tiles", counting_blend_tiles)
+    return calls
+
+
+@torch.no_grad()
+def test_tiles_are_blended_back_in_place(blend_calls):
+    vae = LocalVae()
+    image = torch.rand(2, 3, 136, 200) * 2 - 1
+
+    expected = vae.encode(image).latent_dist
+    tiled = tiled_encode(vae, image, tile_size=64, overlap=16).latent_dist
+    assert len(blend_calls) > 1
+    torch.testing.assert_close(tiled.mean, expected.mean)
+    torch.testing.assert_close(tiled.logvar, expected.logvar)
+
+    latents = expected.mode()
+    torch.testing.assert_close(tiled_decode(vae, latents, tile_size=64, overlap=16), vae.decode(latents)[0])
+
+
+@torch.no_grad()
+def test_tiled_vae_stays_close_to_the_untiled_vae(blend_calls):
+    pipe = tiny_lcm_pipeline(width=32)
+    image = pipe.image_processor.preprocess(load_samples(256)[1][:2])
+    expected = pipe.vae.encode(image).latent_dist.mode()
+    decoded = pipe.vae.decode(expected, return_dict=False)[0]
+
+    def errors(overlap):
+        pipe.enable_tiled_vae(tile_size=128, overlap=overlap)
+        latents = pipe._vae_encode_pixels(image).latent_dist.mode()
+        pixels = pipe._vae_decode_latents(expected)
+        return (latents - expected).abs().mean(), (pixels - decoded).abs().mean()
+
+    encode_error, decode_error = errors(64)
+    assert len(blend_calls) == 2 * 3 * 3
+    # the random tiny VAE normalises and attends over the tile only, so tiling is approximate; the bounds catch
+    # misplaced or misweighted tiles, whose error is of the order of the signal itself
+    assert encode_error < 0.3 * expected.abs().mean()
+    assert decode_error < 0.7 * decoded.abs().mean()
+
+    # blending the overlap is closer to the untiled VAE than butting the tiles against each other
+    seam_encode_error, seam_decode_error = errors(0)
+    assert encode_error < seam_encode_error
+    assert decode_error < seam_decode_error
@@ -0,0 +1,33 @@
+import os
+import signal
+
+import pytest
+
+from benchmarks.components import load_samples, tiny_lcm_pipeline
+from serving.worker_pool import CPUWorkerPool
+
+
+@pytest.fixture(scope="module")
+def images():
+    return load_samples(64)[1][:2]
+
+
+def test_pool_from_a_pipeline_that_already_ran(images):
+    pipe = tiny_lcm_pipeline(width=32)
+    pipe.set_progress_bar_config(disable=True)
+    pipe(prompt="Clean the image", image=images[:1], num_inference_steps=1)
+    assert pipe.prompt_cache_info().current_size == 1
+
+    with CPUWorkerPool(pipe, num_workers=1, threads_per_worker=1) as pool:
+        outputs = pool.map(images, num_inference_steps=1, output_type="np")
+    assert len(outputs) == len(images)
+    # pickling for the workers leaves the parent's cache intact
+    assert pipe.prompt_cache_info().current_size == 1
+
+
+def test_map_raises_when_a_worker_dies(images):
+    pipe = tiny_lcm_pipeline(width=32)
+    with CPUWorkerPool(pipe, num_workers=1, threads_per_worker=1, poll_interval_s=0.1) as pool:
+        os.kill(pool.worker_pids[0], signal.SIGKILL)
+        with pytest.raises(RuntimeError, match="died"):
+            pool.map(images, num_inference_steps=1)
@@ -1,20 +1,13 @@
 from enum import Enum
 import gc
+import importlib
 import numpy as np
-import tomesd
 import torch
 import sys
 sys.path.append('../')
-from pipeline.deccoruptor_lcm_pipe import IP2PLatentConsistencyModelPipeline
-from pipeline.deccoruptor_dpm_pipe import ConsistInstructPix2PixPipeline
-from diffusers import StableDiffusionInstructPix2PixPipeline, StableDiffusionControlNetPipeline, ControlNetModel, UNet2DConditionModel
-from diffusers.schedulers import EulerAncestralDiscreteScheduler, DDIMScheduler
-from text2video.text_to_video_pipeline import TextToVideoPipeline
-from diffusers import ConsistencyDecoderVAE, LCMScheduler
-from diffusers import DDIMScheduler
 
 import utils
-import text2video.gradio_utils
+from text2video import gradio_utils
 import os
 on_huggingspace = os.environ.get("SPACE_AUTHOR_NAME") == "PAIR"
 
@@ -35,14 +28,15 @@ class Model:
         self.device = device
         self.dtype = dtype
         self.generator = torch.Generator(device=device)
+        # (module, class) pairs, imported on first use so that only the selected pipeline is loaded
         self.pipe_dict = {
-            ModelType.Pix2Pix_Video: ConsistInstructPix2PixPipeline,
-            ModelType.Text2Video: TextToVideoPipeline,
-            ModelType.ControlNetCanny: StableDiffusionControlNetPipeline,
-            ModelType.ControlNetCannyDB: StableDiffusionControlNetPipeline,
-            ModelType.ControlNetPose: StableDiffusionControlNetPipeline,
-            ModelType.ControlNetDepth: StableDiffusionControlNetPipeline,
-            ModelType.Pix2Pix_LCM_Video: IP2PLatentConsistencyModelPipeline,
+            ModelType.Pix2Pix_Video: ("pipeline.deccoruptor_dpm_pipe", "ConsistInstructPix2PixPipeline"),
+            ModelType.Text2Video: ("text2video.text_to_video_pipeline", "TextToVideoPipeline"),
+            ModelType.ControlNetCanny: ("diffusers", "StableDiffusionControlNetPipeline"),
+            ModelType.ControlNetCannyDB: ("diffusers", "StableDiffusionControlNetPipeline"),
+            ModelType.ControlNetPose: ("diffusers", "StableDiffusionControlNetPipeline"),
+            ModelType.ControlNetDepth: ("diffusers", "StableDiffusionControlNetPipeline"),
+            ModelType.Pix2Pix_LCM_Video: ("pipeline.deccoruptor_lcm_pipe", "IP2PLatentConsistencyModelPipeline"),
         }
         self.controlnet_attn_proc = utils.CrossFrameAttnProcessor(
             unet_chunk_size=2)
@@ -66,11 +60,15 @@ class Model:
         torch.cuda.empty_cache()
         gc.collect()
         safety_checker = kwargs.pop('safety_checker', None)
-        self.pipe = self.pipe_dict[model_type].from_pretrained(
+        self.pipe = self.pipeline_class(model_type).from_pretrained(
             model_id, safety_checker=safety_checker, **kwargs).to(self.device).to(self.dtype)
         self.model_type = model_type
         self.model_name = model_id
 
+    def pipeline_class(self, model_type: ModelType):
+        module, name = self.pipe_dict[model_type]
+        return getattr(importlib.import_module(module), name)
+
     def inference_chunk(self, frame_ids, **kwargs):
         if not hasattr(self, "pipe") or self.pipe is None:
             return
@@ -101,6 +99,8 @@ class Model:
             merging_ratio = kwargs.pop("merging_ratio")
 
             # if merging_ratio > 0:
+            import tomesd
+
             tomesd.apply_patch(self.pipe, ratio=merging_ratio)
         seed = kwargs.pop('seed', 0)
         if seed < 0:
@@ -159,6 +159,7 @@ class Model:
                                  resolution=512,
                                  use_cf_attn=True,
                                  save_path=None):
+        from diffusers import ControlNetModel, DDIMScheduler
         print("Module Canny")
         video_path = gradio_utils.edge_path_to_video_path(video_path)
         if self.model_type != ModelType.ControlNetCanny:
@@ -222,6 +223,7 @@ class Model:
                                  resolution=512,
                                  use_cf_attn=True,
                                  save_path=None):
+        from diffusers import ControlNetModel, DDIMScheduler
         print("Module Depth")
         video_path = gradio_utils.edge_path_to_video_path(video_path)
         if self.model_type != ModelType.ControlNetDepth:
@@ -285,6 +287,7 @@ class Model:
                                 resolution=512,
                                 use_cf_attn=True,
                                 save_path=None):
+        from diffusers import ControlNetModel, DDIMScheduler
         print("Module Pose")
         video_path = gradio_utils.motion_to_video_path(video_path)
         if self.model_type != ModelType.ControlNetPose:
@@ -350,6 +353,7 @@ class Model:
                                     resolution=512,
                                     use_cf_attn=True,
                                     save_path=None):
+        from diffusers import ControlNetModel, DDIMScheduler
         print("Module Canny_DB")
         db_path = gradio_utils.get_model_from_db_selection(db_path)
         video_path = gradio_utils.get_video_from_canny_selection(video_path)
@@ -417,10 +421,11 @@ class Model:
                         use_cf_attn=True,
                         save_path=None,
                         model_id="timbrooks/instruct-pix2pix"):
+        from diffusers import DDIMScheduler, LCMScheduler
         
         if model == 'DPM':
             print("Module Pix2Pix")
-            self.pipe = ConsistInstructPix2PixPipeline.from_pretrained(model_id, 
+            self.pipe = self.pipeline_class(ModelType.Pix2Pix_Video).from_pretrained(model_id, 
                                                                     torch_dtype=torch.float16, 
                                                                     safety_checker=None,
                                                                     use_safetensors=True)
@@ -441,7 +446,7 @@ class Model:
             # vae = ConsistencyDecoderVAE.from_pretrained("openai/consistency-decoder", torch_dtype=torch.float16)
                                                                     # vae=vae,
             scheduler = LCMScheduler.from_pretrained(model_id, subfolder="scheduler")
-            self.pipe = IP2PLatentConsistencyModelPipeline.from_pretrained(model_id, 
+            self.pipe = self.pipeline_class(ModelType.Pix2Pix_LCM_Video).from_pretrained(model_id, 
                                                                     torch_dtype=torch.float16,
                                                                     scheduler=scheduler, 
                                                                     safety_checker=None,
@@ -491,6 +496,7 @@ class Model:
                            smooth_bg=False,
                            smooth_bg_strength=0.4,
                            path=None):
+        from diffusers import DDIMScheduler, UNet2DConditionModel
         print("Module Text2Video")
         if self.model_type != ModelType.Text2Video or model_name != self.model_name:
             print("Model update")
@@ -0,0 +1,152 @@
+"""
+Trains the corruption-presence gate of `pipeline/corruption_gate.py`.
+
+    cd training_code
+    python train_corruption_gate.py --clean-dir path/to/your_imagenet/train --output ../corruption_gate.pt \
+        --mixing-dirs ../../data/Pixmix_dataset/fractals/images ../../data/Pixmix_dataset/first_layers_resized256_onevis/images
+
+Positives are made from the clean images with the same corruption generator the decorruptor is trained with
+(`input_transform.pixmix` for three quarters of the samples, `input_transform.Simsiam_transform` for the rest, as in
+`edit_dataset.EditDataset_IN`); negatives are the clean images themselves. Both go through the same JPEG round trip, so
+the gate cannot tell them apart by compression artefacts alone. The gate is fitted on the image statistics, its
+threshold calibrated on a held-out split to `--target-recall`, and the JSON report lists the skip rates at several
+operating points.
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import sys
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pixmix_utils  # noqa: E402
+from input_transform import Simsiam_transform, pixmix  # noqa: E402
+from pipeline.corruption_gate import CorruptionGate, gate_metrics, image_statistics  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIXING_DIRS = [
+    os.path.join(REPO_ROOT, "__assets__", "pixmix_samples", "fractals"),
+    os.path.join(REPO_ROOT, "__assets__", "pixmix_samples", "feature_vis"),
+]
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+
+
+def list_images(directory):
+    paths = glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+    return sorted(path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def jpeg_round_trip(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return Image.open(buffer).convert("RGB")
+
+
+def corrupt(image, mixing_sets, transform):
+    if np.random.random() < 0.75:
+        mixing = [transform(Image.open(random.choice(random.choice(mixing_sets))).convert("RGB")) for _ in range(2)]
+        corrupted = pixmix(image, mixing[0], mixing[1], {"tensorize": transforms.ToTensor()})
+    else:
+        corrupted = Simsiam_transform(image)
+    return transforms.functional.to_pil_image(corrupted)
+
+
+def build_dataset(clean_paths, mixing_sets, resolution, corruptions_per_image, jpeg_quality, batch_size=32):
+    r"""Returns the image statistics and labels (`1` corrupted, `0` clean) of the clean images and their corruptions."""
+    transform = transforms.Compose([transforms.Resize(resolution), transforms.CenterCrop(resolution)])
+    # the geometric PixMix operations produce images of this size
+    pixmix_utils.IMAGE_SIZE = resolution
+    features, labels, pending = [], [], []
+
+    def flush():
+        if pending:
+            batch = torch.stack([transforms.functional.to_tensor(image) for image, _ in pending])
+            features.append(image_statistics(batch))
+            labels.extend(label for _, label in pending)
+            pending.clear()
+
+    for path in clean_paths:
+        clean = transform(Image.open(path).convert("RGB"))
+        pending.append((jpeg_round_trip(clean, jpeg_quality), 0))
+        for _ in range(corruptions_per_image):
+            pending.append((jpeg_round_trip(corrupt(clean, mixing_sets, transform), jpeg_quality), 1))
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    return torch.cat(features), torch.tensor(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clean-dir", required=True, help="directory of clean images, searched recursively")
+    parser.add_argument("--mixing-dirs", nargs="+", default=DEFAULT_MIXING_DIRS, help="PixMix mixing image sets")
+    parser.add_argument("--output", default="corruption_gate.pt")
+    parser.add_argument("--max-images", type=int, default=5000)
+    parser.add_argument("--corruptions-per-image", type=int, default=1)
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--jpeg-quality", type=int, default=85)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--hidden-size", type=int, default=32)
+    parser.add_argument("--epochs", type=int, default=500)
+    parser.add_argument("--target-recall", type=float, default=0.95, help="share of corrupted images still edited")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    clean_paths = list_images(args.clean_dir)
+    random.shuffle(clean_paths)
+    clean_paths = clean_paths[: args.max_images]
+    mixing_sets = [list_images(directory) for directory in args.mixing_dirs]
+    mixing_sets = [paths for paths in mixing_sets if paths]
+    if len(clean_paths) < 2 or len(mixing_sets) == 0:
+        raise ValueError(f"Found {len(clean_paths)} clean images and no mixing images in {args.mixing_dirs}.")
+
+    # split by source image, so that no clean image has a corruption on the other side of the split
+    num_val = max(1, int(len(clean_paths) * args.val_fraction))
+    val_features, val_labels = build_dataset(
+        clean_paths[:num_val], mixing_sets, args.resolution, args.corruptions_per_image, args.jpeg_quality
+    )
+    train_features, train_labels = build_dataset(
+        clean_paths[num_val:], mixing_sets, args.resolution, args.corruptions_per_image, args.jpeg_quality
+    )
+
+    gate = CorruptionGate(hidden_size=args.hidden_size)
+    losses = gate.fit(train_features, train_labels, epochs=args.epochs)
+    with torch.no_grad():
+        val_scores = gate.score_features(val_features)
+        train_scores = gate.score_features(train_features)
+    operating_points = {
+        str(recall): gate_metrics(val_scores, val_labels, gate.calibrate(val_scores, val_labels, recall))
+        for recall in sorted({0.9, 0.95, 0.99, args.target_recall})
+    }
+    threshold = gate.calibrate(val_scores, val_labels, args.target_recall)
+    gate.save(args.output)
+
+    report = {
+        "output": args.output,
+        "train_images": len(train_labels),
+        "val_images": len(val_labels),
+        "final_loss": losses[-1],
+        "threshold": threshold,
+        "train": gate_metrics(train_scores, train_labels, threshold),
+        "val": gate_metrics(val_scores, val_labels, threshold),
+        "operating_points": operating_points,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()